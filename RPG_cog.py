@@ -1,102 +1,188 @@
 # RPG_cog.py
 import discord
-from discord.ext import commands
-import random
+from discord.ext import commands, tasks
 import logging
 import asyncio
 import os
 import json
-from typing import Dict, Optional
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, Optional
 
 # 修正: BattleContinuationViewをインポート
-from rpg_data import init_database, SELL_PRICES, RARITY_PROBABILITIES, INVENTORY_LIMIT, DEVELOPER_ID, RARITY_ORDER, RARITY_WEIGHTS, TOTAL_RARITY_WEIGHT
-from rpg_views import EquipConfirmView, InventorySwapView, RerollSelectView, InventoryEmbedView, BattleView, GachaSelectView, BattleContinuationView
-from rpg_utils import transaction
+from rpg_data import (
+    init_database, SELL_PRICES, RARITY_PROBABILITIES, INVENTORY_LIMIT, DEVELOPER_ID, RARITY_ORDER, RARITY_WEIGHTS, TOTAL_RARITY_WEIGHT, XP_FLUSH_INTERVAL_SECONDS, ENEMY_RESCAN_INTERVAL_SECONDS,
+    BATTLE_LOG_TAIL, BATTLE_IDLE_TIMEOUT_SECONDS, BATTLE_REAPER_INTERVAL_SECONDS,
+    MAX_CONCURRENT_BATTLES, MAX_CONCURRENT_BATTLES_PER_GUILD, ROLE_GC_INTERVAL_SECONDS,
+    CONFIRM_TTL_SECONDS, ITEM_CHOICE_TTL_SECONDS, PENDING_ACTION_SWEEP_INTERVAL_SECONDS,
+    REROLL_CONSUME_COUNT, REROLL_MAX_ROUNDS, LEDGER_RETENTION_DAYS, LEDGER_COMPACT_INTERVAL_SECONDS, LEDGER_COMPACT_BATCH_ROWS,
+    LEADERBOARD_TOP_N
+)
+from rpg_views import EquipConfirmView, SellConfirmView, InventorySwapView, RerollSelectView, RerollAutoConfirmView, InventoryEmbedView, BattleView, GachaSelectView, BattleContinuationView, DropOverflowView
 from gacha_system import GachaSystem, GACHA_SETTINGS
+from rpg_xp_buffer import XPAccumulator
+from rpg_cache import UserProfileCache
+from rpg_locks import UserLockManager
+from rpg_enemies import EnemyRecord, EnemyRegistry, AttackAction, HealAction, AttackDebuffAction
+from rpg_render import MessageRenderer
+from rpg_battle_store import BattleStore, StoredBattle
+from rpg_selling import SellResult, TooManySellIdsError, plan_sale, plan_sale_below_rarity, settle_sale
+from rpg_roles import RoleManager
+from rpg_leaderboard import LEADERBOARD_METRICS, Leaderboards
+from rpg_ledger import LEDGER_SOURCES, apply_gold, compact_ledger, fetch_ledger, fetch_rollups
+from rpg_reroll import RerollError, execute_rerolls, fetch_consumables, fetch_reroll_target, roll_effect
+from rpg_drops import roll_drop, roll_drops, store_drops, settle_overflow, drop_from_ids
+from rpg_actions import PendingActionStore
+from rpg_router import ComponentRouter
+from rpg_inventory import EQUIP_IF_OWNED_SQL, InventoryFilter, SORT_ORDERS, DEFAULT_SORT, count_inventory, fetch_inventory_page
+from rpg_combat import (
+    CombatState, player_attack, player_defend, expire_enemy_buffs, choose_enemy_action, apply_enemy_action,
+    roll_gold_drop, player_max_hp
+)
 
 logger = logging.getLogger('SophiaBot.RPGCog')
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 ENEMY_DATA_PATH = os.path.join(SCRIPT_DIR, 'enemy')
+# battles.state の形式を変えたら上げる (古い形式の行は復元せずに捨てる)
+BATTLE_STATE_VERSION = 1
 
 class BattleSession:
-    def __init__(self, bot, interaction: discord.Interaction, player_stats: dict, enemy_data: dict, rpg_cog: 'RPG'):
+    # 同時に多数の戦闘が走るので属性は固定し、敵のデータはレジストリの EnemyRecord を共有する
+    __slots__ = (
+        "bot", "rpg_cog", "player_id", "guild_id", "player_name", "player_avatar_url",
+        "enemy", "combat", "battle_log", "current_turn", "is_battle_over",
+        "battle_message", "view_instance", "result_view", "renderer", "last_action_at",
+    )
+
+    # 敵の行動ごとのログの書式。{value} は rpg_combat.apply_enemy_action の戻り値。
+    _ENEMY_ACTION_LOG_FORMATS = {
+        AttackAction: "{message} {player}に {value} のダメージ！",
+        HealAction: "{message} HPが{value}回復！",
+        AttackDebuffAction: "{message} {player}に {value} のダメージ！{player}の防御力が下がったようだ...",
+    }
+
+    def __init__(self, bot, rpg_cog: 'RPG', player_id: int, guild_id: int, player_name: str,
+                 player_avatar_url: Optional[str], enemy: EnemyRecord, combat: CombatState):
         self.bot = bot
-        self.interaction = interaction
-        self.player_id = interaction.user.id
-        self.guild_id = interaction.guild.id
-        self.player_name = interaction.user.display_name
-        self.player_avatar_url = interaction.user.display_avatar.url
+        self.player_id = player_id
+        self.guild_id = guild_id
+        self.player_name = player_name
+        self.player_avatar_url = player_avatar_url
         self.rpg_cog = rpg_cog
 
-        self.player_hp = player_stats["hp"]
-        self.player_max_hp = player_stats["hp"]
-        self.player_atk = player_stats["atk"]
-        self.player_def = player_stats["def"]
-
-        self.enemy_name = enemy_data["name"]
-        self.enemy_hp = enemy_data["hp"]
-        self.enemy_max_hp = enemy_data["hp"]
-        self.enemy_atk = enemy_data["atk"]
-        self.enemy_def = enemy_data["def"]
-        self.enemy_image_url = enemy_data.get("image_url")
-        self.enemy_actions = enemy_data["actions"]
-        self.enemy_dialogues = enemy_data.get("dialogues", {})
-        
-        # --- 修正: gold_dropが単一の数値でもリストとして扱えるように修正 ---
-        raw_gold_drop = enemy_data.get("gold_drop", [0, 0])
-        if isinstance(raw_gold_drop, int):
-            # JSONで単一の数値が指定されている場合、[数値, 数値]のリストに変換
-            self.enemy_gold_drop = [raw_gold_drop, raw_gold_drop]
-        else:
-            # リスト形式、またはキーが存在しない場合はそのまま（デフォルト値を含む）
-            self.enemy_gold_drop = raw_gold_drop
-        # --- 修正ここまで ---
+        # HP・ATK・DEF・バフなどの数値は rpg_combat で計算する
+        self.combat = combat
 
-        self.battle_log = [f"野生の {self.enemy_name} が現れた！ {self.enemy_dialogues.get('encounter', '')}"]
+        # 読み込み済みの不変なレコードをそのまま参照する (コピーしない)
+        self.enemy = enemy
+
+        # 戦闘画面に表示する分だけ保持する
+        self.battle_log: Deque[str] = deque(maxlen=BATTLE_LOG_TAIL)
+        self.battle_log.append(f"野生の {enemy.name} が現れた！ {enemy.dialogues.get('encounter', '')}")
         self.current_turn = "player"
         self.is_battle_over = False
-        self.battle_message: Optional[discord.WebhookMessage] = None
-        self.view_instance: Optional[discord.ui.View] = None
+        # 送信後は PartialMessage (ID だけ) に置き換え、interaction や受信したメッセージ本体は保持しない
+        self.battle_message: Optional[discord.PartialMessage] = None
+        # 戦闘中は同じ BattleView を使い回し、ボタンの有効/無効だけ切り替える
+        self.view_instance: Optional[BattleView] = None
+        # 決着後に表示する View (連戦ボタンなど)
+        self.result_view: Optional[discord.ui.View] = None
+        self.renderer = MessageRenderer(self._render, on_message_lost=self._on_message_lost)
+        # 放置された戦闘の判定に使う (time.time())
+        self.last_action_at = time.time()
+
+    @property
+    def enemy_name(self) -> str:
+        return self.enemy.name
+
+    @classmethod
+    def from_interaction(cls, bot, rpg_cog: 'RPG', interaction: discord.Interaction, player_stats: dict,
+                         enemy: EnemyRecord) -> 'BattleSession':
+        combat = CombatState(player_stats["hp"], player_stats["atk"], player_stats["def"], enemy)
+        return cls(bot, rpg_cog, interaction.user.id, interaction.guild.id, interaction.user.display_name,
+                   interaction.user.display_avatar.url, enemy, combat)
+
+    @classmethod
+    def restore(cls, bot, rpg_cog: 'RPG', stored: StoredBattle, enemy: EnemyRecord) -> 'BattleSession':
+        """battles テーブルの行から戦闘を復元し、ボタンを押せるよう persistent view として登録する。"""
+        state = stored.state
+        if state.get("v") != BATTLE_STATE_VERSION:
+            raise ValueError(f"unsupported battle state version {state.get('v')!r}")
+        player_name, player_avatar_url = state["player"]
+        session = cls(bot, rpg_cog, stored.user_id, stored.guild_id, player_name, player_avatar_url,
+                      enemy, CombatState.from_list(state["combat"]))
+        session.battle_log.clear()
+        session.battle_log.extend(str(line) for line in state["log"])
+        session.last_action_at = stored.updated_at
+
+        session.battle_message = bot.get_partial_messageable(stored.channel_id).get_partial_message(stored.message_id)
+        # 再起動前の View のタイマーは引き継げないので、放置の判定は reap_idle_battles に任せる
+        session.view_instance = BattleView(session, timeout=None)
+        session.view_instance.message = session.battle_message
+        bot.add_view(session.view_instance, message_id=stored.message_id)
+        session.renderer.attach(session.battle_message)
+        return session
+
+    def to_state(self) -> dict:
+        return {
+            "v": BATTLE_STATE_VERSION,
+            "player": [self.player_name, self.player_avatar_url],
+            "combat": self.combat.to_list(),
+            "log": list(self.battle_log),
+        }
+
+    async def save_state(self):
+        """プレイヤーのターン開始時の状態を保存する。再起動するとここから再開する。"""
+        if self.is_battle_over or self.battle_message is None:
+            return
+        try:
+            await self.rpg_cog.battle_store.save(
+                self.player_id, self.guild_id, self.battle_message.channel.id, self.battle_message.id,
+                self.enemy.key, self.to_state())
+        except Exception as e:
+            logger.error(f"Failed to save battle state for user {self.player_id}: {e}", exc_info=True)
 
-        self.player_is_defending = False
-        self.enemy_current_def_buff = 0
-        self.enemy_atk_buff = 0
-        self.enemy_buff_durations = {}
+    async def _discard_state(self):
+        try:
+            await self.rpg_cog.battle_store.delete(self.player_id)
+        except Exception as e:
+            logger.error(f"Failed to delete battle state for user {self.player_id}: {e}", exc_info=True)
 
-    async def start_battle(self):
-        logger.info(f"Battle started: {self.player_name} vs {self.enemy_name} in guild {self.guild_id}")
-        embed = self._create_battle_embed()
+    async def start_battle(self, interaction: discord.Interaction):
+        logger.info(f"Battle started: {self.player_name} vs {self.enemy.name} in guild {self.guild_id}")
         self.view_instance = BattleView(self)
+        embed, view = self._render()
         try:
             # 「考え中」メッセージを編集して戦闘画面を表示
-            self.battle_message = await self.interaction.edit_original_response(content=None, embed=embed, view=self.view_instance)
+            sent_message = await interaction.edit_original_response(content=None, embed=embed, view=view)
         except discord.NotFound:
             logger.warning("Original interaction message not found in start_battle. Sending new message.")
-            self.battle_message = await self.interaction.channel.send(embed=embed, view=self.view_instance)
+            sent_message = await interaction.channel.send(embed=embed, view=view)
+        self.battle_message = self.bot.get_partial_messageable(sent_message.channel.id).get_partial_message(sent_message.id)
 
-        if self.view_instance and hasattr(self.view_instance, 'message'):
-            self.view_instance.message = self.battle_message
+        self.view_instance.message = self.battle_message
+        self.renderer.attach(self.battle_message, embed, view)
+        await self.save_state()
 
     def _create_battle_embed(self):
-        embed = discord.Embed(title=f"{self.player_name} VS {self.enemy_name}", color=discord.Color.red())
+        embed = discord.Embed(title=f"{self.player_name} VS {self.enemy.name}", color=discord.Color.red())
         if self.player_avatar_url:
             embed.set_author(name=self.player_name, icon_url=self.player_avatar_url)
-        if self.enemy_image_url:
-            embed.set_thumbnail(url=self.enemy_image_url)
+        if self.enemy.image_url:
+            embed.set_thumbnail(url=self.enemy.image_url)
 
-        embed.add_field(name=f"{self.player_name} (あなた)", value=f"HP: {self.player_hp}/{self.player_max_hp}\nATK: {self.player_atk} | DEF: {self.player_def}", inline=True)
-        embed.add_field(name=self.enemy_name, value=f"HP: {self.enemy_hp}/{self.enemy_max_hp}\nATK: {self.enemy_atk} | DEF: {self.enemy_def}", inline=True)
+        embed.add_field(name=f"{self.player_name} (あなた)", value=f"HP: {self.combat.player_hp}/{self.combat.player_max_hp}\nATK: {self.combat.player_atk} | DEF: {self.combat.player_def}", inline=True)
+        embed.add_field(name=self.enemy.name, value=f"HP: {self.combat.enemy_hp}/{self.combat.enemy_max_hp}\nATK: {self.combat.enemy_atk} | DEF: {self.combat.enemy_def}", inline=True)
 
-        log_to_display = self.battle_log[-7:]
-        embed.add_field(name="バトルログ", value=">>> " + "\n".join(log_to_display) if log_to_display else "戦闘開始！", inline=False)
+        embed.add_field(name="バトルログ", value=">>> " + "\n".join(self.battle_log) if self.battle_log else "戦闘開始！", inline=False)
 
         if self.is_battle_over:
-            if self.player_hp <= 0:
-                embed.description = f"**{self.player_name}は倒れてしまった...**\n{self.enemy_dialogues.get('player_lose', 'あなたの負けだ...')}"
+            if self.combat.player_hp <= 0:
+                embed.description = f"**{self.player_name}は倒れてしまった...**\n{self.enemy.dialogues.get('player_lose', 'あなたの負けだ...')}"
                 embed.color = discord.Color.dark_grey()
-            elif self.enemy_hp <= 0:
-                embed.description = f"**{self.enemy_name}を倒した！**\n{self.enemy_dialogues.get('player_win', 'あなたの勝利だ！')}"
+            elif self.combat.enemy_hp <= 0:
+                embed.description = f"**{self.enemy.name}を倒した！**\n{self.enemy.dialogues.get('player_win', 'あなたの勝利だ！')}"
                 embed.color = discord.Color.green()
             else:
                 embed.description = f"**戦闘終了** - {self.battle_log[-1] if self.battle_log else ''}"
@@ -104,33 +190,63 @@ class BattleSession:
         elif self.current_turn == "player":
             embed.set_footer(text="あなたのターンです。行動を選択してください。")
         else:
-            embed.set_footer(text=f"{self.enemy_name}のターンです...")
+            embed.set_footer(text=f"{self.enemy.name}のターンです...")
         return embed
 
-    async def update_battle_message(self, view_override: Optional[discord.ui.View] = None):
-        if self.battle_message:
-            embed = self._create_battle_embed()
-            view_to_set = None
-
-            if view_override is not None:
-                view_to_set = view_override
-            elif not self.is_battle_over:
-                self.view_instance = BattleView(self)
-                if hasattr(self.view_instance, 'message'):
-                    self.view_instance.message = self.battle_message
-                view_to_set = self.view_instance
-
-            if self.is_battle_over and self.view_instance and view_override is None:
-                 if hasattr(self.view_instance, 'stop'):
-                    self.view_instance.stop()
-
+    def _render(self):
+        embed = self._create_battle_embed()
+        if self.result_view is not None:
+            return embed, self.result_view
+        if self.is_battle_over or self.view_instance is None:
+            return embed, None
+        self.view_instance.sync_buttons()
+        return embed, self.view_instance
+
+    def _on_message_lost(self):
+        self.is_battle_over = True
+
+    def update_battle_message(self):
+        """戦闘画面の再描画を予約する。実際の編集は renderer がまとめて行う。"""
+        self.renderer.request()
+
+    async def _finish_battle(self):
+        """決着 (勝利・敗北・逃走) 後に連戦ボタンを表示し、進行中の戦闘から外す。"""
+        self.is_battle_over = True
+        if self.view_instance is not None:
+            self.view_instance.stop()
+        self.result_view = BattleContinuationView(self.player_id)
+        self.update_battle_message()
+        await self.renderer.flush()
+
+        if self.rpg_cog and self.player_id in self.rpg_cog.active_battles:
+            del self.rpg_cog.active_battles[self.player_id]
+        await self._discard_state()
+
+    async def expire(self):
+        """放置された戦闘を時間切れとして終了する。"""
+        if self.is_battle_over:
+            return
+        self.is_battle_over = True
+        self.battle_log.append(f"{self.player_name}は時間切れで行動できなかった...")
+        # 予約中の再描画でタイムアウト表示が上書きされないようにする
+        self.renderer.close()
+        if self.view_instance is not None:
+            self.view_instance.stop()
+        if self.battle_message is not None:
             try:
-                await self.battle_message.edit(embed=embed, view=view_to_set)
+                timeout_embed = self._create_battle_embed()
+                timeout_embed.description = "時間切れで戦闘が終了しました。"
+                timeout_embed.color = discord.Color.light_grey()
+                await self.battle_message.edit(embed=timeout_embed, view=None)
             except discord.errors.NotFound:
-                logger.warning(f"Battle message (ID: {self.battle_message.id}) not found. Cannot update.")
-                self.is_battle_over = True
+                logger.warning(f"Battle timeout: Message (ID: {self.battle_message.id}) not found.")
             except Exception as e:
-                logger.error(f"Error updating battle message: {e}", exc_info=True)
+                logger.error(f"Battle timeout: Error editing message: {e}", exc_info=True)
+
+        if self.rpg_cog and self.rpg_cog.active_battles.get(self.player_id) is self:
+            del self.rpg_cog.active_battles[self.player_id]
+            logger.info(f"Battle session for {self.player_id} removed from active_battles due to timeout.")
+        await self._discard_state()
 
 
     async def player_action(self, action_type: str, interaction_for_action: discord.Interaction):
@@ -139,53 +255,45 @@ class BattleSession:
             return
 
         log_message = ""
-        self.player_is_defending = False
+        self.last_action_at = time.time()
+        self.combat.player_is_defending = False
 
         if action_type == "attack":
-            actual_enemy_def = self.enemy_def + self.enemy_current_def_buff
-            damage_dealt = max(1, self.player_atk - actual_enemy_def)
-            self.enemy_hp = max(0, self.enemy_hp - damage_dealt)
-            log_message = f"{self.player_name}の攻撃！ {self.enemy_name}に {damage_dealt} のダメージ！ {self.enemy_dialogues.get('player_attack', '')}"
+            damage_dealt = player_attack(self.combat)
+            log_message = f"{self.player_name}の攻撃！ {self.enemy.name}に {damage_dealt} のダメージ！ {self.enemy.dialogues.get('player_attack', '')}"
         elif action_type == "defend":
-            heal_amount = round(self.player_def * 0.25)
-            self.player_hp = min(self.player_max_hp, self.player_hp + heal_amount)
+            heal_amount = player_defend(self.combat)
             log_message = f"{self.player_name}は防御に専念し、HPを {heal_amount} 回復した！"
-            self.player_is_defending = True
         elif action_type == "flee":
             self.is_battle_over = True
-            log_message = f"{self.player_name}は戦闘から逃げ出した...！ {self.enemy_dialogues.get('player_flee', '')}"
+            log_message = f"{self.player_name}は戦闘から逃げ出した...！ {self.enemy.dialogues.get('player_flee', '')}"
             self.battle_log.append(log_message)
-            continuation_view = BattleContinuationView(self.rpg_cog, self.player_id)
-            continuation_view.message = self.battle_message
-            await self.update_battle_message(view_override=continuation_view)
-            if self.rpg_cog and self.player_id in self.rpg_cog.active_battles:
-                del self.rpg_cog.active_battles[self.player_id]
+            await self._finish_battle()
             return
 
         self.battle_log.append(log_message)
 
-        if self.enemy_hp <= 0:
+        if self.combat.enemy_hp <= 0:
             self.is_battle_over = True
-            dropped_gold = random.randint(self.enemy_gold_drop[0], self.enemy_gold_drop[1])
+            dropped_gold = roll_gold_drop(self.enemy.gold_drop)
             if dropped_gold > 0:
                 try:
-                    async with transaction(self.bot.db):
-                        await self.bot.db.execute("UPDATE users SET gold = gold + ? WHERE user_id = ? AND guild_id = ?",
-                                                  (dropped_gold, self.player_id, self.guild_id))
-                    self.battle_log.append(f"{self.enemy_name}は {dropped_gold} ゴールドをドロップした！")
+                    async with self.rpg_cog.user_locks.hold(self.player_id, self.guild_id):
+                        async with self.bot.db.write() as conn:
+                            await apply_gold(conn, self.player_id, self.guild_id, dropped_gold, "battle", (self.enemy.key,))
+                            # 再起動で同じ戦闘が復元され、ゴールドを二重に受け取らないよう同じトランザクションで消す
+                            await self.rpg_cog.battle_store.delete(self.player_id, conn)
+                        self.rpg_cog.profile_cache.adjust_gold(self.player_id, self.guild_id, dropped_gold)
+                    self.battle_log.append(f"{self.enemy.name}は {dropped_gold} ゴールドをドロップした！")
                 except Exception as e:
+                    self.rpg_cog.profile_cache.invalidate(self.player_id, self.guild_id)
                     logger.error(f"Failed to add gold after battle for user {self.player_id}: {e}", exc_info=True)
 
-            continuation_view = BattleContinuationView(self.rpg_cog, self.player_id)
-            continuation_view.message = self.battle_message
-            await self.update_battle_message(view_override=continuation_view)
-            
-            if self.rpg_cog and self.player_id in self.rpg_cog.active_battles:
-                del self.rpg_cog.active_battles[self.player_id]
+            await self._finish_battle()
             return
 
         self.current_turn = "enemy"
-        await self.update_battle_message()
+        self.update_battle_message()
         await asyncio.sleep(1.5)
         await self.enemy_turn()
 
@@ -193,61 +301,25 @@ class BattleSession:
         if self.current_turn != "enemy" or self.is_battle_over:
             return
 
-        for buff_key in list(self.enemy_buff_durations.keys()):
-            self.enemy_buff_durations[buff_key] -= 1
-            if self.enemy_buff_durations[buff_key] <= 0:
-                if buff_key == "defense_buff": self.enemy_current_def_buff = 0
-                elif buff_key == "atk_buff": self.enemy_atk_buff = 0
-                self.battle_log.append(f"{self.enemy_name}の{buff_key.replace('_buff','')}効果が切れた。")
-                del self.enemy_buff_durations[buff_key]
+        for buff_key in expire_enemy_buffs(self.combat):
+            self.battle_log.append(f"{self.enemy.name}の{buff_key.replace('_buff','')}効果が切れた。")
 
-        action = random.choice(self.enemy_actions)
-        log_message = ""
-        enemy_turn_action_message = action.get("message", "{enemy_name}の行動！").format(enemy_name=self.enemy_name)
-
-        if action["type"] == "attack":
-            effective_enemy_atk = self.enemy_atk + self.enemy_atk_buff
-            damage_to_player = max(1, round(effective_enemy_atk * action.get("damage_multiplier", 1.0)) - self.player_def)
-            if self.player_is_defending:
-                damage_to_player = max(0, damage_to_player // 2)
-            self.player_hp = max(0, self.player_hp - damage_to_player)
-            log_message = f"{enemy_turn_action_message} {self.player_name}に {damage_to_player} のダメージ！"
-        elif action["type"] == "defense_buff":
-            self.enemy_current_def_buff = action.get("defense_increase", 0)
-            self.enemy_buff_durations["defense_buff"] = action.get("duration", 1) + 1
-            log_message = enemy_turn_action_message
-        elif action["type"] == "heal":
-            heal_amount = action.get("amount", 0)
-            self.enemy_hp = min(self.enemy_max_hp, self.enemy_hp + heal_amount)
-            log_message = enemy_turn_action_message + f" HPが{heal_amount}回復！"
-        elif action["type"] == "buff_self_atk":
-            self.enemy_atk_buff += action.get("atk_increase", 0)
-            self.enemy_buff_durations["atk_buff"] = action.get("duration", 1) + 1
-            log_message = enemy_turn_action_message
-        elif action["type"] == "attack_debuff_target_def":
-            effective_enemy_atk = self.enemy_atk + self.enemy_atk_buff
-            damage_to_player = max(1, round(effective_enemy_atk * action.get("damage_multiplier", 0.5)) - self.player_def)
-            self.player_hp = max(0, self.player_hp - damage_to_player)
-            log_message = f"{enemy_turn_action_message} {self.player_name}に {damage_to_player} のダメージ！{self.player_name}の防御力が下がったようだ..."
-        elif action["type"] == "nothing":
-            log_message = enemy_turn_action_message
-        else:
-            log_message = f"{self.enemy_name}は不思議な行動をとった！ ({action.get('name', '不明な技')})"
+        action = choose_enemy_action(self.enemy.actions)
+        value = apply_enemy_action(self.combat, action)
+        log_message = self._ENEMY_ACTION_LOG_FORMATS.get(type(action), "{message}").format(
+            message=action.message, player=self.player_name, value=value
+        )
 
         self.battle_log.append(log_message)
 
-        if self.player_hp <= 0:
-            self.is_battle_over = True
-            continuation_view = BattleContinuationView(self.rpg_cog, self.player_id)
-            continuation_view.message = self.battle_message
-            await self.update_battle_message(view_override=continuation_view)
-            
-            if self.rpg_cog and self.player_id in self.rpg_cog.active_battles:
-                del self.rpg_cog.active_battles[self.player_id]
+        if self.combat.player_hp <= 0:
+            await self._finish_battle()
             return
 
         self.current_turn = "player"
-        await self.update_battle_message()
+        self.update_battle_message()
+        await self.save_state()
+
 
 class RPG(commands.Cog):
     def __init__(self, bot):
@@ -262,10 +334,25 @@ class RPG(commands.Cog):
         self.active_battles: Dict[int, BattleSession] = {}
         self.gacha_system = GachaSystem(bot, self)
         self.gacha_settings = GACHA_SETTINGS
+        self.xp_buffer = XPAccumulator(bot)
+        self.profile_cache = UserProfileCache(bot, self.xp_buffer)
+        self.xp_buffer.profile_cache = self.profile_cache
+        self.leaderboards = Leaderboards(bot, self.xp_buffer)
+        self.xp_buffer.leaderboards = self.leaderboards
+        self.profile_cache.leaderboards = self.leaderboards
+        self.user_locks = UserLockManager()
+        self.enemy_registry = EnemyRegistry(ENEMY_DATA_PATH)
+        self.battle_store = BattleStore(bot.db)
+        # 監視用のカウンター: reaped (放置・取り残しで終了させた数) / rejected (上限で断った数)
+        self.battle_counters: Counter = Counter()
+        self.role_manager = RoleManager(bot)
+        self.pending_actions = PendingActionStore(bot.db)
+        self.component_router = ComponentRouter(self)
 
 
     async def cog_load(self):
         await init_database(self.bot.db)
+        self.flush_xp_buffer.start()
         if not os.path.exists(ENEMY_DATA_PATH):
             try:
                 os.makedirs(ENEMY_DATA_PATH)
@@ -293,6 +380,177 @@ class RPG(commands.Cog):
                 logger.info("Created a sample enemy file: test_slime.json")
             except Exception as e:
                 logger.error(f"Could not create enemy directory or sample file: {e}", exc_info=True)
+        await asyncio.to_thread(self.enemy_registry.scan)
+        self.rescan_enemy_registry.start()
+        await self.restore_battles()
+        self.reap_idle_battles.start()
+        self.collect_orphan_roles.start()
+        self.sweep_pending_actions.start()
+        self.compact_economy_ledger.start()
+
+    async def cog_unload(self):
+        self.flush_xp_buffer.cancel()
+        self.rescan_enemy_registry.cancel()
+        self.reap_idle_battles.cancel()
+        self.collect_orphan_roles.cancel()
+        self.sweep_pending_actions.cancel()
+        self.compact_economy_ledger.cancel()
+        await self.xp_buffer.flush()
+        await self.role_manager.flush()
+
+    @tasks.loop(seconds=ENEMY_RESCAN_INTERVAL_SECONDS)
+    async def rescan_enemy_registry(self):
+        # 追加・更新された敵データを再起動なしで反映する
+        try:
+            await asyncio.to_thread(self.enemy_registry.rescan_if_changed)
+        except Exception as e:
+            logger.error(f"Failed to rescan enemy data: {e}", exc_info=True)
+
+    async def restore_battles(self):
+        """再起動前に進行中だった戦闘を battles テーブルから復元する。"""
+        try:
+            stored_battles = await self.battle_store.load_all()
+        except Exception as e:
+            logger.error(f"Failed to load saved battles: {e}", exc_info=True)
+            return
+
+        restored = 0
+        for stored in stored_battles:
+            enemy = self.enemy_registry.get(stored.enemy_key)
+            try:
+                if enemy is None:
+                    raise ValueError(f"unknown enemy {stored.enemy_key!r}")
+                session = BattleSession.restore(self.bot, self, stored, enemy)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Discarding saved battle for user {stored.user_id}: {e}")
+                await self.battle_store.delete(stored.user_id)
+                continue
+            self.active_battles[stored.user_id] = session
+            # 再起動前の表示と揃えるため、ボタンを付け直して再描画する
+            session.update_battle_message()
+            restored += 1
+        if stored_battles:
+            logger.info(f"Restored {restored}/{len(stored_battles)} saved battles.")
+
+    @tasks.loop(seconds=BATTLE_REAPER_INTERVAL_SECONDS)
+    async def reap_idle_battles(self):
+        """
+        放置された戦闘と、決着済みなのに active_battles に残った戦闘を取り除く。
+        active_battles に残っているユーザーは経験値が入らないため、取り残しはここで必ず回収する。
+        """
+        deadline = time.time() - BATTLE_IDLE_TIMEOUT_SECONDS
+        reaped = 0
+        for user_id, session in list(self.active_battles.items()):
+            try:
+                if session.is_battle_over:
+                    if self.active_battles.get(user_id) is session:
+                        del self.active_battles[user_id]
+                    await self.battle_store.delete(user_id)
+                elif session.last_action_at < deadline:
+                    await session.expire()
+                else:
+                    continue
+                reaped += 1
+            except Exception as e:
+                logger.error(f"Failed to reap battle for user {user_id}: {e}", exc_info=True)
+        if reaped:
+            self.battle_counters["reaped"] += reaped
+            logger.info(f"Reaped {reaped} idle battles ({len(self.active_battles)} active).")
+        try:
+            await self.battle_store.purge()
+        except Exception as e:
+            logger.error(f"Failed to purge saved battles: {e}", exc_info=True)
+
+    def battle_stats(self) -> Dict[str, int]:
+        return {
+            "active": len(self.active_battles),
+            "reaped": self.battle_counters["reaped"],
+            "rejected": self.battle_counters["rejected"],
+        }
+
+    def _battle_capacity_error(self, guild_id: int) -> Optional[str]:
+        """同時戦闘数の上限に達していれば、ユーザーに見せる断りのメッセージを返す。"""
+        if len(self.active_battles) >= MAX_CONCURRENT_BATTLES:
+            reason = "今はたくさんの戦闘が行われていて、これ以上始められないみたい…！少し待ってからもう一度試してね。"
+        elif sum(1 for s in self.active_battles.values() if s.guild_id == guild_id) >= MAX_CONCURRENT_BATTLES_PER_GUILD:
+            reason = "このサーバーでは今たくさんの戦闘が行われているよ！誰かの戦闘が終わるまで少し待ってね。"
+        else:
+            return None
+        self.battle_counters["rejected"] += 1
+        logger.warning(f"Battle rejected in guild {guild_id}: {self.battle_stats()}")
+        return reason
+
+    @tasks.loop(seconds=XP_FLUSH_INTERVAL_SECONDS)
+    async def flush_xp_buffer(self):
+        await self.xp_buffer.flush()
+
+    @tasks.loop(seconds=ROLE_GC_INTERVAL_SECONDS)
+    async def collect_orphan_roles(self):
+        try:
+            await self.role_manager.collect_orphan_roles()
+        except Exception as e:
+            logger.error(f"Failed to collect unused equipment roles: {e}", exc_info=True)
+
+    @collect_orphan_roles.before_loop
+    async def before_collect_orphan_roles(self):
+        # role.members を見るので、メンバーのキャッシュが揃うまで待つ
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(seconds=PENDING_ACTION_SWEEP_INTERVAL_SECONDS)
+    async def sweep_pending_actions(self):
+        """期限切れの保留中の操作を消す。入りきらなかったドロップは時間切れで売却する。"""
+        try:
+            await self.pending_actions.delete_expired(keep_kinds=("drop_overflow",))
+            expired_overflows = await self.pending_actions.fetch_expired("drop_overflow")
+        except Exception as e:
+            logger.error(f"Failed to sweep pending actions: {e}", exc_info=True)
+            return
+        for action in expired_overflows:
+            try:
+                await self._expire_drop_overflow(action.token, action.user_id, action.guild_id)
+            except Exception as e:
+                logger.error(f"Failed to expire overflow drops for user {action.user_id}: {e}", exc_info=True)
+
+    @tasks.loop(seconds=LEDGER_COMPACT_INTERVAL_SECONDS)
+    async def compact_economy_ledger(self):
+        """保存期間を過ぎた台帳の記録を日ごとの集計に移す。1回のトランザクションは LEDGER_COMPACT_BATCH_ROWS 件まで。"""
+        before = time.time() - LEDGER_RETENTION_DAYS * 24 * 60 * 60
+        moved = 0
+        try:
+            while True:
+                async with self.bot.db.write() as conn:
+                    count = await compact_ledger(conn, before)
+                moved += count
+                if count < LEDGER_COMPACT_BATCH_ROWS:
+                    break
+                # 他の書き込みを待たせ続けないよう、バッチの間で一度譲る
+                await asyncio.sleep(0)
+        except Exception as e:
+            logger.error(f"Failed to compact economy ledger: {e}", exc_info=True)
+        if moved:
+            logger.info(f"Compacted {moved} economy ledger entries older than {LEDGER_RETENTION_DAYS} days.")
+
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction: discord.Interaction):
+        # RPG のボタン・セレクト (custom_id が rpg: で始まるもの) はすべてここで受ける
+        await self.component_router.dispatch(interaction)
+
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role: discord.Role):
+        self.role_manager.on_role_create(role)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self.role_manager.on_role_delete(role)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        self.role_manager.on_role_update(before, after)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.role_manager.forget_guild(guild.id)
+        self.leaderboards.forget_guild(guild.id)
 
 
     @commands.Cog.listener()
@@ -305,32 +563,10 @@ class RPG(commands.Cog):
         user_id = message.author.id
         guild_id = message.guild.id
 
-        async with self.bot.db.execute("SELECT total_characters, level FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
-            row = await cursor.fetchone()
-
-        if row:
-            old_total_chars, old_level = row[0], row[1]
-        else:
-            old_total_chars, old_level = 0, 0
-            try:
-                async with transaction(self.bot.db):
-                    await self.bot.db.execute("INSERT INTO users (user_id, guild_id, total_characters, level, gold) VALUES (?, ?, ?, ?, ?)",
-                                              (user_id, guild_id, 0, 0, 0))
-            except Exception as e:
-                logger.error(f"Failed to register new user {user_id} in guild {guild_id}: {e}", exc_info=True)
-                return
-
-        new_total_chars = old_total_chars + len(message.content)
-        chars_per_level = 250
-        new_level = new_total_chars // chars_per_level
-
-        try:
-            async with transaction(self.bot.db):
-                await self.bot.db.execute("UPDATE users SET total_characters = ?, level = ? WHERE user_id = ? AND guild_id = ?",
-                                          (new_total_chars, new_level, user_id, guild_id))
-        except Exception as e:
-            logger.error(f"Failed to update user {user_id} stats in guild {guild_id}: {e}", exc_info=True)
+        level_change = await self.xp_buffer.add_characters(user_id, guild_id, len(message.content))
+        if level_change is None:
             return
+        old_level, new_level = level_change
 
         if new_level > old_level:
             leveled_up_by = new_level - old_level
@@ -338,37 +574,38 @@ class RPG(commands.Cog):
             level_up_embed = discord.Embed(title="レベルアップ！", description=level_up_embed_description, color=discord.Color.gold())
             level_up_embed.set_thumbnail(url=message.author.display_avatar.url)
 
+            if leveled_up_by > 1:
+                await self._handle_bulk_level_up(message, level_up_embed, leveled_up_by)
+                return
+
             items_dropped_for_embed = []
             choice_payload = None
 
-            for i in range(leveled_up_by):
-                logger.info(f"Level up drop attempt {i+1}/{leveled_up_by} for user {user_id}")
-                drop_result = await self.drop_item(
-                    user_id, guild_id, message.channel,
-                    message.author.id, message.author.display_name, message.author.display_avatar.url
-                )
+            drop_result = await self.drop_item(
+                user_id, guild_id, message.channel,
+                message.author.id, message.author.display_name, message.author.display_avatar.url
+            )
 
-                if isinstance(drop_result, dict):
-                    choice_payload = drop_result
-                    view: InventorySwapView = choice_payload['view']
-                    full_item_name = view.new_full_item_name
-                    item_type_display = view.new_item_type_display
-                    base_item_rarity = view.new_item_base_rarity
-                    effect_rarity = view.new_effect_rarity
-
-                    prob_item = (self.rarity_weights.get(base_item_rarity, 0) / self.total_rarity_weight) if self.total_rarity_weight > 0 else 0
-                    prob_effect = (self.rarity_weights.get(effect_rarity, 0) / self.total_rarity_weight) if self.total_rarity_weight > 0 else 0
-                    combined_prob_percent = prob_item * prob_effect * 100
-
-                    items_dropped_for_embed.append(
-                        f"**{full_item_name}** ({item_type_display})\n"
-                        f"　┣ 装備レアリティ: {base_item_rarity} ({self.rarity_probabilities.get(base_item_rarity, 'N/A')})\n"
-                        f"　┣ 効果レアリティ: {effect_rarity} ({self.rarity_probabilities.get(effect_rarity, 'N/A')})\n"
-                        f"　┗ 組み合わせ出現率: {combined_prob_percent:.3f}%"
-                    )
-                    break
-                elif drop_result is None:
-                    logger.warning(f"Drop attempt {i+1}/{leveled_up_by} for user {user_id} resulted in None (no item or error).")
+            if isinstance(drop_result, dict):
+                choice_payload = drop_result
+                drop = choice_payload['drop']
+                full_item_name = drop.full_name
+                item_type_display = drop.item_type_display
+                base_item_rarity = drop.item.rarity
+                effect_rarity = drop.effect.rarity
+
+                prob_item = (self.rarity_weights.get(base_item_rarity, 0) / self.total_rarity_weight) if self.total_rarity_weight > 0 else 0
+                prob_effect = (self.rarity_weights.get(effect_rarity, 0) / self.total_rarity_weight) if self.total_rarity_weight > 0 else 0
+                combined_prob_percent = prob_item * prob_effect * 100
+
+                items_dropped_for_embed.append(
+                    f"**{full_item_name}** ({item_type_display})\n"
+                    f"　┣ 装備レアリティ: {base_item_rarity} ({self.rarity_probabilities.get(base_item_rarity, 'N/A')})\n"
+                    f"　┣ 効果レアリティ: {effect_rarity} ({self.rarity_probabilities.get(effect_rarity, 'N/A')})\n"
+                    f"　┗ 組み合わせ出現率: {combined_prob_percent:.3f}%"
+                )
+            elif drop_result is None:
+                logger.warning(f"Drop attempt for user {user_id} resulted in None (no item or error).")
 
             if items_dropped_for_embed:
                 level_up_embed.add_field(name="獲得アイテム候補", value="\n\n".join(items_dropped_for_embed), inline=False)
@@ -376,100 +613,196 @@ class RPG(commands.Cog):
             if choice_payload:
                 current_description = level_up_embed.description or ""
                 level_up_embed.description = f"{current_description}\n新しいアイテムをどうするか選択肢が表示されています。"
-            elif not items_dropped_for_embed and leveled_up_by > 0 :
+            elif not items_dropped_for_embed:
                  level_up_embed.add_field(name="獲得アイテム", value="今回は新しいアイテムを見つけられなかった...", inline=False)
 
 
             try:
                 level_up_message = await message.channel.send(embed=level_up_embed)
                 if choice_payload:
-                    choice_embed = choice_payload['embed']
-                    choice_view: InventorySwapView = choice_payload['view']
-                    choice_view.level_up_message_to_delete = level_up_message
-                    message_with_view = await message.channel.send(embed=choice_embed, view=choice_view)
-                    choice_view.message_with_view = message_with_view
+                    drop = choice_payload['drop']
+                    token = await self.pending_actions.create(
+                        "drop", user_id, guild_id,
+                        {"item_id": drop.item.item_id, "effect_id": drop.effect.effect_id, "level_up_message_id": level_up_message.id},
+                        ITEM_CHOICE_TTL_SECONDS)
+                    choice_view = InventorySwapView(user_id, token, drop, choice_payload['is_inventory_full'])
+                    await message.channel.send(embed=choice_payload['embed'], view=choice_view)
             except discord.Forbidden:
                 logger.warning(f"Missing permissions to send level up message in {message.channel.name} (guild {guild_id}).")
             except Exception as e:
                 logger.error(f"Error sending level up message for user {user_id} in guild {guild_id}: {e}", exc_info=True)
 
-    async def _get_item_stats_from_db(self, base_item_id: int, effect_id: int):
-        """Helper to get combined stats of a base item and an effect."""
-        async with self.bot.db.execute("SELECT base_attack, base_defense FROM items WHERE item_id = ?", (base_item_id,)) as cur_item:
-            item_stats_row = await cur_item.fetchone()
-        async with self.bot.db.execute("SELECT attack_bonus, defense_bonus FROM effects WHERE effect_id = ?", (effect_id,)) as cur_effect:
-            effect_stats_row = await cur_effect.fetchone()
+    @staticmethod
+    def _format_drop_lines(drops, limit: int = 1020) -> str:
+        text = ""
+        for i, drop in enumerate(drops):
+            line = f"・{drop.describe()}"
+            if len(text) + len(line) + 1 > limit - 20:
+                text += f"\n...他{len(drops) - i}件"
+                break
+            text = f"{text}\n{line}" if text else line
+        return text or "なし"
+
+    async def _handle_bulk_level_up(self, message: discord.Message, level_up_embed: discord.Embed, leveled_up_by: int):
+        """
+        一度に複数レベル上がったときのドロップ。全レベル分をメモリ上で抽選し、空き枠に入る分は
+        1回のトランザクションで追加する。入りきらなかった分は DropOverflowView でまとめて取得/売却を選ばせる。
+        """
+        user_id = message.author.id
+        guild_id = message.guild.id
+        drops = roll_drops(leveled_up_by)
+        logger.info(f"Level up x{leveled_up_by} for user {user_id}: rolled {len(drops)} drops.")
+
+        stored, overflow = [], []
+        if drops:
+            try:
+                async with self.user_locks.hold(user_id, guild_id):
+                    async with self.bot.db.write() as conn:
+                        stored, overflow = await store_drops(conn, user_id, guild_id, drops, self.inventory_limit)
+            except Exception as e:
+                logger.error(f"Failed to store level up drops for user {user_id} in guild {guild_id}: {e}", exc_info=True)
+                stored, overflow = [], drops
+
+        if stored:
+            level_up_embed.add_field(name=f"インベントリに追加 ({len(stored)}件)", value=self._format_drop_lines(stored), inline=False)
+        if overflow:
+            level_up_embed.add_field(name=f"インベントリに入りきらなかったアイテム ({len(overflow)}件)", value=self._format_drop_lines(overflow), inline=False)
+            level_up_embed.description = f"{level_up_embed.description}\n入りきらなかったアイテムをどうするか選択肢が表示されています。"
+        if not drops:
+            level_up_embed.add_field(name="獲得アイテム", value="今回は新しいアイテムを見つけられなかった...", inline=False)
 
-        if item_stats_row and effect_stats_row:
-            return {
-                "base_attack": item_stats_row[0], "base_defense": item_stats_row[1],
-                "effect_attack_bonus": effect_stats_row[0], "effect_defense_bonus": effect_stats_row[1]
-            }
-        logger.warning(f"Could not retrieve full stats for base_item_id: {base_item_id} or effect_id: {effect_id}")
-        return {"base_attack": 0, "base_defense": 0, "effect_attack_bonus": 0, "effect_defense_bonus": 0}
+        try:
+            await message.channel.send(embed=level_up_embed)
+            if overflow:
+                token = await self.pending_actions.create(
+                    "drop_overflow", user_id, guild_id,
+                    {"drops": [[drop.item.item_id, drop.effect.effect_id] for drop in overflow], "keep": []},
+                    ITEM_CHOICE_TTL_SECONDS)
+                view = DropOverflowView(user_id, token, overflow)
+                choice_embed = discord.Embed(
+                    title="インベントリが上限です！",
+                    description=(
+                        f"インベントリが一杯（{self.inventory_limit}個）のため、{len(overflow)}件のアイテムが入りきりませんでした。\n"
+                        f"取得したいアイテムを選んで「決定」を押してください。選ばなかったものは売却されます。\n\n"
+                        f"このメッセージへの操作は <@{user_id}> さんのみ可能です。"
+                    ),
+                    color=discord.Color.orange()
+                )
+                choice_embed.set_thumbnail(url=message.author.display_avatar.url)
+                choice_embed.set_footer(text="選択肢のタイムアウトは2分です。時間切れの場合はすべて売却されます。")
+                choice_message = await message.channel.send(embed=choice_embed, view=view)
+                # 時間切れで売却したときにこのメッセージを書き換えられるよう、送信先を覚えておく
+                action = await self.pending_actions.get(token, "drop_overflow")
+                if action is not None:
+                    await self.pending_actions.update_payload(token, "drop_overflow", dict(
+                        action.payload, channel_id=choice_message.channel.id, message_id=choice_message.id))
+        except discord.Forbidden:
+            logger.warning(f"Missing permissions to send level up message in {message.channel.name} (guild {guild_id}).")
+        except Exception as e:
+            logger.error(f"Error sending level up message for user {user_id} in guild {guild_id}: {e}", exc_info=True)
+
+    async def resolve_drop_overflow(self, user_id: int, guild_id: int, token: int, sell_all: bool) -> Optional[discord.Embed]:
+        """DropOverflowView の決定を反映し、結果の embed を返す。既に処理済み・期限切れなら None。"""
+        async with self.user_locks.hold(user_id, guild_id):
+            try:
+                async with self.bot.db.write() as conn:
+                    action = await self.pending_actions.claim(token, "drop_overflow", conn)
+                    if action is None:
+                        return None
+                    drops = [drop for drop in (drop_from_ids(*ids) for ids in action.payload["drops"]) if drop is not None]
+                    keep_indices = [] if sell_all else action.payload.get("keep", [])
+                    stored, sold = await settle_overflow(conn, user_id, guild_id, drops, keep_indices, self.inventory_limit)
+            except Exception:
+                self.profile_cache.invalidate(user_id, guild_id)
+                raise
+            total_price = sum(drop.sell_price for drop in sold)
+            if total_price:
+                self.profile_cache.adjust_gold(user_id, guild_id, total_price)
+        logger.info(f"User {user_id} resolved {len(drops)} overflow drops: stored {len(stored)}, sold {len(sold)} for {total_price}G.")
+
+        embed = discord.Embed(title="アイテムの処理完了", color=discord.Color.green())
+        if stored:
+            embed.add_field(name=f"取得 ({len(stored)}件)", value=self._format_drop_lines(stored), inline=False)
+        if sold:
+            embed.add_field(name=f"売却 ({len(sold)}件) - {total_price} ゴールド獲得", value=self._format_drop_lines(sold), inline=False)
+        if len(stored) < len(keep_indices):
+            embed.description = "空きが足りなかったアイテムは売却しました。"
+        return embed
 
+    async def _expire_drop_overflow(self, token: int, user_id: int, guild_id: int):
+        """
+        時間切れになった DropOverflowView のアイテムをすべて売却し、メッセージを書き換える。
+        操作の取り出しと売却は同じトランザクションで行うので、失敗しても操作は残り次の掃除で再試行される。
+        """
+        async with self.user_locks.hold(user_id, guild_id):
+            try:
+                async with self.bot.db.write() as conn:
+                    action = await self.pending_actions.claim_expired(token, "drop_overflow", conn)
+                    if action is None:
+                        return
+                    drops = [drop for drop in (drop_from_ids(*ids) for ids in action.payload["drops"]) if drop is not None]
+                    total_price = sum(drop.sell_price for drop in drops)
+                    await apply_gold(conn, user_id, guild_id, total_price, "drop_overflow_expired",
+                                     (drop.ref_id for drop in drops))
+            except Exception:
+                self.profile_cache.invalidate(user_id, guild_id)
+                raise
+            self.profile_cache.adjust_gold(user_id, guild_id, total_price)
+        logger.info(f"Overflow drops of user {user_id} expired: sold {len(drops)} for {total_price}G.")
+
+        channel_id, message_id = action.payload.get("channel_id"), action.payload.get("message_id")
+        if not channel_id or not message_id:
+            return
+        embed = discord.Embed(title="アイテムの処理完了", color=discord.Color.green())
+        embed.add_field(name=f"売却 ({len(drops)}件) - {total_price} ゴールド獲得", value=self._format_drop_lines(drops), inline=False)
+        embed.set_footer(text="時間切れのため、すべて売却しました。")
+        try:
+            await self.bot.get_partial_messageable(channel_id).get_partial_message(message_id).edit(embed=embed, view=None)
+        except discord.HTTPException as e:
+            logger.warning(f"Could not edit expired overflow message {message_id}: {e}")
 
     async def drop_item(self, user_id: int, guild_id: int, channel: discord.TextChannel,
                         interaction_user_id: int, user_display_name: str, user_avatar_url: str):
         """
         Generates a random item.
-        Returns a dictionary with embed and view if inventory is full or item is offered,
+        Returns a dictionary with the choice embed, the rolled drop and is_inventory_full,
         otherwise None if an error occurs.
         """
-        new_item_type = random.choice(["weapon", "armor"])
-        new_item_type_display = "武器" if new_item_type == "weapon" else "防具"
-        new_base_rarity = random.choices(list(self.rarity_weights.keys()), weights=list(self.rarity_weights.values()), k=1)[0]
-
-        async with self.bot.db.execute("SELECT item_id, base_name FROM items WHERE type = ? AND rarity = ? ORDER BY RANDOM() LIMIT 1", (new_item_type, new_base_rarity)) as cursor:
-            item_row = await cursor.fetchone()
-        if not item_row:
-            logger.error(f"No base item found for type {new_item_type} and rarity {new_base_rarity}")
+        drop = roll_drop()
+        if drop is None:
             return None
-        new_item_base_id, new_item_base_name = item_row
-
-        new_effect_rarity = random.choices(list(self.rarity_weights.keys()), weights=list(self.rarity_weights.values()), k=1)[0]
-        async with self.bot.db.execute("SELECT effect_id, prefix_name FROM effects WHERE rarity = ? ORDER BY RANDOM() LIMIT 1", (new_effect_rarity,)) as cursor:
-            effect_row = await cursor.fetchone()
-        if not effect_row:
-            logger.warning(f"No effect found for rarity {new_effect_rarity}. Assigning 'no effect' (ID 0).")
-            async with self.bot.db.execute("SELECT effect_id, prefix_name FROM effects WHERE effect_id = 0") as c_no_effect:
-                no_effect_row = await c_no_effect.fetchone()
-            if no_effect_row: new_effect_id, new_effect_name_prefix = no_effect_row
-            else: new_effect_id, new_effect_name_prefix = 0, ""
-            new_effect_rarity = "N/A"
-        else:
-            new_effect_id, new_effect_name_prefix = effect_row
-
-        async with self.bot.db.execute("SELECT COUNT(*) FROM inventory WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
-            count_row = await cursor.fetchone()
+        new_item_type_display = drop.item_type_display
+        new_base_rarity, new_effect_rarity = drop.item.rarity, drop.effect.rarity
+        new_item_base_id, new_item_base_name = drop.item.item_id, drop.item.base_name
+        new_effect_id, new_effect_name_prefix = drop.effect.effect_id, drop.effect.prefix_name
+
+        async with self.bot.db.read() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM inventory WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+                count_row = await cursor.fetchone()
         current_inventory_count = count_row[0] if count_row else 0
         is_inventory_full = current_inventory_count >= self.inventory_limit
 
-        return await self.handle_inventory_full(
+        choice = await self.handle_inventory_full(
             user_id, guild_id, channel, interaction_user_id, user_display_name, user_avatar_url,
             new_item_base_id, new_item_base_name, new_base_rarity, new_item_type_display,
             new_effect_id, new_effect_name_prefix or "", new_effect_rarity, is_inventory_full
         )
+        choice.update(drop=drop, is_inventory_full=is_inventory_full)
+        return choice
 
     async def handle_inventory_full(self, user_id: int, guild_id: int, channel: discord.TextChannel, interaction_user_id: int, user_display_name: str, user_avatar_url: str,
                                     new_item_base_id: int, new_item_base_name: str, new_base_rarity: str, new_item_type_display: str,
                                     new_effect_id: int, new_effect_name_prefix: str, new_effect_rarity: str, is_inventory_full: bool):
         """
-        Prepares the embed and view for the item choice.
-        Returns a dictionary: {"embed": discord.Embed, "view": InventorySwapView}
+        Prepares the embed for the item choice.
+        Returns a dictionary: {"embed": discord.Embed}
         """
         new_full_item_name = f"{new_effect_name_prefix}{new_item_base_name}"
 
-        async with self.bot.db.execute("""
-            SELECT inv.inventory_id, i.base_name, i.type, i.rarity as base_rarity, i.item_id,
-                   e.prefix_name, e.rarity as effect_rarity, e.effect_id,
-                   i.base_attack, i.base_defense, e.attack_bonus, e.defense_bonus
-            FROM inventory inv
-            JOIN items i ON inv.item_id = i.item_id
-            JOIN effects e ON inv.effect_id = e.effect_id
-            WHERE inv.user_id = ? AND inv.guild_id = ? ORDER BY inv.inventory_id ASC
-        """, (user_id, guild_id)) as cursor:
-            inventory_items_for_view_tuples = await cursor.fetchall()
+        preview_items_count = 3
+        async with self.bot.db.read() as conn:
+            inventory_count, _ = await count_inventory(conn, user_id, guild_id)
+            preview_items, _ = await fetch_inventory_page(conn, user_id, guild_id, limit=preview_items_count)
 
         title = "新しいアイテムを入手！" if not is_inventory_full else "インベントリが上限です！"
         prob_item = (RARITY_WEIGHTS.get(new_base_rarity, 0) / TOTAL_RARITY_WEIGHT) if TOTAL_RARITY_WEIGHT > 0 else 0
@@ -500,122 +833,108 @@ class RPG(commands.Cog):
         embed = discord.Embed(title=title, description=description, color=discord.Color.orange())
         embed.set_thumbnail(url=user_avatar_url)
 
-        preview_items_count = 3
-        if inventory_items_for_view_tuples:
-            preview_text_parts = [f"ID:{item[0]} | {item[5]}{item[1][:15]} ({item[3]}/{item[6]})" for item in inventory_items_for_view_tuples[:preview_items_count]]
+        if preview_items:
+            preview_text_parts = [f"ID:{item.inventory_id} | {item.effect_prefix}{item.base_name[:15]} ({item.base_rarity}/{item.effect_rarity})" for item in preview_items]
             preview_text = "\n".join(preview_text_parts)
-            if len(inventory_items_for_view_tuples) > preview_items_count:
-                preview_text += f"\n...他{len(inventory_items_for_view_tuples) - preview_items_count}件"
+            if inventory_count > len(preview_items):
+                preview_text += f"\n...他{inventory_count - len(preview_items)}件"
             if len(preview_text) > 1020:
                 preview_text = preview_text[:1020] + "..."
-            embed.add_field(name=f"現在のインベントリ (一部表示 - 全{len(inventory_items_for_view_tuples)}件)", value=preview_text if preview_text else "なし", inline=False)
+            embed.add_field(name=f"現在のインベントリ (一部表示 - 全{inventory_count}件)", value=preview_text if preview_text else "なし", inline=False)
         else:
             embed.add_field(name="現在のインベントリ", value="なし", inline=False)
 
         embed.set_footer(text="選択肢のタイムアウトは2分です。")
 
-        view = InventorySwapView(
-            self.bot, user_id, guild_id,
-            new_item_base_id, new_item_base_name, new_base_rarity, new_item_type_display,
-            new_effect_id, new_effect_name_prefix, new_effect_rarity,
-            inventory_items_for_view_tuples,
-            interaction_user_id,
-            is_inventory_full
-        )
-        return {"embed": embed, "view": view}
+        return {"embed": embed}
 
 
     async def manage_user_role(self, guild: discord.Guild, user: discord.Member, full_item_name: str, item_type_display: str):
-        """Manages RPG equipment roles for a user."""
-        roles_to_remove = [role for role in user.roles if role.name.startswith(f"{item_type_display}:")]
-        if roles_to_remove:
-            try:
-                await user.remove_roles(*roles_to_remove, reason="RPG装備変更")
-            except discord.Forbidden:
-                logger.warning(f"Missing permissions to remove roles from {user.name} in {guild.name}.")
-            except Exception as e:
-                logger.error(f"Error removing roles from {user.name} in {guild.name}: {e}", exc_info=True)
-
-        new_role_name = f"{item_type_display}: {full_item_name}"
-        if len(new_role_name) > 100:
-            new_role_name = new_role_name[:97] + "..."
-
-        role_to_assign = discord.utils.get(guild.roles, name=new_role_name)
-        if not role_to_assign:
-            try:
-                role_to_assign = await guild.create_role(name=new_role_name, mentionable=False, reason=f"RPG装備: {full_item_name}")
-            except discord.Forbidden:
-                logger.warning(f"Missing permissions to create role {new_role_name} in {guild.name}.")
-                return
-            except Exception as e:
-                logger.error(f"Error creating role {new_role_name} in {guild.name}: {e}", exc_info=True)
-                return
-
-        if role_to_assign:
-            try:
-                await user.add_roles(role_to_assign, reason="RPG装備変更")
-            except discord.Forbidden:
-                logger.warning(f"Missing permissions to add role {role_to_assign.name} to {user.name} in {guild.name}.")
-            except Exception as e:
-                logger.error(f"Error adding role {role_to_assign.name} to {user.name} in {guild.name}: {e}", exc_info=True)
+        """Manages RPG equipment roles for a user. 実際の付け替えは RoleManager がまとめて行う。"""
+        self.role_manager.request(user, item_type_display, full_item_name)
 
     @discord.app_commands.command(name="vlevel", description="現在のレベルとゴールドを表示")
     async def level_cmd(self, interaction: discord.Interaction):
         user_id = interaction.user.id
         guild_id = interaction.guild.id
-        async with self.bot.db.execute("SELECT level, total_characters, gold FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
-            row = await cursor.fetchone()
+        profile = await self.profile_cache.get(user_id, guild_id)
 
         embed = discord.Embed(title=f"{interaction.user.display_name} のステータス", color=discord.Color.green())
         embed.set_thumbnail(url=interaction.user.display_avatar.url)
         show_ephemeral = True
-        if row:
-            level, total_chars, gold = row
-            embed.add_field(name="レベル", value=str(level), inline=True)
-            embed.add_field(name="総入力文字数", value=str(total_chars), inline=True)
-            embed.add_field(name="ゴールド", value=f"{gold} G", inline=True)
+        if profile:
+            embed.add_field(name="レベル", value=str(profile.level), inline=True)
+            embed.add_field(name="総入力文字数", value=str(profile.total_characters), inline=True)
+            embed.add_field(name="ゴールド", value=f"{profile.gold} G", inline=True)
             show_ephemeral = False
         else:
             embed.description = "まだSophiaに認識されていません。何かメッセージを送ってみましょう！"
             embed.color = discord.Color.red()
         await interaction.response.send_message(embed=embed, ephemeral=show_ephemeral)
 
-    @discord.app_commands.command(name="vinventory", description="インベントリを表示します。ソートも可能です。")
-    async def inventory_cmd(self, interaction: discord.Interaction):
+    @discord.app_commands.command(name="vleaderboard", description="サーバー内のランキングを表示")
+    @discord.app_commands.describe(metric="ランキングの種類")
+    @discord.app_commands.choices(metric=[
+        discord.app_commands.Choice(name=label, value=key) for key, label in LEADERBOARD_METRICS.items()
+    ])
+    async def leaderboard_cmd(self, interaction: discord.Interaction,
+                              metric: Optional[discord.app_commands.Choice[str]] = None):
+        await interaction.response.defer()
+        metric_key = metric.value if metric else "level"
+        metric_label = LEADERBOARD_METRICS[metric_key]
+        # 最初の1回だけサーバー分を読み込み、以降はメモリ上の順位構造から引く
+        board = await self.leaderboards.get(interaction.guild.id)
+        top_entries = board.top(metric_key, LEADERBOARD_TOP_N)
+        unit = " G" if metric_key == "gold" else ""
+
+        lines = [f"**{entry.rank}位** <@{entry.user_id}> - {entry.value}{unit}" for entry in top_entries]
+        embed = discord.Embed(title=f"ランキング: {metric_label}",
+                              description="\n".join(lines) if lines else "まだ誰もいません。",
+                              color=discord.Color.gold())
+        own = board.rank_of(metric_key, interaction.user.id)
+        if own is not None:
+            embed.add_field(name="あなたの順位", value=f"{own.rank}位 / {len(board)}人 - {own.value}{unit}", inline=False)
+        else:
+            embed.add_field(name="あなたの順位", value="まだ記録がありません。何かメッセージを送ってみましょう！", inline=False)
+        await interaction.followup.send(embed=embed, allowed_mentions=discord.AllowedMentions.none())
+
+    @discord.app_commands.command(name="vinventory", description="インベントリを表示します。ソートや絞り込みも可能です。")
+    @discord.app_commands.describe(
+        item_type="種別で絞り込む",
+        rarity="装備レアリティで絞り込む",
+        sort="最初の並び順"
+    )
+    @discord.app_commands.choices(
+        item_type=[
+            discord.app_commands.Choice(name="武器", value="weapon"),
+            discord.app_commands.Choice(name="防具", value="armor"),
+        ],
+        rarity=[
+            discord.app_commands.Choice(name=rarity, value=rarity)
+            for rarity in sorted(RARITY_ORDER, key=RARITY_ORDER.get)
+        ],
+        sort=[
+            discord.app_commands.Choice(name=spec.label, value=key)
+            for key, spec in SORT_ORDERS.items()
+        ]
+    )
+    async def inventory_cmd(self, interaction: discord.Interaction,
+                            item_type: Optional[discord.app_commands.Choice[str]] = None,
+                            rarity: Optional[discord.app_commands.Choice[str]] = None,
+                            sort: Optional[discord.app_commands.Choice[str]] = None):
         await interaction.response.defer(ephemeral=True)
         user_id = interaction.user.id
         guild_id = interaction.guild.id
 
-        async with self.bot.db.execute("""
-            SELECT
-                inv.inventory_id, i.base_name, i.type AS item_type, i.rarity AS base_item_rarity,
-                i.item_id AS base_item_id, e.prefix_name AS effect_name_prefix, e.rarity AS effect_rarity,
-                e.effect_id AS effect_id, i.base_attack, i.base_defense,
-                e.attack_bonus AS effect_attack_bonus, e.defense_bonus AS effect_defense_bonus
-            FROM inventory inv
-            JOIN items i ON inv.item_id = i.item_id
-            JOIN effects e ON inv.effect_id = e.effect_id
-            WHERE inv.user_id = ? AND inv.guild_id = ?
-        """, (user_id, guild_id)) as cursor:
-            inventory_items_db_tuples = await cursor.fetchall()
-
-        async with self.bot.db.execute("SELECT gold FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
-            gold_row = await cursor.fetchone()
-            gold = gold_row[0] if gold_row else 0
-
-        if not inventory_items_db_tuples:
-            embed = discord.Embed(title=f"{interaction.user.display_name} のインベントリ (0/{self.inventory_limit})", color=discord.Color.red())
-            embed.set_thumbnail(url=interaction.user.display_avatar.url)
-            embed.add_field(name="所持ゴールド", value=f"{gold} G", inline=False)
-            embed.add_field(name="アイテム", value="インベントリは空です。", inline=False)
-            await interaction.followup.send(embed=embed, ephemeral=True)
-            return
+        profile = await self.profile_cache.get(user_id, guild_id)
+        gold = profile.gold if profile else 0
 
+        item_filter = InventoryFilter(item_type.value if item_type else None, rarity.value if rarity else None)
         view = InventoryEmbedView(
-            inventory_items_db_tuples, items_per_page=5, user_name=interaction.user.display_name,
+            self.bot, user_id, guild_id, items_per_page=5, user_name=interaction.user.display_name,
             inventory_limit=self.inventory_limit, gold=gold, rarity_probabilities=self.rarity_probabilities,
-            initial_interaction=interaction, current_sort_order="id_asc", is_ephemeral=True,
-            user_avatar_url=interaction.user.display_avatar.url
+            initial_interaction=interaction, current_sort_order=sort.value if sort else DEFAULT_SORT,
+            item_filter=item_filter, is_ephemeral=True, user_avatar_url=interaction.user.display_avatar.url
         )
         await view.send_initial_message()
 
@@ -626,14 +945,15 @@ class RPG(commands.Cog):
         user_id = interaction.user.id
         guild_id = interaction.guild.id
 
-        async with self.bot.db.execute("""
-            SELECT i.base_name, i.type, i.rarity as base_rarity, e.prefix_name, i.item_id, e.effect_id, e.rarity as effect_rarity
-            FROM inventory inv
-            JOIN items i ON inv.item_id = i.item_id
-            JOIN effects e ON inv.effect_id = e.effect_id
-            WHERE inv.inventory_id = ? AND inv.user_id = ? AND inv.guild_id = ?
-        """, (inventory_id, user_id, guild_id)) as cursor:
-            selected_item_row = await cursor.fetchone()
+        async with self.bot.db.read() as conn:
+            async with conn.execute("""
+                SELECT i.base_name, i.type, i.rarity as base_rarity, e.prefix_name, i.item_id, e.effect_id, e.rarity as effect_rarity
+                FROM inventory inv
+                JOIN items i ON inv.item_id = i.item_id
+                JOIN effects e ON inv.effect_id = e.effect_id
+                WHERE inv.inventory_id = ? AND inv.user_id = ? AND inv.guild_id = ?
+            """, (inventory_id, user_id, guild_id)) as cursor:
+                selected_item_row = await cursor.fetchone()
 
         if not selected_item_row:
             embed = discord.Embed(title="エラー", description=f"インベントリID {inventory_id} は存在しないか、あなたのアイテムではありません。", color=discord.Color.red())
@@ -645,9 +965,8 @@ class RPG(commands.Cog):
         item_type_display = "武器" if item_type == "weapon" else "防具"
         equip_field_to_update = "equipped_weapon" if item_type == "weapon" else "equipped_armor"
 
-        async with self.bot.db.execute(f"SELECT {equip_field_to_update} FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
-            currently_equipped_row = await cursor.fetchone()
-        currently_equipped_inv_id = currently_equipped_row[0] if currently_equipped_row else None
+        profile = await self.profile_cache.get(user_id, guild_id)
+        currently_equipped_inv_id = getattr(profile, equip_field_to_update) if profile else None
 
         if currently_equipped_inv_id == inventory_id:
             embed = discord.Embed(title="情報", description=f"そのアイテム ({full_item_name}) は既に装備中です。", color=discord.Color.blue())
@@ -655,14 +974,15 @@ class RPG(commands.Cog):
             return
 
         if currently_equipped_inv_id:
-            async with self.bot.db.execute("""
-                SELECT i.base_name as c_base_name, i.type as c_type, i.rarity as c_item_rarity, e.prefix_name as c_effect_prefix, e.rarity as c_effect_rarity
-                FROM inventory inv
-                JOIN items i ON inv.item_id = i.item_id
-                JOIN effects e ON inv.effect_id = e.effect_id
-                WHERE inv.inventory_id = ? AND inv.user_id = ? AND inv.guild_id = ?
-            """, (currently_equipped_inv_id, user_id, guild_id)) as cursor:
-                equipped_item_details = await cursor.fetchone()
+            async with self.bot.db.read() as conn:
+                async with conn.execute("""
+                    SELECT i.base_name as c_base_name, i.type as c_type, i.rarity as c_item_rarity, e.prefix_name as c_effect_prefix, e.rarity as c_effect_rarity
+                    FROM inventory inv
+                    JOIN items i ON inv.item_id = i.item_id
+                    JOIN effects e ON inv.effect_id = e.effect_id
+                    WHERE inv.inventory_id = ? AND inv.user_id = ? AND inv.guild_id = ?
+                """, (currently_equipped_inv_id, user_id, guild_id)) as cursor:
+                    equipped_item_details = await cursor.fetchone()
 
             if equipped_item_details:
                 c_base_name, c_type, c_item_rarity, c_effect_prefix, c_effect_rarity = equipped_item_details
@@ -681,18 +1001,26 @@ class RPG(commands.Cog):
                     f"　┣ ﾚｱ: {base_item_rarity}/{effect_rarity} (出現率: {prob_str_new})\n\n"
                     "この装備に入れ替えますか？"
                 )
-                view = EquipConfirmView(self.bot, inventory_id, full_item_name, item_type_display, equip_field_to_update, interaction.user.id)
+                view = EquipConfirmView(inventory_id, interaction.user.id)
                 await interaction.followup.send(embed=embed, view=view, ephemeral=True)
                 return
 
         try:
-            async with transaction(self.bot.db):
-                await self.bot.db.execute(f"UPDATE users SET {equip_field_to_update} = ? WHERE user_id = ? AND guild_id = ?", (inventory_id, user_id, guild_id))
+            async with self.user_locks.hold(user_id, guild_id):
+                async with self.bot.db.write() as conn:
+                    update_cursor = await conn.execute(EQUIP_IF_OWNED_SQL.format(field=equip_field_to_update),
+                                                       (inventory_id, user_id, guild_id, inventory_id, user_id, guild_id))
+                if update_cursor.rowcount == 0:
+                    embed = discord.Embed(title="エラー", description=f"インベントリID {inventory_id} は存在しないか、あなたのアイテムではありません。", color=discord.Color.red())
+                    await interaction.followup.send(embed=embed, ephemeral=True)
+                    return
+                self.profile_cache.set_fields(user_id, guild_id, **{equip_field_to_update: inventory_id})
             await self.manage_user_role(interaction.guild, interaction.user, full_item_name, item_type_display)
             embed = discord.Embed(title="装備完了", description=f"**{full_item_name}** ({item_type_display}) を装備しました。", color=discord.Color.green())
             embed.set_thumbnail(url=interaction.user.display_avatar.url)
             await interaction.followup.send(embed=embed, ephemeral=True)
         except Exception as e:
+            self.profile_cache.invalidate(user_id, guild_id)
             logger.error(f"Error equipping item for user {user_id} in guild {guild_id}: {e}", exc_info=True)
             error_embed = discord.Embed(title="エラー", description="装備処理中にエラーが発生しました。", color=discord.Color.red())
             await interaction.followup.send(embed=error_embed, ephemeral=True)
@@ -705,69 +1033,37 @@ class RPG(commands.Cog):
         guild_id = interaction.guild.id
         target_user = interaction.user
 
-        async with self.bot.db.execute("SELECT equipped_weapon, equipped_armor, gold, level FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
-            user_data = await cursor.fetchone()
+        profile = await self.profile_cache.get(user_id, guild_id)
 
         embed = discord.Embed(title=f"{target_user.display_name} のステータス", color=discord.Color.purple())
         embed.set_thumbnail(url=target_user.display_avatar.url)
         has_any_info = False
 
-        if user_data:
+        if profile:
             has_any_info = True
-            equipped_weapon_inv_id, equipped_armor_inv_id, gold, level = user_data
+            equipped_weapon_inv_id, equipped_armor_inv_id, gold, level = profile.equipped_weapon, profile.equipped_armor, profile.gold, profile.level
             embed.add_field(name="レベル", value=str(level), inline=True)
             embed.add_field(name="ゴールド", value=f"{gold} G", inline=True)
             embed.add_field(name="\u200b", value="\u200b", inline=True)
 
-            total_atk = 0
-            total_def = 0
-
-            weapon_emoji = "🗡️"
-            if equipped_weapon_inv_id:
-                async with self.bot.db.execute("""
-                    SELECT i.base_name, i.rarity as item_rarity, i.base_attack, i.base_defense,
-                           e.prefix_name, e.attack_bonus, e.defense_bonus, e.rarity as effect_rarity
-                    FROM inventory inv
-                    JOIN items i ON inv.item_id = i.item_id
-                    JOIN effects e ON inv.effect_id = e.effect_id
-                    WHERE inv.inventory_id = ? AND inv.user_id = ? AND inv.guild_id = ?
-                """, (equipped_weapon_inv_id, user_id, guild_id)) as cur:
-                    item_stats = await cur.fetchone()
-                    if item_stats:
-                        full_name = f"{item_stats[4]}{item_stats[0]}"
-                        item_rarity = item_stats[1]; eff_rarity = item_stats[7]
-                        item_atk = item_stats[2] + item_stats[5]; item_def = item_stats[3] + item_stats[6]
-                        total_atk += item_atk; total_def += item_def
-                        prob_str = self._calculate_combined_probability_str_for_cog(item_rarity, eff_rarity)
-                        embed.add_field(name=f"{weapon_emoji} 装備中の武器", value=f"**{full_name}**\n　┣ ﾚｱ: {item_rarity}/{eff_rarity} (出現率: {prob_str})\n　┗ ATK: {item_atk} | DEF: {item_def}", inline=False)
-                    else:
-                        embed.add_field(name=f"{weapon_emoji} 装備中の武器", value="なし (情報取得エラー)", inline=False)
-            else:
-                embed.add_field(name=f"{weapon_emoji} 装備中の武器", value="なし", inline=False)
-
-            shield_emoji = "<:shield:1237991581006565426>"
-            if equipped_armor_inv_id:
-                async with self.bot.db.execute("""
-                    SELECT i.base_name, i.rarity as item_rarity, i.base_attack, i.base_defense,
-                           e.prefix_name, e.attack_bonus, e.defense_bonus, e.rarity as effect_rarity
-                    FROM inventory inv
-                    JOIN items i ON inv.item_id = i.item_id
-                    JOIN effects e ON inv.effect_id = e.effect_id
-                    WHERE inv.inventory_id = ? AND inv.user_id = ? AND inv.guild_id = ?
-                """, (equipped_armor_inv_id, user_id, guild_id)) as cur:
-                    item_stats = await cur.fetchone()
-                    if item_stats:
-                        full_name = f"{item_stats[4]}{item_stats[0]}"
-                        item_rarity = item_stats[1]; eff_rarity = item_stats[7]
-                        item_atk = item_stats[2] + item_stats[5]; item_def = item_stats[3] + item_stats[6]
-                        total_atk += item_atk; total_def += item_def
-                        prob_str = self._calculate_combined_probability_str_for_cog(item_rarity, eff_rarity)
-                        embed.add_field(name=f"{shield_emoji} 装備中の防具", value=f"**{full_name}**\n　┣ ﾚｱ: {item_rarity}/{eff_rarity} (出現率: {prob_str})\n　┗ ATK: {item_atk} | DEF: {item_def}", inline=False)
-                    else:
-                        embed.add_field(name=f"{shield_emoji} 装備中の防具", value="なし (情報取得エラー)", inline=False)
-            else:
-                embed.add_field(name=f"{shield_emoji} 装備中の防具", value="なし", inline=False)
+            equipment = await self.profile_cache.get_equipment(user_id, guild_id)
+            slots = (
+                ("🗡️", "武器", equipped_weapon_inv_id, equipment.weapon if equipment else None),
+                ("<:shield:1237991581006565426>", "防具", equipped_armor_inv_id, equipment.armor if equipment else None),
+            )
+            for emoji, label, inv_id, equipped in slots:
+                field_name = f"{emoji} 装備中の{label}"
+                if not inv_id:
+                    embed.add_field(name=field_name, value="なし", inline=False)
+                elif equipped is None:
+                    embed.add_field(name=field_name, value="なし (情報取得エラー)", inline=False)
+                else:
+                    item_rarity, eff_rarity = equipped.item.rarity, equipped.effect.rarity
+                    prob_str = self._calculate_combined_probability_str_for_cog(item_rarity, eff_rarity)
+                    embed.add_field(name=field_name, value=f"**{equipped.full_name}**\n　┣ ﾚｱ: {item_rarity}/{eff_rarity} (出現率: {prob_str})\n　┗ ATK: {equipped.attack} | DEF: {equipped.defense}", inline=False)
 
+            total_atk = equipment.attack if equipment else 0
+            total_def = equipment.defense if equipment else 0
             embed.add_field(name="合計ステータス", value=f"ATK: {total_atk} | DEF: {total_def}", inline=False)
 
         if not has_any_info:
@@ -790,172 +1086,274 @@ class RPG(commands.Cog):
         return f"{combined_prob * 100:.3f}%"
 
 
-    @discord.app_commands.command(name="vreroll", description="アイテムの効果を再抽選（同レアリティの装備5個を消費）")
-    @discord.app_commands.describe(inventory_id_to_reroll="再抽選するアイテムのインベントリID")
-    async def reroll_cmd(self, interaction: discord.Interaction, inventory_id_to_reroll: int):
+    @discord.app_commands.command(name="vreroll", description=f"アイテムの効果を再抽選（1回につき同レアリティの装備{REROLL_CONSUME_COUNT}個を消費）")
+    @discord.app_commands.describe(
+        inventory_id_to_reroll="再抽選するアイテムのインベントリID",
+        rounds=f"まとめて再抽選する回数 (指定すると消費する装備を自動で選びます。最大{REROLL_MAX_ROUNDS}回)",
+        stop_at_rarity="このレアリティ以上の効果が出たら止める (指定すると消費する装備を自動で選びます)"
+    )
+    @discord.app_commands.choices(stop_at_rarity=[
+        discord.app_commands.Choice(name=rarity, value=rarity)
+        for rarity in sorted(RARITY_ORDER, key=RARITY_ORDER.get) if RARITY_ORDER[rarity] > 1
+    ])
+    async def reroll_cmd(self, interaction: discord.Interaction, inventory_id_to_reroll: int,
+                         rounds: Optional[discord.app_commands.Range[int, 1, REROLL_MAX_ROUNDS]] = None,
+                         stop_at_rarity: Optional[discord.app_commands.Choice[str]] = None):
         await interaction.response.defer(ephemeral=True)
         user_id = interaction.user.id
         guild_id = interaction.guild.id
 
-        async with self.bot.db.execute("""
-            SELECT i.rarity as base_rarity, i.base_name, i.type FROM inventory inv
-            JOIN items i ON inv.item_id = i.item_id
-            WHERE inv.inventory_id = ? AND inv.user_id = ? AND inv.guild_id = ?
-        """, (inventory_id_to_reroll, user_id, guild_id)) as cursor:
-            target_item_info = await cursor.fetchone()
-
-        if not target_item_info:
+        profile = await self.profile_cache.get(user_id, guild_id)
+        # 装備中のアイテムは消費の候補にしない
+        keep_ids = (profile.equipped_weapon, profile.equipped_armor) if profile else ()
+        auto_mode = rounds is not None or stop_at_rarity is not None
+        if auto_mode and rounds is None:
+            rounds = REROLL_MAX_ROUNDS
+        async with self.bot.db.read() as conn:
+            target = await fetch_reroll_target(conn, user_id, guild_id, inventory_id_to_reroll)
+            consumables = []
+            if target is not None:
+                consumables = await fetch_consumables(conn, user_id, guild_id, target, keep_ids,
+                                                      limit=rounds * REROLL_CONSUME_COUNT if auto_mode else None)
+
+        if not target:
             await interaction.followup.send(embed=discord.Embed(title="エラー", description=f"ID {inventory_id_to_reroll} は存在しないかあなたのアイテムではありません。", color=discord.Color.red()), ephemeral=True)
             return
-
-        target_item_base_rarity, target_item_base_name, target_item_type = target_item_info
-        target_item_type_display = "武器" if target_item_type == "weapon" else "防具"
-
-        async with self.bot.db.execute("""
-            SELECT inv.inventory_id, i.base_name, i.type, i.rarity as base_rarity, i.item_id,
-                   e.prefix_name, e.rarity as effect_rarity, e.effect_id
-            FROM inventory inv
-            JOIN items i ON inv.item_id = i.item_id
-            JOIN effects e ON inv.effect_id = e.effect_id
-            WHERE inv.user_id = ? AND inv.guild_id = ? AND i.rarity = ? AND inv.inventory_id != ?
-            ORDER BY inv.inventory_id ASC
-        """, (user_id, guild_id, target_item_base_rarity, inventory_id_to_reroll)) as cursor:
-            consumable_items_tuples = await cursor.fetchall()
-
-        if len(consumable_items_tuples) < 5:
-            await interaction.followup.send(embed=discord.Embed(title="エラー", description=f"同じベースレアリティ ({target_item_base_rarity}) の装備が他に5個必要です。(現在: {len(consumable_items_tuples)}個)", color=discord.Color.red()), ephemeral=True)
+        if len(consumables) < REROLL_CONSUME_COUNT:
+            await interaction.followup.send(embed=discord.Embed(title="エラー", description=f"同じベースレアリティ ({target.base_rarity}) の装備が他に{REROLL_CONSUME_COUNT}個必要です。(現在: {len(consumables)}個、装備中のものは除く)", color=discord.Color.red()), ephemeral=True)
             return
 
-        new_eff_rarity = random.choices(list(self.rarity_weights.keys()), weights=list(self.rarity_weights.values()), k=1)[0]
-        async with self.bot.db.execute("SELECT effect_id, prefix_name FROM effects WHERE rarity = ? ORDER BY RANDOM() LIMIT 1", (new_eff_rarity,)) as cursor:
-            new_effect_info = await cursor.fetchone()
-        if not new_effect_info:
-            await interaction.followup.send(embed=discord.Embed(title="エラー", description="新しい効果の抽選に失敗しました。", color=discord.Color.red()), ephemeral=True)
+        target_item_type_display = "武器" if target.item_type == "weapon" else "防具"
+        if auto_mode:
+            await self._confirm_auto_reroll(interaction, target, consumables, rounds,
+                                            stop_at_rarity.value if stop_at_rarity else None)
             return
-        new_effect_id, new_effect_name_prefix = new_effect_info
 
-        new_full_item_name_preview = f"{new_effect_name_prefix}{target_item_base_name}"
+        new_effect = roll_effect()
+        new_full_item_name_preview = f"{new_effect.prefix_name}{target.base_name}"
 
         embed = discord.Embed(title="効果の再抽選", color=discord.Color.blue())
         embed.set_thumbnail(url=interaction.user.display_avatar.url)
         embed.description = (
-            f"**{target_item_type_display}: {target_item_base_name}** (ベースレアリティ: {target_item_base_rarity}) の効果を再抽選します。\n"
-            f"新しい効果候補の接頭辞: **{new_effect_name_prefix}** (効果レアリティ: {new_eff_rarity})\n"
+            f"**{target_item_type_display}: {target.base_name}** (ベースレアリティ: {target.base_rarity}) の効果を再抽選します。\n"
+            f"新しい効果候補の接頭辞: **{new_effect.prefix_name}** (効果レアリティ: {new_effect.rarity})\n"
             f"これにより、アイテム名は「{new_full_item_name_preview}」のようになります。\n\n"
-            "以下から5個選択して消費してください:"
+            f"以下から{REROLL_CONSUME_COUNT}個選択して消費してください:"
         )
 
         consumable_list_str_parts = []
-        for item_tuple in consumable_items_tuples[:25]:
-            consumable_list_str_parts.append(f"ID:{item_tuple[0]} | {item_tuple[5]}{item_tuple[1][:15]} ({item_tuple[3]}/{item_tuple[6]})")
+        for row in consumables[:25]:
+            consumable_list_str_parts.append(f"ID:{row.inventory_id} | {row.effect_prefix}{row.base_name[:15]} ({row.base_rarity}/{row.effect_rarity})")
         consumable_list_str = "\n".join(consumable_list_str_parts)
-        if len(consumable_items_tuples) > 25:
-            consumable_list_str += f"\n...他{len(consumable_items_tuples) - 25}件（選択肢には最初の25件まで表示）"
+        if len(consumables) > 25:
+            consumable_list_str += f"\n...他{len(consumables) - 25}件（選択肢には最初の25件まで表示）"
 
-        embed.add_field(name="消費候補アイテム", value=consumable_list_str if consumable_list_str else "なし", inline=False)
+        embed.add_field(name="消費候補アイテム (価値の低い順)", value=consumable_list_str if consumable_list_str else "なし", inline=False)
         embed.set_footer(text=f"この操作は {interaction.user.display_name} さんのみ可能です。タイムアウトは2分です。")
 
-        view = RerollSelectView(
-            self.bot, inventory_id_to_reroll, new_effect_id, new_effect_name_prefix, new_eff_rarity,
-            consumable_items_tuples, target_item_base_rarity, interaction.user.id
-        )
+        token = await self.pending_actions.create(
+            "reroll", user_id, guild_id,
+            {"inventory_id": inventory_id_to_reroll, "effect_id": new_effect.effect_id, "base_rarity": target.base_rarity},
+            ITEM_CHOICE_TTL_SECONDS)
+        view = RerollSelectView(user_id, token, consumables, target.base_rarity)
+        await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+
+    async def _confirm_auto_reroll(self, interaction: discord.Interaction, target, consumables, rounds: int,
+                                   stop_at_rarity: Optional[str]):
+        """まとめて再抽選する前に、消費する可能性のある装備を見せて確認する。"""
+        rounds = min(rounds, len(consumables) // REROLL_CONSUME_COUNT)
+        consumables = consumables[:rounds * REROLL_CONSUME_COUNT]
+        description_parts = [
+            f"**{target.full_name}** (ID:{target.inventory_id}, {target.base_rarity}/{target.effect_rarity}) の効果を"
+            f"最大 **{rounds}回** 再抽選します。",
+            f"{stop_at_rarity} 以上の効果が出たらそこで止め、残りの装備は消費しません。" if stop_at_rarity
+            else "指定した回数をすべて行い、最後に出た効果になります。",
+            f"1回につき下の一覧の上から{REROLL_CONSUME_COUNT}個を消費します (効果のレアリティ → ATK+DEF → ID の低い順、装備中のものは除く)。",
+            f"\n**消費する可能性のある装備 (最大{len(consumables)}個):**",
+            "\n".join(f"・ID:{row.inventory_id} {row.full_name} ({row.base_rarity}/{row.effect_rarity})" for row in consumables),
+        ]
+        description = "\n".join(description_parts)
+        if len(description) > 4000:
+            description = description[:3990] + "\n…"
+        embed = discord.Embed(title="まとめて再抽選の確認", description=description, color=discord.Color.gold())
+        embed.set_thumbnail(url=interaction.user.display_avatar.url)
+        embed.set_footer(text="確認のタイムアウトは1分です。")
+        token = await self.pending_actions.create(
+            "reroll_auto", interaction.user.id, interaction.guild.id,
+            {"inventory_id": target.inventory_id, "rounds": rounds, "stop_at_rarity": stop_at_rarity,
+             "candidate_ids": [row.inventory_id for row in consumables]},
+            CONFIRM_TTL_SECONDS)
+        view = RerollAutoConfirmView(token, interaction.user.id)
         await interaction.followup.send(embed=embed, view=view, ephemeral=True)
 
-    @discord.app_commands.command(name="vsell", description="インベントリから指定したIDのアイテムを複数売却します (IDをスペース区切りで入力)。")
-    @discord.app_commands.describe(inventory_ids="売却するアイテムのインベントリID (スペース区切り)")
-    async def sell_cmd(self, interaction: discord.Interaction, inventory_ids: str):
+    async def execute_auto_reroll(self, interaction: discord.Interaction, token: int) -> Optional[discord.Embed]:
+        """確認済みのまとめて再抽選を実行し、結果の埋め込みを返す。既に処理済み・期限切れなら None。RerollAutoConfirmView から呼ばれる。"""
+        user_id = interaction.user.id
+        guild_id = interaction.guild.id
+        async with self.user_locks.hold(user_id, guild_id):
+            profile = await self.profile_cache.get(user_id, guild_id)
+            keep_ids = (profile.equipped_weapon, profile.equipped_armor) if profile else ()
+            try:
+                async with self.bot.db.write() as conn:
+                    action = await self.pending_actions.claim(token, "reroll_auto", conn)
+                    if action is None:
+                        return None
+                    payload = action.payload
+                    # 確認画面で見せた装備の中からだけ消費する (その後に装備・売却されたものは除かれる)
+                    result = await execute_rerolls(conn, user_id, guild_id, payload["inventory_id"], payload["rounds"],
+                                                   payload["stop_at_rarity"], keep_ids, payload["candidate_ids"])
+            except RerollError as e:
+                return discord.Embed(title="エラー", description=str(e), color=discord.Color.red())
+            # 装備中のアイテムの効果が変わった場合に備えて、キャッシュした ATK/DEF を捨てる
+            self.profile_cache.invalidate_equipment(user_id, guild_id)
+        logger.info(f"User {user_id} rerolled item {result.target.inventory_id} {len(result.rounds)} times "
+                    f"(consumed {len(result.consumed_ids)}, final effect {result.final_effect.effect_id}).")
+
+        round_lines = [f"{i}. {r.effect.prefix_name or '効果なし'} ({r.effect.rarity})" for i, r in enumerate(result.rounds, 1)]
+        description_parts = [
+            f"アイテム「{result.final_name}」の効果を **{result.final_effect.prefix_name or '効果なし'}** "
+            f"(効果レアリティ: {result.final_effect.rarity}) に更新しました！",
+            f"（{len(result.rounds)}回再抽選、{result.target.base_rarity}装備{len(result.consumed_ids)}個を消費）",
+        ]
+        if payload["stop_at_rarity"]:
+            description_parts.append(f"{payload['stop_at_rarity']} 以上の効果が出たため途中で止めました。" if result.reached_target
+                                     else f"{payload['stop_at_rarity']} 以上の効果は出ませんでした。")
+        description_parts.append("\n**抽選の履歴:**\n" + "\n".join(round_lines))
+        description = "\n".join(description_parts)
+        if len(description) > 4000:
+            description = description[:3990] + "\n…"
+        return discord.Embed(title="効果を更新", description=description, color=discord.Color.green())
+
+    def _build_sell_result_embed(self, interaction: discord.Interaction, result: SellResult, current_gold: int) -> discord.Embed:
+        plan = result.plan
+        result_description_parts = []
+        if plan.lines:
+            result_description_parts.append(f"{len(plan.lines)}個のアイテムを合計 {plan.total_price}G で売却しました。")
+            result_description_parts.append(f"現在の所持ゴールド: {current_gold}G")
+            result_description_parts.append("\n**売却成功:**\n" + "\n".join(line.describe() for line in plan.lines))
+            embed_color = discord.Color.green()
+        else:
+            result_description_parts.append("指定されたアイテムの売却に失敗しました。")
+            embed_color = discord.Color.orange()
+
+        if plan.missing_ids:
+            result_description_parts.append("\n**売却失敗/対象外ID:**\n・" + "\n・".join(str(i) for i in plan.missing_ids))
+            embed_color = discord.Color.orange() if not plan.lines else discord.Color.yellow()
+
+        embed = discord.Embed(
+            title="アイテム売却結果",
+            description="\n".join(result_description_parts),
+            color=embed_color
+        )
+        embed.set_thumbnail(url=interaction.user.display_avatar.url)
+        return embed
+
+    async def execute_sale(self, interaction: discord.Interaction, token: int) -> Optional[discord.Embed]:
+        """
+        確認画面で見せた ID (pending_actions の "sell") を売却し、結果の埋め込みを返す。既に処理済み・期限切れなら None。
+        SellConfirmView から呼ばれる。確認の取り出しは売却と同じトランザクションなので、失敗すればもう一度押せる。
+        """
+        user_id = interaction.user.id
+        guild_id = interaction.guild.id
+
+        # 装備中かどうかの判定から売却額の加算までを、他のゴールド・インベントリ操作と直列化する
+        async with self.user_locks.hold(user_id, guild_id):
+            profile = await self.profile_cache.get(user_id, guild_id)
+            try:
+                async with self.bot.db.write() as conn:
+                    action = await self.pending_actions.claim(token, "sell", conn)
+                    if action is None:
+                        return None
+                    result = await settle_sale(conn, user_id, guild_id, action.payload["inventory_ids"],
+                                               profile.equipped_weapon if profile else None,
+                                               profile.equipped_armor if profile else None)
+            except Exception:
+                self.profile_cache.invalidate(user_id, guild_id)
+                raise
+
+            if result.plan.total_price > 0:
+                self.profile_cache.adjust_gold(user_id, guild_id, result.plan.total_price)
+            if result.unequipped_fields:
+                self.profile_cache.set_fields(user_id, guild_id, **result.unequipped_fields)
+        logger.info(f"User {user_id} sold {len(result.plan.lines)} items for {result.plan.total_price}G "
+                    f"(missing: {list(result.plan.missing_ids)}).")
+
+        if "equipped_weapon" in result.unequipped_fields:
+            await self.manage_user_role(interaction.guild, interaction.user, "なし", "武器")
+        if "equipped_armor" in result.unequipped_fields:
+            await self.manage_user_role(interaction.guild, interaction.user, "なし", "防具")
+        refreshed_profile = await self.profile_cache.get(user_id, guild_id)
+        current_gold = refreshed_profile.gold if refreshed_profile else 0
+        return self._build_sell_result_embed(interaction, result, current_gold)
+
+    @discord.app_commands.command(name="vsell", description="アイテムを売却します。IDをスペース区切りで指定するか、レアリティ未満をまとめて売却できます。")
+    @discord.app_commands.describe(
+        inventory_ids="売却するアイテムのインベントリID (スペース区切り)",
+        below_rarity="このレアリティ未満のアイテムをまとめて売却 (装備中のものは除く)"
+    )
+    @discord.app_commands.choices(below_rarity=[
+        discord.app_commands.Choice(name=rarity, value=rarity)
+        for rarity in sorted(RARITY_ORDER, key=RARITY_ORDER.get) if RARITY_ORDER[rarity] > 1
+    ])
+    async def sell_cmd(self, interaction: discord.Interaction, inventory_ids: Optional[str] = None,
+                       below_rarity: Optional[discord.app_commands.Choice[str]] = None):
         await interaction.response.defer(thinking=True, ephemeral=True)
         user_id = interaction.user.id
         guild_id = interaction.guild.id
 
         try:
-            try:
-                ids_to_sell_str = inventory_ids.split()
-                ids_to_sell_int = [int(id_str) for id_str in ids_to_sell_str]
-                if not ids_to_sell_int:
-                    raise ValueError("売却するアイテムのIDが指定されていません。")
-            except ValueError:
-                embed = discord.Embed(title="入力エラー", description="アイテムIDは半角数字で、スペース区切りで入力してください。", color=discord.Color.red())
+            if (inventory_ids is None) == (below_rarity is None):
+                embed = discord.Embed(title="入力エラー", description="`inventory_ids` か `below_rarity` のどちらか一方を指定してください。", color=discord.Color.red())
                 await interaction.followup.send(embed=embed, ephemeral=True)
                 return
 
-            sold_items_details = []
-            failed_to_sell_ids = []
-            total_sell_price = 0
-
-            async with transaction(self.bot.db):
-                async with self.bot.db.execute("SELECT gold FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as gold_cursor:
-                    gold_row = await gold_cursor.fetchone()
-                current_gold = gold_row[0] if gold_row else 0
-                accumulated_sell_price_for_tx = 0
-
-                for inv_id in ids_to_sell_int:
-                    async with self.bot.db.execute("""
-                        SELECT i.base_name, i.rarity as base_rarity, e.prefix_name, e.rarity as effect_rarity
-                        FROM inventory inv
-                        JOIN items i ON inv.item_id = i.item_id
-                        JOIN effects e ON inv.effect_id = e.effect_id
-                        WHERE inv.inventory_id = ? AND inv.user_id = ? AND inv.guild_id = ?
-                    """, (inv_id, user_id, guild_id)) as cursor:
-                        item_to_sell = await cursor.fetchone()
-
-                    if not item_to_sell:
-                        failed_to_sell_ids.append(str(inv_id))
-                        logger.warning(f"User {user_id} tried to sell non-existent or not owned item (Inv ID: {inv_id})")
-                        continue
-
-                    base_name, base_rarity, effect_prefix, effect_rarity = item_to_sell
-                    full_item_name = f"{effect_prefix}{base_name}"
-                    sell_price = SELL_PRICES.get(base_rarity, 0)
-
-                    async with self.bot.db.execute("SELECT equipped_weapon, equipped_armor FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as equip_cursor:
-                        equipped_ids = await equip_cursor.fetchone()
-                    if equipped_ids:
-                        if inv_id == equipped_ids[0]:
-                            await self.bot.db.execute("UPDATE users SET equipped_weapon = NULL WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
-                            await self.manage_user_role(interaction.guild, interaction.user, "なし", "武器")
-                        elif inv_id == equipped_ids[1]:
-                            await self.bot.db.execute("UPDATE users SET equipped_armor = NULL WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
-                            await self.manage_user_role(interaction.guild, interaction.user, "なし", "防具")
-
-                    delete_cursor = await self.bot.db.execute("DELETE FROM inventory WHERE inventory_id = ? AND user_id = ? AND guild_id = ?", (inv_id, user_id, guild_id))
-                    if delete_cursor.rowcount > 0:
-                        sold_items_details.append(f"・ID:{inv_id} {full_item_name} ({base_rarity}/{effect_rarity}) - {sell_price}G")
-                        total_sell_price += sell_price
-                        accumulated_sell_price_for_tx += sell_price
-                        logger.info(f"User {user_id} successfully queued item (Inv ID: {inv_id}) for selling. Price: {sell_price}G")
+            keep_ids = ()
+            if below_rarity is not None:
+                # キャッシュに無いと get() も読み取り接続を使うので、接続を借りる前に読んでおく
+                profile = await self.profile_cache.get(user_id, guild_id)
+                keep_ids = (profile.equipped_weapon, profile.equipped_armor) if profile else ()
+
+            try:
+                async with self.bot.db.read() as conn:
+                    if below_rarity is not None:
+                        plan = await plan_sale_below_rarity(conn, user_id, guild_id, below_rarity.value, keep_ids)
                     else:
-                        failed_to_sell_ids.append(str(inv_id) + " (削除失敗)")
-                        logger.warning(f"User {user_id} failed to delete item (Inv ID: {inv_id}) from inventory during selling.")
-
-                if accumulated_sell_price_for_tx > 0:
-                    new_gold = current_gold + accumulated_sell_price_for_tx
-                    await self.bot.db.execute("UPDATE users SET gold = ? WHERE user_id = ? AND guild_id = ?", (new_gold, user_id, guild_id))
-
-            result_description_parts = []
-            if sold_items_details:
-                result_description_parts.append(f"{len(sold_items_details)}個のアイテムを合計 {total_sell_price}G で売却しました。")
-                result_description_parts.append(f"現在の所持ゴールド: {current_gold + total_sell_price}G")
-                result_description_parts.append("\n**売却成功:**\n" + "\n".join(sold_items_details))
-                embed_color = discord.Color.green()
-            else:
-                result_description_parts.append("指定されたアイテムの売却に失敗しました。")
-                embed_color = discord.Color.orange()
+                        ids_to_sell_int = [int(id_str) for id_str in inventory_ids.split()]
+                        if not ids_to_sell_int:
+                            raise ValueError("売却するアイテムのIDが指定されていません。")
+                        plan = await plan_sale(conn, user_id, guild_id, ids_to_sell_int)
+            except ValueError as e:
+                description = str(e) if isinstance(e, TooManySellIdsError) else "アイテムIDは半角数字で、スペース区切りで入力してください。"
+                embed = discord.Embed(title="入力エラー", description=description, color=discord.Color.red())
+                await interaction.followup.send(embed=embed, ephemeral=True)
+                return
 
-            if failed_to_sell_ids:
-                result_description_parts.append("\n**売却失敗/対象外ID:**\n・" + "\n・".join(failed_to_sell_ids))
-                embed_color = discord.Color.orange() if not sold_items_details else discord.Color.yellow()
+            if not plan.lines:
+                if below_rarity is not None:
+                    description = f"{below_rarity.value} 未満の売却できるアイテムはありません (装備中のものは除きます)。"
+                else:
+                    description = "指定されたアイテムはインベントリにありません。\n・" + "\n・".join(str(i) for i in plan.missing_ids)
+                embed = discord.Embed(title="アイテム売却", description=description, color=discord.Color.orange())
+                await interaction.followup.send(embed=embed, ephemeral=True)
+                return
 
-            embed = discord.Embed(
-                title="アイテム売却結果",
-                description="\n".join(result_description_parts),
-                color=embed_color
-            )
+            # 売却前に内容と合計額を見せて確認する
+            description_parts = [f"以下の{len(plan.lines)}個のアイテムを合計 **{plan.total_price}G** で売却します。よろしいですか？",
+                                 "\n".join(line.describe() for line in plan.lines)]
+            if plan.missing_ids:
+                description_parts.append("\n**対象外ID:**\n・" + "\n・".join(str(i) for i in plan.missing_ids))
+            description = "\n".join(description_parts)
+            if len(description) > 4000:
+                description = description[:3990] + "\n…"
+            embed = discord.Embed(title="売却の確認", description=description, color=discord.Color.gold())
             embed.set_thumbnail(url=interaction.user.display_avatar.url)
-            await interaction.followup.send(embed=embed, ephemeral=True)
+            token = await self.pending_actions.create(
+                "sell", user_id, guild_id, {"inventory_ids": list(plan.inventory_ids)}, CONFIRM_TTL_SECONDS)
+            view = SellConfirmView(token, interaction.user.id)
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
 
         except Exception as e:
-            logger.error(f"Error during sell_cmd for user {user_id}, item_ids '{inventory_ids}': {e}", exc_info=True)
+            logger.error(f"Error during sell_cmd for user {user_id}, item_ids '{inventory_ids}', below '{below_rarity}': {e}", exc_info=True)
             error_embed = discord.Embed(title="エラー", description=f"アイテム売却処理中に予期せぬエラーが発生しました。\n`{str(e)}`", color=discord.Color.red())
             await interaction.followup.send(embed=error_embed, ephemeral=True)
 
@@ -965,9 +1363,8 @@ class RPG(commands.Cog):
 
         user_id = interaction.user.id
         guild_id = interaction.guild.id
-        async with self.bot.db.execute("SELECT gold FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
-            user_gold_row = await cursor.fetchone()
-        current_gold = user_gold_row[0] if user_gold_row else 0
+        profile = await self.profile_cache.get(user_id, guild_id)
+        current_gold = profile.gold if profile else 0
 
         embed = discord.Embed(
             title="ガチャへようこそ！",
@@ -984,7 +1381,7 @@ class RPG(commands.Cog):
 
         for gacha_key, gacha_info in self.gacha_settings.items():
             embed.add_field(
-                name=f"{gacha_info['name']} - {gacha_info['cost_single']}G",
+                name=f"{gacha_info['name']} - {gacha_info['cost_single']}G (10連 {gacha_info['cost_single'] * 10}G / 100連 {gacha_info['cost_single'] * 100}G)",
                 value=gacha_info['description'],
                 inline=False
             )
@@ -1000,6 +1397,64 @@ class RPG(commands.Cog):
         await interaction.followup.send(embed=embed, view=view, ephemeral=True)
 
 
+    @discord.app_commands.command(name="vbattle_stats", description="進行中の戦闘の統計を表示（開発者専用）")
+    async def battle_stats_cmd(self, interaction: discord.Interaction):
+        if interaction.user.id != self.developer_id:
+            await interaction.response.send_message(embed=discord.Embed(title="エラー", description="このコマンドは開発者専用です！", color=discord.Color.red()), ephemeral=True)
+            return
+
+        stats = self.battle_stats()
+        per_guild = Counter(s.guild_id for s in self.active_battles.values())
+        embed = discord.Embed(title="戦闘の統計", color=discord.Color.blue())
+        embed.add_field(name="進行中", value=f"{stats['active']} / {MAX_CONCURRENT_BATTLES}", inline=True)
+        embed.add_field(name="このサーバー", value=f"{per_guild.get(interaction.guild.id, 0)} / {MAX_CONCURRENT_BATTLES_PER_GUILD}", inline=True)
+        embed.add_field(name="放置で終了", value=str(stats["reaped"]), inline=True)
+        embed.add_field(name="上限で拒否", value=str(stats["rejected"]), inline=True)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @discord.app_commands.command(name="vledger", description="ユーザーのゴールドの増減履歴を表示（開発者専用）")
+    @discord.app_commands.describe(
+        user="履歴を見るユーザー",
+        limit="表示する件数 (新しい順)",
+        source="この理由の記録だけを表示"
+    )
+    @discord.app_commands.choices(source=[
+        discord.app_commands.Choice(name=label, value=key) for key, label in LEDGER_SOURCES.items()
+    ])
+    async def ledger_cmd(self, interaction: discord.Interaction, user: discord.User,
+                         limit: discord.app_commands.Range[int, 1, 50] = 20,
+                         source: Optional[discord.app_commands.Choice[str]] = None):
+        if interaction.user.id != self.developer_id:
+            await interaction.response.send_message(embed=discord.Embed(title="エラー", description="このコマンドは開発者専用です！", color=discord.Color.red()), ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        guild_id = interaction.guild.id
+        async with self.bot.db.read() as conn:
+            entries = await fetch_ledger(conn, user.id, guild_id, limit, source.value if source else None)
+            rollups = await fetch_rollups(conn, user.id, guild_id)
+        profile = await self.profile_cache.get(user.id, guild_id)
+        current_gold = profile.gold if profile else 0
+
+        lines = []
+        for entry_id, entry in entries:
+            refs = f" [{entry.ref_ids[:40]}]" if entry.ref_ids else ""
+            lines.append(f"`#{entry_id}` <t:{int(entry.created_at)}:f> {LEDGER_SOURCES.get(entry.source, entry.source)} "
+                         f"**{entry.delta:+}G** → {entry.balance_after}G{refs}")
+        description = "\n".join(lines) if lines else "記録はありません。"
+        if len(description) > 4000:
+            description = description[:3990] + "\n…"
+        embed = discord.Embed(title=f"{user.display_name} のゴールド台帳", description=description, color=discord.Color.blue())
+        embed.add_field(name="現在の所持ゴールド", value=f"{current_gold}G", inline=True)
+        if entries and source is None and entries[0][1].balance_after != current_gold:
+            # 最新の記録の残高と一致しない場合は、台帳を通らないゴールドの変更があった
+            embed.add_field(name="⚠ 不一致", value=f"最新の記録の残高は {entries[0][1].balance_after}G です。", inline=True)
+        if rollups:
+            embed.add_field(name=f"{LEDGER_RETENTION_DAYS}日より前の集計 (新しい日から)", value="\n".join(
+                f"{r.day} {LEDGER_SOURCES.get(r.source, r.source)}: {r.entries}件 {r.total_delta:+}G (終値 {r.closing_balance}G)"
+                for r in rollups)[:1024], inline=False)
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
     @discord.app_commands.command(name="vreset_rpg", description="RPGデータをリセット（開発者専用）")
     async def reset_rpg_cmd(self, interaction: discord.Interaction):
         if interaction.user.id != self.developer_id:
@@ -1009,58 +1464,43 @@ class RPG(commands.Cog):
         await interaction.response.defer(ephemeral=True)
         try:
             logger.info(f"RPG Data reset initiated by developer {interaction.user.id}")
-            async with transaction(self.bot.db):
-                await self.bot.db.execute("DROP TABLE IF EXISTS inventory")
-                await self.bot.db.execute("DROP TABLE IF EXISTS users")
+            # 進行中の戦闘は消えるユーザーのステータスを前提にしているので、先に時間切れとして終わらせる
+            for session in list(self.active_battles.values()):
+                try:
+                    await session.expire()
+                except Exception as e:
+                    logger.error(f"Failed to expire battle for user {session.player_id} during reset: {e}", exc_info=True)
+            self.active_battles.clear()
+            # テーブルは消さずに行だけ消す (スキーマとインデックスはマイグレーションの管理下にある)
+            async with self.bot.db.write() as conn:
+                await conn.execute("DELETE FROM inventory")
+                await conn.execute("DELETE FROM users")
+                # インベントリIDは振り直すので、古いIDを持つ確認ボタン (売却・リロールなど) と保存済みの戦闘も消す。
+                # pending_actions の token は振り直さない (古いボタンが新しい操作を取り出さないように)
+                await conn.execute("DELETE FROM pending_actions")
+                await conn.execute("DELETE FROM battles")
+                # 所持ゴールドが 0 に戻るので、台帳も残高が合わなくなる過去の記録ごと消す
+                await conn.execute("DELETE FROM economy_ledger")
+                await conn.execute("DELETE FROM economy_ledger_rollups")
+                await conn.execute("DELETE FROM sqlite_sequence WHERE name IN ('inventory', 'economy_ledger')")
+            self.xp_buffer.clear()
+            self.profile_cache.clear()
             await init_database(self.bot.db)
             logger.info(f"RPG Data reset completed by developer {interaction.user.id}")
-            await interaction.followup.send(embed=discord.Embed(title="RPGデータリセット完了", description="ユーザーとインベントリのデータがリセットされました。\nアイテムと効果の基本データは維持または再初期化されました。", color=discord.Color.green()), ephemeral=True)
+            await interaction.followup.send(embed=discord.Embed(title="RPGデータリセット完了", description="ユーザー・インベントリ・進行中の戦闘・保留中の操作・ゴールドの台帳がリセットされました。\nアイテムと効果の基本データは維持または再初期化されました。", color=discord.Color.green()), ephemeral=True)
         except Exception as e:
             logger.error(f"Error during RPG data reset by developer {interaction.user.id}: {e}", exc_info=True)
             await interaction.followup.send(embed=discord.Embed(title="エラー", description=f"リセット中にエラーが発生しました: {str(e)}", color=discord.Color.red()), ephemeral=True)
 
-    def load_enemy_data(self, enemy_name_base: str) -> Optional[dict]:
-        """Loads enemy data from a JSON file."""
-        file_path = os.path.join(ENEMY_DATA_PATH, f"{enemy_name_base}.json")
-        logger.debug(f"Attempting to load enemy data from: {file_path}")
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    logger.info(f"Successfully loaded enemy data for {enemy_name_base}.")
-                    return data
-            except json.JSONDecodeError as e:
-                logger.error(f"JSONDecodeError loading enemy data for {enemy_name_base} from {file_path}: {e}", exc_info=True)
-                return None
-            except Exception as e:
-                logger.error(f"Unexpected error loading enemy data for {enemy_name_base} from {file_path}: {e}", exc_info=True)
-                return None
-        else:
-            logger.warning(f"Enemy data file not found: {file_path}")
-        return None
-
-    def get_random_enemy_filename(self) -> Optional[str]:
-        """Gets a random enemy filename (without .json) from the enemy data path."""
-        if not os.path.exists(ENEMY_DATA_PATH) or not os.path.isdir(ENEMY_DATA_PATH):
-            logger.error(f"Enemy data path not found or not a directory: {ENEMY_DATA_PATH}")
-            return None
-        enemy_files = [f for f in os.listdir(ENEMY_DATA_PATH) if f.endswith('.json')]
-        if not enemy_files:
-            logger.warning(f"No enemy JSON files found in {ENEMY_DATA_PATH}")
-            return None
-        chosen_file = random.choice(enemy_files)
-        logger.info(f"Random enemy file chosen: {chosen_file}")
-        return chosen_file.replace('.json', '')
-
     async def get_player_battle_stats(self, user_id: int, guild_id: int) -> Optional[dict]:
         """Retrieves player's battle stats (HP, ATK, DEF) based on level and equipment."""
-        async with self.bot.db.execute("SELECT level, equipped_weapon, equipped_armor FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
-            user_base_stats = await cursor.fetchone()
-        if not user_base_stats:
+        profile = await self.profile_cache.get(user_id, guild_id)
+        if not profile:
             logger.warning(f"Player battle stats not found for user {user_id} in guild {guild_id}.")
             try:
-                 async with transaction(self.bot.db):
-                    await self.bot.db.execute("INSERT INTO users (user_id, guild_id, level, total_characters, gold) VALUES (?, ?, ?, ?, ?)", (user_id, guild_id, 0, 0, 0))
+                 async with self.bot.db.write() as conn:
+                    await conn.execute("INSERT INTO users (user_id, guild_id, level, total_characters, gold) VALUES (?, ?, ?, ?, ?)", (user_id, guild_id, 0, 0, 0))
+                 self.profile_cache.invalidate(user_id, guild_id)
                  logger.info(f"Created new user entry for {user_id} in guild {guild_id} from get_player_battle_stats.")
                  return await self.get_player_battle_stats(user_id, guild_id)
             except Exception as e:
@@ -1068,41 +1508,16 @@ class RPG(commands.Cog):
                  return None
 
 
-        level, equipped_weapon_id, equipped_armor_id = user_base_stats
-        player_hp = min(level + 10, 1000)
-        player_atk = 0
-        player_def = 0
-
-        if equipped_weapon_id:
-            async with self.bot.db.execute("""
-                SELECT i.base_attack, i.base_defense, e.attack_bonus, e.defense_bonus
-                FROM inventory inv
-                JOIN items i ON inv.item_id = i.item_id
-                JOIN effects e ON inv.effect_id = e.effect_id
-                WHERE inv.inventory_id = ?
-            """, (equipped_weapon_id,)) as cur:
-                weapon_stats = await cur.fetchone()
-                if weapon_stats:
-                    player_atk += weapon_stats[0] + weapon_stats[2]
-                    player_def += weapon_stats[1] + weapon_stats[3]
-                else:
-                    logger.warning(f"Equipped weapon (inv_id: {equipped_weapon_id}) stats not found for user {user_id}.")
-
-
-        if equipped_armor_id:
-            async with self.bot.db.execute("""
-                SELECT i.base_attack, i.base_defense, e.attack_bonus, e.defense_bonus
-                FROM inventory inv
-                JOIN items i ON inv.item_id = i.item_id
-                JOIN effects e ON inv.effect_id = e.effect_id
-                WHERE inv.inventory_id = ?
-            """, (equipped_armor_id,)) as cur:
-                armor_stats = await cur.fetchone()
-                if armor_stats:
-                    player_atk += armor_stats[0] + armor_stats[2]
-                    player_def += armor_stats[1] + armor_stats[3]
-                else:
-                    logger.warning(f"Equipped armor (inv_id: {equipped_armor_id}) stats not found for user {user_id}.")
+        level = profile.level
+        player_hp = player_max_hp(level)
+        # 装備の ATK/DEF はプロフィールと一緒にキャッシュされている
+        equipment = await self.profile_cache.get_equipment(user_id, guild_id)
+        player_atk = equipment.attack if equipment else 0
+        player_def = equipment.defense if equipment else 0
+        if equipment and profile.equipped_weapon and equipment.weapon is None:
+            logger.warning(f"Equipped weapon (inv_id: {profile.equipped_weapon}) stats not found for user {user_id}.")
+        if equipment and profile.equipped_armor and equipment.armor is None:
+            logger.warning(f"Equipped armor (inv_id: {profile.equipped_armor}) stats not found for user {user_id}.")
 
         logger.info(f"Player {user_id} battle stats: HP={player_hp}, ATK={player_atk}, DEF={player_def}, Level={level}")
         return {"hp": player_hp, "atk": player_atk, "def": player_def, "level": level}
@@ -1111,9 +1526,23 @@ class RPG(commands.Cog):
         user_id = interaction.user.id
         guild_id = interaction.guild.id
 
-        if user_id in self.active_battles:
+        previous_session = self.active_battles.get(user_id)
+        if previous_session is not None:
             logger.warning(f"Starting new battle for {user_id}, clearing previous active session.")
-            del self.active_battles[user_id]
+            # 古い画面の再描画を止め、保存済みの状態も消す (再起動で古い戦闘が復元されないように)
+            try:
+                await previous_session.expire()
+            except Exception as e:
+                logger.error(f"Failed to expire previous battle for user {user_id}: {e}", exc_info=True)
+            if self.active_battles.get(user_id) is previous_session:
+                del self.active_battles[user_id]
+            await self.battle_store.delete(user_id)
+
+        # 「連戦する」からも呼ばれるので、上限の確認はここでも行う
+        capacity_error = self._battle_capacity_error(guild_id)
+        if capacity_error:
+            await interaction.edit_original_response(content=capacity_error, embed=None, view=None)
+            return
         
         player_stats = await self.get_player_battle_stats(user_id, guild_id)
         if not player_stats:
@@ -1121,22 +1550,17 @@ class RPG(commands.Cog):
             await interaction.edit_original_response(content="戦闘を開始できませんでした。あなたのRPG情報が見つかりません。", embed=None, view=None)
             return
 
-        enemy_filename_base = self.get_random_enemy_filename()
-        if not enemy_filename_base:
-            logger.error("No enemy files found to start a battle.")
+        enemy = self.enemy_registry.random_enemy()
+        if not enemy:
+            logger.error("No enemy data loaded to start a battle.")
             await interaction.edit_original_response(content="戦闘を開始できませんでした。戦うべき敵が見つかりません！", embed=None, view=None)
             return
+        logger.info(f"Random enemy chosen: {enemy.key}")
 
-        enemy_data = self.load_enemy_data(enemy_filename_base)
-        if not enemy_data:
-            logger.error(f"Failed to load enemy data for '{enemy_filename_base}'.")
-            await interaction.edit_original_response(content=f"戦闘を開始できませんでした。敵「{enemy_filename_base}」のデータの読み込みに失敗しました。", embed=None, view=None)
-            return
-
-        battle_session = BattleSession(self.bot, interaction, player_stats, enemy_data, self)
+        battle_session = BattleSession.from_interaction(self.bot, self, interaction, player_stats, enemy)
         self.active_battles[user_id] = battle_session
         try:
-            await battle_session.start_battle()
+            await battle_session.start_battle(interaction)
         except Exception as e:
             logger.error(f"Error during battle_session.start_battle() for user {user_id}: {e}", exc_info=True)
             try:
@@ -1153,6 +1577,10 @@ class RPG(commands.Cog):
             await interaction.response.send_message("あなたは既に別の戦闘中です！", ephemeral=True)
             logger.warning(f"User {user_id} tried to start a battle while already in one.")
             return
+        capacity_error = self._battle_capacity_error(interaction.guild.id)
+        if capacity_error:
+            await interaction.response.send_message(capacity_error, ephemeral=True)
+            return
 
         bot_name = self.bot.user.display_name if self.bot.user else "ソフィア"
         await interaction.response.send_message(f"… {bot_name} が考え中…", ephemeral=False)
@@ -0,0 +1,219 @@
+# battle_simulator.py
+"""
+戦闘バランス確認用のシミュレーター。
+
+rpg_combat の戦闘計算を Discord なしで回し、enemy/ の全敵について
+勝率・撃破までのターン数・1時間あたりのゴールドを装備プロファイルごとに出力する。
+プロファイルは「装備なし」と、レアリティごとの武器+防具 (ベース値と同レアリティ効果の平均) から作る。
+プレイヤーは毎ターン攻撃する (防御・逃走はしない) 前提。
+
+    python battle_simulator.py --fights 2000 --seed 42
+    python battle_simulator.py --profile rare --level 300
+    python battle_simulator.py --enemy enemy_spoiled_brat --csv balance.csv
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import time
+from statistics import fmean
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from rpg_data import RARITY_ORDER
+from rpg_catalog import CATALOG
+from rpg_combat import (
+    CombatState, player_attack, expire_enemy_buffs, choose_enemy_action, apply_enemy_action,
+    roll_gold_drop, player_max_hp
+)
+from rpg_enemies import EnemyRecord, EnemyRegistry
+
+RARITIES: List[str] = sorted(RARITY_ORDER, key=RARITY_ORDER.get)
+NO_EQUIPMENT_KEY = "none"
+DEFAULT_ENEMY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'enemy')
+# BattleSession は敵のターンの前に asyncio.sleep(1.5) を挟む。ボタンを押すまでの時間はオーバーヘッドに含める。
+DEFAULT_SECONDS_PER_TURN = 1.5
+# /vbattle の実行から戦闘開始まで、および勝利後に「続ける」を押すまでの時間の目安
+DEFAULT_FIGHT_OVERHEAD = 5.0
+
+
+class PlayerProfile(NamedTuple):
+    key: str
+    atk: int
+    defense: int
+
+
+class EnemyResult(NamedTuple):
+    profile: PlayerProfile
+    enemy: EnemyRecord
+    fights: int
+    wins: int
+    mean_turns_to_kill: Optional[float]
+    mean_turns: float
+    gold_total: int
+    gold_per_hour: float
+
+    @property
+    def win_rate(self) -> float:
+        return self.wins / self.fights
+
+
+def _mean_stats(records: Sequence, atk_attr: str, def_attr: str):
+    if not records:
+        return 0.0, 0.0
+    return fmean(getattr(r, atk_attr) for r in records), fmean(getattr(r, def_attr) for r in records)
+
+
+def build_profiles() -> Dict[str, PlayerProfile]:
+    """
+    装備なし + レアリティごとのプロファイル。各レアリティは同レアリティの武器と防具を1つずつ装備し、
+    どちらにも同レアリティの効果が付いている想定で平均値を使う。
+    該当アイテムが無いレアリティはドロップと同じく common にフォールバックし、効果が無ければ補正0。
+    """
+    profiles = {NO_EQUIPMENT_KEY: PlayerProfile(NO_EQUIPMENT_KEY, 0, 0)}
+    for rarity in RARITIES:
+        atk = defense = 0.0
+        for item_type in ("weapon", "armor"):
+            items = CATALOG.items_by_key.get((item_type, rarity)) or CATALOG.items_by_key.get((item_type, "common"), ())
+            item_atk, item_def = _mean_stats(items, "base_attack", "base_defense")
+            atk += item_atk
+            defense += item_def
+        effect_atk, effect_def = _mean_stats(CATALOG.effects_by_rarity.get(rarity, ()), "attack_bonus", "defense_bonus")
+        atk += effect_atk * 2
+        defense += effect_def * 2
+        profiles[rarity] = PlayerProfile(rarity, round(atk), round(defense))
+    return profiles
+
+
+def simulate_fight(profile: PlayerProfile, enemy: EnemyRecord, hp: int, rng: random.Random, max_turns: int):
+    """1戦闘を実行し、(勝ったか, ターン数, 獲得ゴールド) を返す。max_turns に達したら負け扱い。"""
+    state = CombatState(hp, profile.atk, profile.defense, enemy)
+    for turn in range(1, max_turns + 1):
+        player_attack(state)
+        if state.enemy_hp <= 0:
+            return True, turn, roll_gold_drop(enemy.gold_drop, rng)
+        expire_enemy_buffs(state)
+        apply_enemy_action(state, choose_enemy_action(enemy.actions, rng))
+        if state.player_hp <= 0:
+            return False, turn, 0
+    return False, max_turns, 0
+
+
+def simulate_enemy(profile: PlayerProfile, enemy: EnemyRecord, hp: int, fights: int, rng: random.Random,
+                   max_turns: int, seconds_per_turn: float, fight_overhead: float) -> EnemyResult:
+    wins = 0
+    turns_total = 0
+    kill_turns_total = 0
+    gold_total = 0
+    for _ in range(fights):
+        won, turns, gold = simulate_fight(profile, enemy, hp, rng, max_turns)
+        turns_total += turns
+        if won:
+            wins += 1
+            kill_turns_total += turns
+            gold_total += gold
+    seconds = turns_total * seconds_per_turn + fights * fight_overhead
+    return EnemyResult(
+        profile=profile,
+        enemy=enemy,
+        fights=fights,
+        wins=wins,
+        mean_turns_to_kill=kill_turns_total / wins if wins else None,
+        mean_turns=turns_total / fights,
+        gold_total=gold_total,
+        gold_per_hour=gold_total * 3600 / seconds if seconds > 0 else 0.0,
+    )
+
+
+def format_report(profile: PlayerProfile, hp: int, results: List[EnemyResult]) -> str:
+    lines = [
+        f"=== profile {profile.key}: HP {hp} / ATK {profile.atk} / DEF {profile.defense} ===",
+        f"{'enemy':<36}{'HP':>8}{'ATK':>6}{'DEF':>6}{'win%':>9}{'TTK':>8}{'gold/h':>12}",
+    ]
+    for r in results:
+        ttk = f"{r.mean_turns_to_kill:.1f}" if r.mean_turns_to_kill is not None else "-"
+        lines.append(
+            f"{r.enemy.key:<36}{r.enemy.hp:>8}{r.enemy.atk:>6}{r.enemy.defense:>6}"
+            f"{r.win_rate * 100:>8.1f}%{ttk:>8}{r.gold_per_hour:>12.0f}"
+        )
+    winnable = sum(1 for r in results if r.wins)
+    lines.append(f"winnable enemies: {winnable}/{len(results)}, "
+                 f"mean gold/h over all enemies: {fmean(r.gold_per_hour for r in results):.0f}")
+    return "\n".join(lines)
+
+
+def write_csv(path: str, hp: int, results: List[EnemyResult]):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["profile", "player_hp", "player_atk", "player_def", "enemy", "enemy_hp", "enemy_atk",
+                         "enemy_def", "fights", "wins", "win_rate", "mean_turns_to_kill", "mean_turns", "gold_per_hour"])
+        for r in results:
+            writer.writerow([
+                r.profile.key, hp, r.profile.atk, r.profile.defense, r.enemy.key, r.enemy.hp, r.enemy.atk,
+                r.enemy.defense, r.fights, r.wins, f"{r.win_rate:.4f}",
+                "" if r.mean_turns_to_kill is None else f"{r.mean_turns_to_kill:.2f}",
+                f"{r.mean_turns:.2f}", f"{r.gold_per_hour:.1f}",
+            ])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    profiles = build_profiles()
+    parser = argparse.ArgumentParser(description="戦闘バランスのシミュレーター")
+    parser.add_argument("--fights", type=int, default=1000, help="敵・プロファイルごとの戦闘回数")
+    parser.add_argument("--seed", type=int, default=None, help="乱数シード (再現用)")
+    parser.add_argument("--level", type=int, default=100, help="プレイヤーレベル (最大HPの計算に使う)")
+    parser.add_argument("--profile", choices=["all", *profiles], default="all", help="装備プロファイル")
+    parser.add_argument("--enemy", action="append", metavar="KEY", help="対象の敵 (ファイル名から .json を除いたもの)。複数指定可")
+    parser.add_argument("--enemy-dir", default=DEFAULT_ENEMY_DIR, help="敵データのディレクトリ")
+    parser.add_argument("--max-turns", type=int, default=500, help="この回数で決着しなければ負け扱い")
+    parser.add_argument("--seconds-per-turn", type=float, default=DEFAULT_SECONDS_PER_TURN)
+    parser.add_argument("--fight-overhead", type=float, default=DEFAULT_FIGHT_OVERHEAD, help="1戦闘あたりの固定秒数")
+    parser.add_argument("--csv", metavar="PATH", help="結果を CSV で書き出す")
+    args = parser.parse_args(argv)
+
+    if args.fights <= 0:
+        parser.error("--fights must be positive")
+    if args.max_turns <= 0:
+        parser.error("--max-turns must be positive")
+
+    registry = EnemyRegistry(args.enemy_dir)
+    registry.scan()
+    enemies = registry.records()
+    if args.enemy:
+        missing = [key for key in args.enemy if registry.get(key) is None]
+        if missing:
+            parser.error(f"unknown enemy: {', '.join(missing)}")
+        enemies = tuple(registry.get(key) for key in args.enemy)
+    if not enemies:
+        print(f"No valid enemies in {args.enemy_dir}", file=sys.stderr)
+        return 1
+
+    rng = random.Random(args.seed)
+    hp = player_max_hp(args.level)
+    keys = list(profiles) if args.profile == "all" else [args.profile]
+    all_results: List[EnemyResult] = []
+    started = time.perf_counter()
+    for key in keys:
+        results = [
+            simulate_enemy(profiles[key], enemy, hp, args.fights, rng, args.max_turns,
+                           args.seconds_per_turn, args.fight_overhead)
+            for enemy in enemies
+        ]
+        all_results.extend(results)
+        print(format_report(profiles[key], hp, results))
+        print()
+    elapsed = time.perf_counter() - started
+
+    total_fights = len(all_results) * args.fights
+    print(f"{total_fights} fights in {elapsed:.2f}s ({total_fights / elapsed:.0f} fights/s)")
+    if registry.invalid_files:
+        print(f"WARNING: skipped invalid enemy files: {', '.join(sorted(registry.invalid_files))}")
+
+    if args.csv:
+        write_csv(args.csv, hp, all_results)
+        print(f"Wrote {len(all_results)} rows to {args.csv}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
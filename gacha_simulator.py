@@ -0,0 +1,275 @@
+# gacha_simulator.py
+"""
+ガチャ / レベルアップドロップのモンテカルロシミュレーター。
+
+GACHA_SETTINGS / RARITY_WEIGHTS / アイテムカタログ / SELL_PRICES から実際の抽選と同じ手順
+(ベースレアリティ → タイプ → ベースアイテム、効果レアリティ → 効果) を NumPy でまとめて再現し、
+ベース×効果レアリティの同時分布、1回あたりの期待売却ゴールド、ATK/DEF の分布を出力する。
+--write-html を付けると kakuritu.html の確率表を RARITY_WEIGHTS から作り直す。
+
+    python gacha_simulator.py --draws 1000000 --seed 42
+    python gacha_simulator.py --pool vip
+    python gacha_simulator.py --pool drop --write-html kakuritu.html
+"""
+import argparse
+import re
+import sys
+from typing import Dict, List, Mapping, NamedTuple, Optional
+
+import numpy as np
+
+from rpg_data import (
+    GACHA_SETTINGS, RARITY_WEIGHTS, RARITY_ORDER, RARITY_PROBABILITIES, SELL_PRICES
+)
+from rpg_catalog import CATALOG
+from rpg_sampler import RARITY_SAMPLER, build_gacha_samplers
+
+RARITIES: List[str] = sorted(RARITY_ORDER, key=RARITY_ORDER.get)
+ITEM_TYPES = ("weapon", "armor")
+DROP_POOL_KEY = "drop"
+CHUNK_SIZE = 1_000_000
+# ATK/DEF のヒストグラムの範囲 (負の補正を持つ効果があるため下限に余裕を持たせる)
+STAT_OFFSET = 64
+
+
+class PoolSpec(NamedTuple):
+    key: str
+    name: str
+    cost: int
+    base_probs: np.ndarray
+    effect_probs: np.ndarray
+
+
+class PoolResult(NamedTuple):
+    spec: PoolSpec
+    draws: int
+    joint_counts: np.ndarray
+    gold_total: int
+    atk_hist: np.ndarray
+    def_hist: np.ndarray
+
+
+class CatalogArrays:
+    """
+    カタログを (タイプ, レアリティ) 順に並べた平坦な配列と、各グループの開始位置・件数。
+    該当アイテムの無い組み合わせは本番と同じく common にフォールバックし、
+    該当効果の無いレアリティは末尾の「効果なし」(補正0) を指す。
+    """
+
+    def __init__(self):
+        item_atk: List[int] = []
+        item_def: List[int] = []
+        self.item_offsets = np.zeros((len(ITEM_TYPES), len(RARITIES)), dtype=np.int64)
+        self.item_counts = np.zeros((len(ITEM_TYPES), len(RARITIES)), dtype=np.int64)
+        for t, item_type in enumerate(ITEM_TYPES):
+            for r, rarity in enumerate(RARITIES):
+                items = CATALOG.items_by_key.get((item_type, rarity), ())
+                self.item_offsets[t, r] = len(item_atk)
+                self.item_counts[t, r] = len(items)
+                item_atk.extend(item.base_attack for item in items)
+                item_def.extend(item.base_defense for item in items)
+            if self.item_counts[t, 0] == 0:
+                raise ValueError(f"No common {item_type} in catalog; drops cannot fall back.")
+            for r in range(len(RARITIES)):
+                if self.item_counts[t, r] == 0:
+                    self.item_offsets[t, r] = self.item_offsets[t, 0]
+                    self.item_counts[t, r] = self.item_counts[t, 0]
+        self.item_atk = np.asarray(item_atk, dtype=np.int64)
+        self.item_def = np.asarray(item_def, dtype=np.int64)
+
+        effect_atk: List[int] = []
+        effect_def: List[int] = []
+        self.effect_offsets = np.zeros(len(RARITIES), dtype=np.int64)
+        self.effect_counts = np.zeros(len(RARITIES), dtype=np.int64)
+        for r, rarity in enumerate(RARITIES):
+            effects = CATALOG.effects_by_rarity.get(rarity, ())
+            self.effect_offsets[r] = len(effect_atk)
+            self.effect_counts[r] = len(effects)
+            effect_atk.extend(effect.attack_bonus for effect in effects)
+            effect_def.extend(effect.defense_bonus for effect in effects)
+        no_effect_index = len(effect_atk)
+        effect_atk.append(0)
+        effect_def.append(0)
+        for r in range(len(RARITIES)):
+            if self.effect_counts[r] == 0:
+                self.effect_offsets[r] = no_effect_index
+                self.effect_counts[r] = 1
+        self.effect_atk = np.asarray(effect_atk, dtype=np.int64)
+        self.effect_def = np.asarray(effect_def, dtype=np.int64)
+
+        self.stat_size = int(max(self.item_atk.max() + self.effect_atk.max(), self.item_def.max() + self.effect_def.max())) + STAT_OFFSET + 1
+        self.sell_prices = np.asarray([SELL_PRICES.get(rarity, 0) for rarity in RARITIES], dtype=np.int64)
+
+
+def _probs(weights: Mapping[str, float]) -> np.ndarray:
+    probs = np.asarray([float(weights.get(rarity, 0.0)) for rarity in RARITIES])
+    return probs / probs.sum()
+
+
+def build_pool_specs() -> Dict[str, PoolSpec]:
+    """本番と同じサンプラーの重みから各プールの確率ベクトルを作る。"""
+    specs = {DROP_POOL_KEY: PoolSpec(DROP_POOL_KEY, "レベルアップドロップ", 0,
+                                     _probs(RARITY_SAMPLER.weights), _probs(RARITY_SAMPLER.weights))}
+    for gacha_key, samplers in build_gacha_samplers(GACHA_SETTINGS).items():
+        info = GACHA_SETTINGS[gacha_key]
+        specs[gacha_key] = PoolSpec(gacha_key, info.get("name", gacha_key), int(info.get("cost_single", 0)),
+                                    _probs(samplers.base.weights), _probs(samplers.effect.weights))
+    return specs
+
+
+def simulate_pool(spec: PoolSpec, arrays: CatalogArrays, draws: int, rng: np.random.Generator) -> PoolResult:
+    n_rarities = len(RARITIES)
+    joint_counts = np.zeros(n_rarities * n_rarities, dtype=np.int64)
+    atk_hist = np.zeros(arrays.stat_size, dtype=np.int64)
+    def_hist = np.zeros(arrays.stat_size, dtype=np.int64)
+    gold_total = 0
+
+    remaining = draws
+    while remaining > 0:
+        m = min(remaining, CHUNK_SIZE)
+        remaining -= m
+
+        base = rng.choice(n_rarities, size=m, p=spec.base_probs)
+        item_type = rng.integers(0, len(ITEM_TYPES), size=m)
+        counts = arrays.item_counts[item_type, base]
+        item_idx = arrays.item_offsets[item_type, base] + (rng.random(m) * counts).astype(np.int64)
+
+        effect = rng.choice(n_rarities, size=m, p=spec.effect_probs)
+        effect_idx = arrays.effect_offsets[effect] + (rng.random(m) * arrays.effect_counts[effect]).astype(np.int64)
+
+        atk = arrays.item_atk[item_idx] + arrays.effect_atk[effect_idx] + STAT_OFFSET
+        dfn = arrays.item_def[item_idx] + arrays.effect_def[effect_idx] + STAT_OFFSET
+        atk_hist += np.bincount(atk, minlength=arrays.stat_size)
+        def_hist += np.bincount(dfn, minlength=arrays.stat_size)
+        joint_counts += np.bincount(base * n_rarities + effect, minlength=n_rarities * n_rarities)
+        # 売却額はベースアイテムのレアリティで決まる
+        gold_total += int(arrays.sell_prices[base].sum())
+
+    return PoolResult(spec, draws, joint_counts.reshape(n_rarities, n_rarities), gold_total, atk_hist, def_hist)
+
+
+def _hist_summary(hist: np.ndarray) -> str:
+    values = np.arange(hist.size) - STAT_OFFSET
+    total = hist.sum()
+    mean = float((values * hist).sum()) / total
+    std = (float(((values - mean) ** 2 * hist).sum()) / total) ** 0.5
+    cumulative = np.cumsum(hist)
+    p50, p90, p99 = (int(values[np.searchsorted(cumulative, q * total)]) for q in (0.5, 0.9, 0.99))
+    nonzero = np.nonzero(hist)[0]
+    return (f"mean {mean:7.2f}  std {std:6.2f}  min {int(values[nonzero[0]]):4d}  "
+            f"p50 {p50:4d}  p90 {p90:4d}  p99 {p99:4d}  max {int(values[nonzero[-1]]):4d}")
+
+
+def format_report(result: PoolResult) -> str:
+    spec = result.spec
+    n = result.draws
+    lines = [f"=== {spec.key}: {spec.name} ({n:,} draws) ==="]
+
+    theory = np.outer(spec.base_probs, spec.effect_probs)
+    empirical = result.joint_counts / n
+    # 各セルの標準誤差で割った最大ずれ (3σ を超えるなら抽選の実装が確率表とずれている)
+    stderr = np.sqrt(np.maximum(theory * (1 - theory), 1e-300) / n)
+    z = np.where(theory > 0, np.abs(empirical - theory) / stderr, np.where(empirical > 0, np.inf, 0.0))
+
+    used_base = [r for r in range(len(RARITIES)) if spec.base_probs[r] > 0 or result.joint_counts[r].any()]
+    used_effect = [e for e in range(len(RARITIES)) if spec.effect_probs[e] > 0 or result.joint_counts[:, e].any()]
+    lines.append("base \\ effect  " + "".join(f"{RARITIES[e]:>20}" for e in used_effect))
+    for r in used_base:
+        cells = "".join(f"{empirical[r, e] * 100:9.4f}% ({theory[r, e] * 100:7.4f})" for e in used_effect)
+        lines.append(f"{RARITIES[r]:<14} {cells}")
+    lines.append(f"max |z| vs theory: {float(z.max()):.2f}")
+
+    expected_gold = result.gold_total / n
+    theory_gold = float((spec.base_probs * np.asarray([SELL_PRICES.get(r, 0) for r in RARITIES])).sum())
+    gold_line = f"sell gold / pull: {expected_gold:,.1f} (theory {theory_gold:,.1f})"
+    if spec.cost:
+        gold_line += f"  cost {spec.cost:,}  net {expected_gold - spec.cost:,.1f}  return {expected_gold / spec.cost:.2%}"
+    lines.append(gold_line)
+    lines.append(f"ATK  {_hist_summary(result.atk_hist)}")
+    lines.append(f"DEF  {_hist_summary(result.def_hist)}")
+    return "\n".join(lines)
+
+
+def _percent_label(probability: float) -> str:
+    return f"{round(probability * 100, 1):g}%"
+
+
+def build_probability_table(weights: Mapping[str, float] = RARITY_WEIGHTS) -> str:
+    """kakuritu.html の <table> 部分 (装備レアリティ × 効果レアリティの同時確率) を作る。"""
+    probs = _probs(weights)
+    headers = [f"{rarity.capitalize()} ({_percent_label(p)})" for rarity, p in zip(RARITIES, probs)]
+    rows = ["    <table>",
+            "        <caption>RPG Equipment and Effect Rarity Probability Table</caption>",
+            "        <tr>",
+            "            <th>Equipment \\ Effect</th>"]
+    rows.extend(f"            <th>{header}</th>" for header in headers)
+    rows.append("        </tr>")
+    for r, header in enumerate(headers):
+        rows.append("        <tr>")
+        rows.append(f"            <td>{header}</td>")
+        rows.extend(f"            <td>{probs[r] * probs[e] * 100:.4f}%</td>" for e in range(len(RARITIES)))
+        rows.append("        </tr>")
+    rows.append("    </table>")
+    return "\n".join(rows)
+
+
+def write_probability_html(path: str):
+    """既存ファイルの <table>...</table> だけを差し替える (スタイル等はそのまま)。"""
+    with open(path, encoding="utf-8") as f:
+        html = f.read()
+    new_html, replaced = re.subn(r"[ \t]*<table>.*?</table>", lambda _: build_probability_table(), html, count=1, flags=re.S)
+    if not replaced:
+        raise ValueError(f"No <table> found in {path}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(new_html)
+
+
+def check_probability_strings() -> List[str]:
+    """RARITY_PROBABILITIES と各ガチャ説明文の提供割合が実際の重みと一致しているか調べる。"""
+    problems = []
+    for rarity, label in RARITY_PROBABILITIES.items():
+        expected = f"{RARITY_WEIGHTS[rarity] / sum(RARITY_WEIGHTS.values()) * 100:.1f}%"
+        if label != expected:
+            problems.append(f"RARITY_PROBABILITIES[{rarity!r}] = {label!r}, expected {expected!r}")
+    for gacha_key, info in GACHA_SETTINGS.items():
+        pool = info.get("rarity_pool") or {}
+        total = sum(pool.values())
+        listed = [float(value) for value in re.findall(r"(\d+(?:\.\d+)?)%", info.get("description", ""))]
+        expected = [pool[rarity] / total * 100 for rarity in RARITIES if pool.get(rarity, 0) > 0] if total else []
+        if len(listed) != len(expected) or any(abs(a - b) > 0.0005 for a, b in zip(listed, expected)):
+            problems.append(f"GACHA_SETTINGS[{gacha_key!r}] description lists {listed}, pool gives {[round(p, 3) for p in expected]}")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    specs = build_pool_specs()
+    parser = argparse.ArgumentParser(description="ガチャ / ドロップ確率のモンテカルロシミュレーター")
+    parser.add_argument("--draws", type=int, default=1_000_000, help="プールごとの試行回数")
+    parser.add_argument("--seed", type=int, default=None, help="乱数シード (再現用)")
+    parser.add_argument("--pool", choices=["all", *specs], default="all", help="対象のプール (drop はレベルアップドロップ)")
+    parser.add_argument("--write-html", metavar="PATH", help="確率表 (kakuritu.html) を RARITY_WEIGHTS から作り直す")
+    args = parser.parse_args(argv)
+
+    if args.draws <= 0:
+        parser.error("--draws must be positive")
+
+    rng = np.random.default_rng(args.seed)
+    arrays = CatalogArrays()
+    keys = list(specs) if args.pool == "all" else [args.pool]
+    for key in keys:
+        print(format_report(simulate_pool(specs[key], arrays, args.draws, rng)))
+        print()
+
+    print("RARITY_PROBABILITIES: " + ", ".join(f"{r}={RARITY_PROBABILITIES.get(r, '?')}" for r in RARITIES))
+    problems = check_probability_strings()
+    for problem in problems:
+        print(f"WARNING: {problem}")
+
+    if args.write_html:
+        write_probability_html(args.write_html)
+        print(f"Wrote probability table to {args.write_html}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
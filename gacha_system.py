@@ -6,168 +6,74 @@ from typing import Dict, List, Tuple, Optional, TYPE_CHECKING
 
 from rpg_data import (
     SELL_PRICES, RARITY_ORDER, RARITY_WEIGHTS, TOTAL_RARITY_WEIGHT,
-    INVENTORY_LIMIT, RARITY_PROBABILITIES
+    RARITY_PROBABILITIES, GACHA_SETTINGS, GACHA_CHOICE_TTL_SECONDS
 )
-from rpg_views import GachaResultView
-from rpg_utils import transaction
+from rpg_views import GachaResultView, GachaMultiResultView
+from rpg_catalog import CATALOG, NO_EFFECT
+from rpg_sampler import build_gacha_samplers
+from rpg_ledger import apply_gold
 
 if TYPE_CHECKING:
     from RPG_cog import RPG
 
 logger = logging.getLogger('SophiaBot.GachaSystem')
 
-GACHA_SETTINGS: Dict[str, Dict] = {
-    "junk": {
-        "name": "ジャンクパーツ詰め合わせ",
-        "cost_single": 5000,
-        "rarity_pool": {"common": 0.60, "uncommon": 0.29, "rare": 0.10, "epic": 0.01},
-        "guaranteed_rarity_above_single": None,
-        "description": (
-            "```\n"
-            "ガラクタの山から掘り出し物が見つかるかも？ハードオフよりはマシ\n\n"
-            "ベースアイテム提供割合:\n"
-            "コモン:　　　　　60.000%\n"
-            "アンコモン:　　　29.000%\n"
-            "レア:　　　　　　10.000%\n"
-            "エピック:　　 　　1.000%\n\n"
-            "(効果のレアリティは上記とは別に抽選されます)\n"
-            "```\n\n"
-        )
-    },
-    "influencer": {
-        "name": "インフルエンサーおすすめセット",
-        "cost_single": 30000,
-        "rarity_pool": {"uncommon": 0.50, "rare": 0.33, "epic": 0.15, "legendary": 0.02},
-        "guaranteed_rarity_above_single": "uncommon",
-        "description": (
-            "```\n"
-            "あの人も使ってる最新トレンドアイテム！（PR案件）\n\n"
-            "ベースアイテム提供割合:\n"
-            "アンコモン:　　　50.000%\n"
-            "レア:　　　　　　33.000%\n"
-            "エピック:　　　　15.000%\n"
-            "レジェンダリー:　 2.000%\n\n"
-            "(効果のレアリティは上記とは別に抽選されます)\n"
-            "```\n\n"
-        )
-    },
-    "vip": {
-        "name": "VIP供給品",
-        "cost_single": 100000,
-        "rarity_pool": {"legendary": 0.70, "mythic": 0.25, "unique": 0.05},
-        "guaranteed_rarity_above_single": "legendary",
-        "description": (
-            "```\n"
-            "選ばれし者のみが手にできる至高の逸品。\n\n"
-            "ベースアイテム提供割合:\n"
-            "レジェンダリー:　70.000%\n"
-            "ミシック:　　　　25.000%\n"
-            "ユニーク:　　　　 5.000%\n\n"
-            "(効果のレアリティは上記とは別に抽選されます)\n"
-            "```"
-        )
-    }
-}
+GACHA_SAMPLERS = build_gacha_samplers(GACHA_SETTINGS)
+GACHA_DRAW_COUNTS = (1, 10, 100)
+
+
+class GachaInsufficientGoldError(Exception):
+    """精算時に所持ゴールドが足りなかった場合にトランザクションを巻き戻すための例外。"""
 
 class GachaSystem:
     def __init__(self, bot, rpg_cog: 'RPG'):
         self.bot = bot
         self.rpg_cog = rpg_cog
         self.gacha_settings = GACHA_SETTINGS
+        self.gacha_samplers = GACHA_SAMPLERS
 
-    async def _draw_single_item(self, gacha_type_key: str) -> Optional[Tuple[int, str, str, str, int, str, str]]:
-        if gacha_type_key not in self.gacha_settings:
+    def _draw_single_item(self, gacha_type_key: str) -> Optional[Tuple[int, str, str, str, int, str, str]]:
+        samplers = self.gacha_samplers.get(gacha_type_key)
+        if samplers is None:
             logger.error(f"Unknown gacha type in _draw_single_item: {gacha_type_key}")
             return None
+        return self._build_drawn_item(gacha_type_key, samplers.base.sample(), samplers.effect.sample())
 
-        gacha_info = self.gacha_settings[gacha_type_key]
-        base_item_rarity_pool = gacha_info["rarity_pool"]
-        guaranteed_rarity_threshold = gacha_info.get("guaranteed_rarity_above_single")
-
-        chosen_base_rarity: Optional[str] = None
-        current_抽選プール: Dict[str, float] = {}
-
-        if guaranteed_rarity_threshold:
-            for rarity, weight in base_item_rarity_pool.items():
-                if RARITY_ORDER.get(rarity, 0) >= RARITY_ORDER.get(guaranteed_rarity_threshold, 0):
-                    current_抽選プール[rarity] = weight
-            if not current_抽選プール:
-                logger.warning(f"Gacha '{gacha_type_key}' guaranteed threshold '{guaranteed_rarity_threshold}' not met by pool. Using full defined pool.")
-                current_抽選プール = base_item_rarity_pool
-        else:
-            current_抽選プール = base_item_rarity_pool
-
-        total_current_weight = sum(current_抽選プール.values())
-        if total_current_weight > 0 and current_抽選プール:
-            chosen_base_rarity = random.choices(list(current_抽選プール.keys()), weights=list(current_抽選プール.values()), k=1)[0]
-        else:
-            logger.error(f"Gacha '{gacha_type_key}' has a total weight of 0 or empty pool for its current rarity pool ({current_抽選プール}). Cannot draw base rarity.")
-            if TOTAL_RARITY_WEIGHT > 0 and RARITY_WEIGHTS:
-                chosen_base_rarity = random.choices(list(RARITY_WEIGHTS.keys()), weights=list(RARITY_WEIGHTS.values()), k=1)[0]
-                logger.warning(f"Fell back to global rarity weights, chose: {chosen_base_rarity}")
-            else:
-                logger.critical(f"CRITICAL: Global RARITY_WEIGHTS are also invalid. Cannot determine base rarity for '{gacha_type_key}'.")
-                return None
-
-        if not chosen_base_rarity:
-             logger.critical(f"CRITICAL: Failed to determine chosen_base_rarity for gacha '{gacha_type_key}' after fallbacks.")
-             return None
+    def _draw_items(self, gacha_type_key: str, count: int) -> List[Tuple[int, str, str, str, int, str, str]]:
+        """count 回分のレアリティをまとめて抽選し、アイテムを組み立てる。失敗した抽選は含まない。"""
+        samplers = self.gacha_samplers.get(gacha_type_key)
+        if samplers is None:
+            logger.error(f"Unknown gacha type in _draw_items: {gacha_type_key}")
+            return []
+        base_rarities = samplers.base.sample_many(count)
+        effect_rarities = samplers.effect.sample_many(count)
+        drawn = (self._build_drawn_item(gacha_type_key, b, e) for b, e in zip(base_rarities, effect_rarities))
+        return [item for item in drawn if item is not None]
 
+    def _build_drawn_item(self, gacha_type_key: str, chosen_base_rarity: str, chosen_effect_rarity: str) -> Optional[Tuple[int, str, str, str, int, str, str]]:
         new_item_type = random.choice(["weapon", "armor"])
         new_item_type_display = "武器" if new_item_type == "weapon" else "防具"
-        async with self.bot.db.execute("SELECT item_id, base_name FROM items WHERE type = ? AND rarity = ? ORDER BY RANDOM() LIMIT 1", (new_item_type, chosen_base_rarity)) as cursor:
-            item_row = await cursor.fetchone()
+        base_item = CATALOG.random_item(new_item_type, chosen_base_rarity)
 
-        if not item_row:
+        if not base_item:
             logger.error(f"No base item found for gacha '{gacha_type_key}', type: {new_item_type}, chosen_rarity: {chosen_base_rarity}. Attempting fallback to 'common'.")
-            async with self.bot.db.execute("SELECT item_id, base_name FROM items WHERE type = ? AND rarity = 'common' ORDER BY RANDOM() LIMIT 1", (new_item_type,)) as fallback_cursor:
-                item_row = await fallback_cursor.fetchone()
-            if not item_row:
+            base_item = CATALOG.random_item(new_item_type, "common")
+            if not base_item:
                 logger.error(f"Fallback failed: No common {new_item_type} found. Cannot provide item for this draw.")
                 return None
-            new_item_base_id, new_item_base_name = item_row
             original_chosen_rarity = chosen_base_rarity
             chosen_base_rarity = "common"
-            logger.info(f"Fell back to common item: {new_item_base_name} (original intended rarity: {original_chosen_rarity})")
-        else:
-            new_item_base_id, new_item_base_name = item_row
-
-        effect_rarity_pool = gacha_info["rarity_pool"]
-        total_effect_pool_weight = sum(effect_rarity_pool.values())
-        chosen_effect_rarity: Optional[str] = None
-
-        if total_effect_pool_weight > 0 and effect_rarity_pool:
-            chosen_effect_rarity = random.choices(list(effect_rarity_pool.keys()), weights=list(effect_rarity_pool.values()), k=1)[0]
-        else:
-            logger.warning(f"Gacha '{gacha_type_key}' has total weight 0 or empty pool for effect rarity. Fallback to global weights.")
-            if TOTAL_RARITY_WEIGHT > 0 and RARITY_WEIGHTS:
-                chosen_effect_rarity = random.choices(list(RARITY_WEIGHTS.keys()), weights=list(RARITY_WEIGHTS.values()), k=1)[0]
-                logger.warning(f"Fell back to global rarity weights for effect, chose: {chosen_effect_rarity}")
-            else:
-                logger.critical(f"CRITICAL: Global RARITY_WEIGHTS also invalid for effect. Cannot determine effect rarity for '{gacha_type_key}'.")
-                chosen_effect_rarity = "N/A" # 効果レアリティ不明
-
-        if not chosen_effect_rarity or chosen_effect_rarity == "N/A":
-            logger.warning(f"Effect rarity determination failed for gacha '{gacha_type_key}'. Assigning 'no effect'.")
-            async with self.bot.db.execute("SELECT effect_id, prefix_name FROM effects WHERE effect_id = 0") as c_no_effect:
-                no_effect_row = await c_no_effect.fetchone()
-            if no_effect_row: new_effect_id, new_effect_name_prefix = no_effect_row
-            else: new_effect_id, new_effect_name_prefix = 0, ""
+            logger.info(f"Fell back to common item: {base_item.base_name} (original intended rarity: {original_chosen_rarity})")
+        new_item_base_id, new_item_base_name = base_item.item_id, base_item.base_name
+
+        effect = CATALOG.random_effect(chosen_effect_rarity)
+        if not effect:
+            logger.warning(f"No effect found for chosen rarity '{chosen_effect_rarity}' in gacha '{gacha_type_key}'. Assigning 'no effect'.")
+            effect = NO_EFFECT
             chosen_effect_rarity = "N/A"
-        else:
-            async with self.bot.db.execute("SELECT effect_id, prefix_name FROM effects WHERE rarity = ? ORDER BY RANDOM() LIMIT 1", (chosen_effect_rarity,)) as cursor:
-                effect_row = await cursor.fetchone()
-            if not effect_row:
-                logger.warning(f"No effect found for chosen rarity '{chosen_effect_rarity}' in gacha '{gacha_type_key}'. Assigning 'no effect'.")
-                async with self.bot.db.execute("SELECT effect_id, prefix_name FROM effects WHERE effect_id = 0") as c_no_effect:
-                    no_effect_row = await c_no_effect.fetchone()
-                if no_effect_row: new_effect_id, new_effect_name_prefix = no_effect_row
-                else: new_effect_id, new_effect_name_prefix = 0, ""
-                chosen_effect_rarity = "N/A"
-            else:
-                new_effect_id, new_effect_name_prefix = effect_row
+        new_effect_id, new_effect_name_prefix = effect.effect_id, effect.prefix_name
 
-        logger.info(f"Gacha draw successful for '{gacha_type_key}': {new_effect_name_prefix or ''}{new_item_base_name} (Item: {chosen_base_rarity}, Effect: {chosen_effect_rarity})")
+        logger.debug(f"Gacha draw successful for '{gacha_type_key}': {new_effect_name_prefix or ''}{new_item_base_name} (Item: {chosen_base_rarity}, Effect: {chosen_effect_rarity})")
         return (new_item_base_id, new_item_base_name, chosen_base_rarity, new_item_type_display,
                 new_effect_id, new_effect_name_prefix or "", chosen_effect_rarity)
 
@@ -175,14 +81,15 @@ class GachaSystem:
         """
         ユーザーがガチャの種類を選んだ後に呼び出される実際のガチャ処理。
         interaction は既に ephemeral=True で defer されている想定。
-        num_draws は常に1 (単発ガチャのみのため)。
+        num_draws は GACHA_DRAW_COUNTS のいずれか (単発 / 10連 / 100連)。
         """
         user_id = interaction.user.id
         guild_id = interaction.guild.id
 
-        if num_draws != 1:
-            logger.error(f"User {user_id} attempted gacha with num_draws={num_draws}. This system is single-draw only. Forcing to 1.")
-            num_draws = 1 # 強制的に単発にする
+        if num_draws not in GACHA_DRAW_COUNTS:
+            logger.error(f"User {user_id} attempted gacha with unsupported num_draws={num_draws}.")
+            await interaction.followup.send(f"その回数 ({num_draws}回) のガチャは用意してないんだ。ごめんね！", ephemeral=True)
+            return
 
         if gacha_type_key not in self.gacha_settings:
             logger.warning(f"User {user_id} attempted to draw unknown gacha type: {gacha_type_key}")
@@ -190,23 +97,34 @@ class GachaSystem:
             return
 
         gacha_info = self.gacha_settings[gacha_type_key]
-        cost = gacha_info["cost_single"]
-        required_inventory_space = 1
+        cost = gacha_info["cost_single"] * num_draws
 
-        async with self.bot.db.execute("SELECT gold FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
-            user_gold_row = await cursor.fetchone()
-        current_gold = user_gold_row[0] if user_gold_row else 0
+        # 残高確認から精算までを同じユーザーの他のゴールド操作と直列化する
+        async with self.rpg_cog.user_locks.hold(user_id, guild_id):
+            profile = await self.rpg_cog.profile_cache.get(user_id, guild_id)
+            current_gold = profile.gold if profile else 0
 
-        if current_gold < cost:
-            await interaction.followup.send(
-                f"おっと、**{gacha_info['name']}** を引くには **{cost}G** 必要だけど、君は今 **{current_gold}G** しか持ってないみたいだね。\n"
-                "もう少し懐を温めてから、また挑戦しに来ておくれ！世の中そんなに甘くないのさ。",
-                ephemeral=True
-            )
-            return
+            if current_gold < cost:
+                await interaction.followup.send(
+                    f"おっと、**{gacha_info['name']}** を{num_draws}回引くには **{cost}G** 必要だけど、君は今 **{current_gold}G** しか持ってないみたいだね。\n"
+                    "もう少し懐を温めてから、また挑戦しに来ておくれ！世の中そんなに甘くないのさ。",
+                    ephemeral=True
+                )
+                return
+
+            if num_draws == 1:
+                await self._execute_single_draw(interaction, gacha_type_key, gacha_info, cost)
+            else:
+                await self._execute_multi_draw(interaction, gacha_type_key, gacha_info, num_draws, cost)
+
+    async def _execute_single_draw(self, interaction: discord.Interaction, gacha_type_key: str, gacha_info: Dict, cost: int):
+        user_id = interaction.user.id
+        guild_id = interaction.guild.id
+        required_inventory_space = 1
 
-        async with self.bot.db.execute("SELECT COUNT(*) FROM inventory WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
-            count_row = await cursor.fetchone()
+        async with self.bot.db.read() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM inventory WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+                count_row = await cursor.fetchone()
         current_inventory_count = count_row[0] if count_row else 0
         available_slots = self.rpg_cog.inventory_limit - current_inventory_count
 
@@ -220,19 +138,23 @@ class GachaSystem:
             return
 
         try:
-            async with transaction(self.bot.db):
-                await self.bot.db.execute("UPDATE users SET gold = gold - ? WHERE user_id = ? AND guild_id = ?", (cost, user_id, guild_id))
+            async with self.bot.db.write() as conn:
+                if not await apply_gold(conn, user_id, guild_id, -cost, "gacha", (f"{gacha_type_key}x1",), require_funds=True):
+                    raise GachaInsufficientGoldError()
+            self.rpg_cog.profile_cache.adjust_gold(user_id, guild_id, -cost)
             logger.info(f"User {user_id} spent {cost}G on gacha: {gacha_type_key} x1")
+        except GachaInsufficientGoldError:
+            self.rpg_cog.profile_cache.invalidate(user_id, guild_id)
+            await interaction.followup.send(f"おっと、支払いの直前に所持ゴールドが **{cost}G** を下回っちゃったみたい。今回はやめておこうか。", ephemeral=True)
+            return
         except Exception as e:
+            self.rpg_cog.profile_cache.invalidate(user_id, guild_id)
             logger.error(f"Gacha coin deduction error for user {user_id} (gacha: {gacha_type_key}): {e}", exc_info=True)
             await interaction.followup.send("おっと、コインの処理でエラーが起きちゃったみたいだ…。サーバーが混み合ってるのかも？\nごめんね、もう一度試してみて。", ephemeral=True)
             return
 
-        drawn_items_details: List[Optional[Tuple[int, str, str, str, int, str, str]]] = []
-        item_tuple = await self._draw_single_item(gacha_type_key)
-        drawn_items_details.append(item_tuple)
-
-        if not any(drawn_items_details):
+        item_tuple = self._draw_single_item(gacha_type_key)
+        if item_tuple is None:
             logger.warning(f"Gacha for user {user_id} (gacha: {gacha_type_key} x1) resulted in all None items.")
             await interaction.followup.send(
                 "うーん、今回は残念ながら何も出なかったみたい…まるで蜃気楼だったね！\n"
@@ -241,18 +163,99 @@ class GachaSystem:
             )
             return
 
-        gacha_result_view = GachaResultView(
-            bot=self.bot,
-            rpg_cog=self.rpg_cog,
+        (new_item_base_id, new_item_base_name, new_item_base_rarity, new_item_type_display,
+         new_effect_id, new_effect_name_prefix, new_effect_rarity) = item_tuple
+        prob_item = (RARITY_WEIGHTS.get(new_item_base_rarity, 0) / TOTAL_RARITY_WEIGHT) if TOTAL_RARITY_WEIGHT > 0 else 0
+        prob_effect = (RARITY_WEIGHTS.get(new_effect_rarity, 0) / TOTAL_RARITY_WEIGHT) if TOTAL_RARITY_WEIGHT > 0 else 0
+        combined_prob_percent = prob_item * prob_effect * 100
+
+        embed = discord.Embed(
+            title=f"ガチャ結果: {gacha_info['name']}",
+            description=(
+                f"{interaction.user.mention}さん、見てみて！こんなのが出たよ！\n\n"
+                f"**{new_effect_name_prefix}{new_item_base_name}**\n"
+                f"　┣ 装備タイプ: {new_item_type_display}\n"
+                f"　┣ 装備レアリティ: {new_item_base_rarity} ({RARITY_PROBABILITIES.get(new_item_base_rarity, 'N/A')})\n"
+                f"　┣ 効果レアリティ: {new_effect_rarity} ({RARITY_PROBABILITIES.get(new_effect_rarity, 'N/A')})\n"
+                f"　┗ 組み合わせ出現率: {combined_prob_percent:.3f}%\n\n"
+                "このアイテム、どうする？"
+            ),
+            color=discord.Color.gold()
+        )
+        embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
+        embed.set_footer(text="選択肢のタイムアウトは3分です。")
+
+        # 引いたアイテムは保管/売却が押されるまで pending_actions に置く (再起動しても期限内なら選べる)
+        token = await self.rpg_cog.pending_actions.create(
+            "gacha", user_id, guild_id, {"item_id": new_item_base_id, "effect_id": new_effect_id}, GACHA_CHOICE_TTL_SECONDS)
+        view = GachaResultView(user_id, token, SELL_PRICES.get(new_item_base_rarity, 0))
+        await interaction.followup.send(embed=embed, view=view, ephemeral=False)
+
+    async def _execute_multi_draw(self, interaction: discord.Interaction, gacha_type_key: str, gacha_info: Dict, num_draws: int, cost: int):
+        """
+        連続ガチャ。全件をメモリ上で抽選し、金額の精算とインベントリへの追加を1トランザクションで行う。
+        インベントリに入りきらない分はレアリティの低いものから自動で売却する。
+        """
+        user_id = interaction.user.id
+        guild_id = interaction.guild.id
+
+        drawn_items = self._draw_items(gacha_type_key, num_draws)
+        if not drawn_items:
+            logger.warning(f"Gacha for user {user_id} (gacha: {gacha_type_key} x{num_draws}) resulted in all None items.")
+            await interaction.followup.send("うーん、ガチャの機械が動かなかったみたい…。ゴールドは減ってないから安心してね。", ephemeral=True)
+            return
+        if len(drawn_items) != num_draws:
+            # 失敗した抽選の分は請求しない
+            logger.warning(f"Gacha for user {user_id} (gacha: {gacha_type_key} x{num_draws}) drew only {len(drawn_items)} items.")
+            cost = gacha_info["cost_single"] * len(drawn_items)
+        drawn_count = len(drawn_items)
+
+        # 保管の優先順位: 装備レアリティ+効果レアリティの合計が高い順、同点なら先に出た順
+        ranked_indices = sorted(
+            range(len(drawn_items)),
+            key=lambda i: (-(RARITY_ORDER.get(drawn_items[i][2], 0) + RARITY_ORDER.get(drawn_items[i][6], 0)), i)
+        )
+
+        try:
+            async with self.bot.db.write() as conn:
+                async with conn.execute("SELECT COUNT(*) FROM inventory WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+                    count_row = await cursor.fetchone()
+                available_slots = max(0, self.rpg_cog.inventory_limit - (count_row[0] if count_row else 0))
+
+                kept_indices = set(ranked_indices[:available_slots])
+                sold_total = sum(SELL_PRICES.get(item[2], 0) for i, item in enumerate(drawn_items) if i not in kept_indices)
+
+                # 支払いと自動売却は台帳で別の記録にする (支払いの時点で cost 以上持っていることが条件)
+                if not await apply_gold(conn, user_id, guild_id, -cost, "gacha", (f"{gacha_type_key}x{drawn_count}",), require_funds=True):
+                    raise GachaInsufficientGoldError()
+                await apply_gold(conn, user_id, guild_id, sold_total, "gacha_sell",
+                                 (f"{drawn_items[i][0]}/{drawn_items[i][4]}" for i in range(len(drawn_items)) if i not in kept_indices))
+
+                if kept_indices:
+                    await conn.executemany(
+                        "INSERT INTO inventory (user_id, guild_id, item_id, effect_id) VALUES (?, ?, ?, ?)",
+                        [(user_id, guild_id, drawn_items[i][0], drawn_items[i][4]) for i in sorted(kept_indices)]
+                    )
+            self.rpg_cog.profile_cache.adjust_gold(user_id, guild_id, sold_total - cost)
+            logger.info(f"User {user_id} spent {cost}G on gacha: {gacha_type_key} x{drawn_count} (kept {len(kept_indices)}, auto-sold for {sold_total}G)")
+        except GachaInsufficientGoldError:
+            self.rpg_cog.profile_cache.invalidate(user_id, guild_id)
+            await interaction.followup.send(f"おっと、支払いの直前に所持ゴールドが **{cost}G** を下回っちゃったみたい。今回はやめておこうか。", ephemeral=True)
+            return
+        except Exception as e:
+            self.rpg_cog.profile_cache.invalidate(user_id, guild_id)
+            logger.error(f"Gacha multi-draw settlement error for user {user_id} (gacha: {gacha_type_key} x{num_draws}): {e}", exc_info=True)
+            await interaction.followup.send("おっと、コインの処理でエラーが起きちゃったみたいだ…。サーバーが混み合ってるのかも？\nごめんね、もう一度試してみて。", ephemeral=True)
+            return
+
+        results = [(item, i in kept_indices) for i, item in enumerate(drawn_items)]
+        result_view = GachaMultiResultView(
             user_id=user_id,
-            guild_id=guild_id,
-            drawn_items_details=drawn_items_details,
             gacha_name=gacha_info["name"],
-            rarity_probabilities=RARITY_PROBABILITIES,
-            rarity_weights=RARITY_WEIGHTS,
-            total_rarity_weight=TOTAL_RARITY_WEIGHT,
+            results=results,
+            total_cost=cost,
+            sold_total=sold_total,
             sell_prices=SELL_PRICES,
-            inventory_limit=INVENTORY_LIMIT
+            requested_draws=num_draws
         )
-        # interaction (元のコマンドの Interaction オブジェクト) を渡す
-        await gacha_result_view.send_initial_message(interaction)
+        await result_view.send_initial_message(interaction)
@@ -0,0 +1,123 @@
+# rpg_actions.py
+import json
+import logging
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+logger = logging.getLogger('SophiaBot.RPGActions')
+
+
+class PendingAction(NamedTuple):
+    token: int
+    kind: str
+    user_id: int
+    guild_id: int
+    payload: Dict[str, Any]
+    expires_at: float
+
+
+def _row_to_action(row) -> Optional[PendingAction]:
+    token, kind, user_id, guild_id, payload, expires_at = row
+    try:
+        data = json.loads(payload)
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Discarding unreadable pending action {token}: {e}")
+        return None
+    return PendingAction(token, kind, user_id, guild_id, data, expires_at)
+
+
+_SELECT_SQL = "SELECT token, kind, user_id, guild_id, payload, expires_at FROM pending_actions"
+
+
+class PendingActionStore:
+    """
+    ボタン・セレクトの押下を待っている操作を pending_actions テーブルに置いておく。
+    custom_id には token だけを入れ、押されたときに claim() で取り出す (取り出しと削除は同じトランザクションなので、
+    連打や複数の接続からの同時押しでも処理されるのは1回だけ)。再起動しても期限内なら押せる。
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def create(self, kind: str, user_id: int, guild_id: int, payload: Dict[str, Any], ttl_seconds: float) -> int:
+        data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        async with self.db.write() as conn:
+            cursor = await conn.execute(
+                "INSERT INTO pending_actions (kind, user_id, guild_id, payload, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, user_id, guild_id, data, time.time() + ttl_seconds))
+            return cursor.lastrowid
+
+    async def get(self, token: int, kind: str) -> Optional[PendingAction]:
+        """期限内の操作を消さずに読む。"""
+        async with self.db.read() as conn:
+            async with conn.execute(f"{_SELECT_SQL} WHERE token = ? AND kind = ? AND expires_at >= ?",
+                                    (token, kind, time.time())) as cursor:
+                row = await cursor.fetchone()
+        return _row_to_action(row) if row else None
+
+    async def update_payload(self, token: int, kind: str, payload: Dict[str, Any]) -> bool:
+        data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        async with self.db.write() as conn:
+            cursor = await conn.execute(
+                "UPDATE pending_actions SET payload = ? WHERE token = ? AND kind = ? AND expires_at >= ?",
+                (data, token, kind, time.time()))
+            return cursor.rowcount > 0
+
+    async def claim(self, token: int, kind: str, conn=None) -> Optional[PendingAction]:
+        """
+        期限内の操作を取り出して消す。既に処理済み・期限切れなら None。
+        conn を渡すと呼び出し側のトランザクションの中で取り出す (その後の書き込みが失敗すれば取り出しも巻き戻る)。
+        """
+        if conn is None:
+            async with self.db.write() as conn:
+                return await self.claim(token, kind, conn)
+        async with conn.execute(f"{_SELECT_SQL} WHERE token = ? AND kind = ? AND expires_at >= ?",
+                                (token, kind, time.time())) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        await conn.execute("DELETE FROM pending_actions WHERE token = ?", (token,))
+        return _row_to_action(row)
+
+    async def discard(self, token: int, kind: str):
+        async with self.db.write() as conn:
+            await conn.execute("DELETE FROM pending_actions WHERE token = ? AND kind = ?", (token, kind))
+
+    async def delete_expired(self, keep_kinds: Sequence[str] = (), now: Optional[float] = None) -> int:
+        """
+        期限切れの操作を消し、消した数を返す。keep_kinds の種類は時間切れ時の処理が要るので残す
+        (fetch_expired() で読み、処理と同じトランザクションの中で claim_expired() で消すこと)。
+        """
+        now = time.time() if now is None else now
+        sql = "DELETE FROM pending_actions WHERE expires_at < ?"
+        params: List[Any] = [now]
+        if keep_kinds:
+            sql += f" AND kind NOT IN ({', '.join('?' * len(keep_kinds))})"
+            params.extend(keep_kinds)
+        async with self.db.write() as conn:
+            cursor = await conn.execute(sql, params)
+        if cursor.rowcount:
+            logger.info(f"Expired {cursor.rowcount} pending actions.")
+        return cursor.rowcount
+
+    async def fetch_expired(self, kind: str, now: Optional[float] = None) -> List[PendingAction]:
+        """期限切れの kind の操作を消さずに読む。"""
+        now = time.time() if now is None else now
+        async with self.db.read() as conn:
+            async with conn.execute(f"{_SELECT_SQL} WHERE kind = ? AND expires_at < ? ORDER BY token",
+                                    (kind, now)) as cursor:
+                rows = await cursor.fetchall()
+        return [action for action in map(_row_to_action, rows) if action is not None]
+
+    async def claim_expired(self, token: int, kind: str, conn) -> Optional[PendingAction]:
+        """
+        期限切れの操作を取り出して消す (claim() の時間切れ版)。conn は時間切れ時の処理を行う
+        bot.db.write() のトランザクション内の接続を渡すこと。処理が失敗すれば操作は残り、次の掃除で再試行される。
+        """
+        async with conn.execute(f"{_SELECT_SQL} WHERE token = ? AND kind = ? AND expires_at < ?",
+                                (token, kind, time.time())) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        await conn.execute("DELETE FROM pending_actions WHERE token = ?", (token,))
+        return _row_to_action(row)
@@ -0,0 +1,90 @@
+# rpg_battle_store.py
+import json
+import logging
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from rpg_data import BATTLE_STATE_TTL_SECONDS, BATTLE_STATE_MAX_ROWS
+
+logger = logging.getLogger('SophiaBot.RPGBattleStore')
+
+
+class StoredBattle(NamedTuple):
+    user_id: int
+    guild_id: int
+    channel_id: int
+    message_id: int
+    enemy_key: str
+    state: Dict[str, Any]
+    updated_at: float
+
+
+class BattleStore:
+    """
+    進行中の戦闘を battles テーブルに保存し、再起動後に復元できるようにする。
+    1ユーザー1行で、ターンごとに上書きする。最後の更新から ttl_seconds を過ぎた行と、
+    max_rows を超えた古い行は purge() で消す。
+    """
+
+    def __init__(self, db, ttl_seconds: float = BATTLE_STATE_TTL_SECONDS, max_rows: int = BATTLE_STATE_MAX_ROWS):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+
+    async def save(self, user_id: int, guild_id: int, channel_id: int, message_id: int, enemy_key: str,
+                   state: Dict[str, Any]):
+        payload = json.dumps(state, ensure_ascii=False, separators=(",", ":"))
+        async with self.db.write() as conn:
+            await conn.execute(
+                "INSERT OR REPLACE INTO battles (user_id, guild_id, channel_id, message_id, enemy_key, state, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, guild_id, channel_id, message_id, enemy_key, payload, time.time()))
+
+    async def delete(self, user_id: int, conn=None):
+        """保存済みの戦闘を消す。conn を渡すと呼び出し側のトランザクションの中で消す。"""
+        if conn is not None:
+            await conn.execute("DELETE FROM battles WHERE user_id = ?", (user_id,))
+            return
+        async with self.db.write() as conn:
+            await conn.execute("DELETE FROM battles WHERE user_id = ?", (user_id,))
+
+    async def purge(self, now: Optional[float] = None) -> int:
+        """期限切れと上限超過の行を消し、消した行数を返す。"""
+        now = time.time() if now is None else now
+        async with self.db.write() as conn:
+            cursor = await conn.execute("DELETE FROM battles WHERE updated_at < ?", (now - self.ttl_seconds,))
+            removed = cursor.rowcount
+            cursor = await conn.execute(
+                "DELETE FROM battles WHERE user_id IN "
+                "(SELECT user_id FROM battles ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,))
+            removed += cursor.rowcount
+        if removed:
+            logger.info(f"Purged {removed} stale battle sessions.")
+        return removed
+
+    async def load_all(self) -> List[StoredBattle]:
+        """期限内の戦闘をすべて読み込む。壊れた行は消す。"""
+        await self.purge()
+        async with self.db.read() as conn:
+            async with conn.execute(
+                    "SELECT user_id, guild_id, channel_id, message_id, enemy_key, state, updated_at FROM battles") as cursor:
+                rows = await cursor.fetchall()
+
+        battles: List[StoredBattle] = []
+        broken: List[int] = []
+        for user_id, guild_id, channel_id, message_id, enemy_key, payload, updated_at in rows:
+            try:
+                state = json.loads(payload)
+                if not isinstance(state, dict):
+                    raise ValueError("state is not an object")
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Discarding unreadable battle state for user {user_id}: {e}")
+                broken.append(user_id)
+                continue
+            battles.append(StoredBattle(user_id, guild_id, channel_id, message_id, enemy_key, state, updated_at))
+
+        if broken:
+            async with self.db.write() as conn:
+                await conn.executemany("DELETE FROM battles WHERE user_id = ?", [(uid,) for uid in broken])
+        return battles
@@ -0,0 +1,195 @@
+# rpg_cache.py
+import logging
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+from rpg_catalog import CATALOG, ItemRecord, EffectRecord
+
+if TYPE_CHECKING:
+    from rpg_xp_buffer import XPAccumulator
+    from rpg_leaderboard import Leaderboards
+
+logger = logging.getLogger('SophiaBot.RPGCache')
+
+UserKey = Tuple[int, int]
+
+
+class EquippedItem(NamedTuple):
+    inventory_id: int
+    item: ItemRecord
+    effect: EffectRecord
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.effect.prefix_name}{self.item.base_name}"
+
+    @property
+    def attack(self) -> int:
+        return self.item.base_attack + self.effect.attack_bonus
+
+    @property
+    def defense(self) -> int:
+        return self.item.base_defense + self.effect.defense_bonus
+
+
+class EquipmentStats(NamedTuple):
+    """装備中の武器・防具と、その合計 ATK/DEF。装備が見つからないスロットは None。"""
+    weapon: Optional[EquippedItem]
+    armor: Optional[EquippedItem]
+
+    @property
+    def attack(self) -> int:
+        return sum(slot.attack for slot in (self.weapon, self.armor) if slot)
+
+    @property
+    def defense(self) -> int:
+        return sum(slot.defense for slot in (self.weapon, self.armor) if slot)
+
+
+def _equipped_item(inventory_id: Optional[int], item_id: Optional[int], effect_id: Optional[int]) -> Optional[EquippedItem]:
+    if not inventory_id or item_id is None:
+        return None
+    item = CATALOG.get_item(item_id)
+    if item is None:
+        logger.warning(f"Equipped inventory {inventory_id} refers to unknown item {item_id}.")
+        return None
+    return EquippedItem(inventory_id, item, CATALOG.get_effect(effect_id or 0))
+
+
+# users の1行と、装備中の2つのインベントリ行をまとめて引く (装備の能力値はカタログから計算する)
+_PROFILE_SQL = """
+    SELECT u.level, u.total_characters, u.gold, u.equipped_weapon, u.equipped_armor,
+           w.item_id, w.effect_id, a.item_id, a.effect_id
+    FROM users u
+    LEFT JOIN inventory w ON w.inventory_id = u.equipped_weapon AND w.user_id = u.user_id AND w.guild_id = u.guild_id
+    LEFT JOIN inventory a ON a.inventory_id = u.equipped_armor AND a.user_id = u.user_id AND a.guild_id = u.guild_id
+    WHERE u.user_id = ? AND u.guild_id = ?
+"""
+
+
+class UserProfile:
+    """users テーブルの1行分と、装備の能力値。"""
+    __slots__ = ("level", "total_characters", "gold", "equipped_weapon", "equipped_armor", "equipment")
+
+    def __init__(self, level: int, total_characters: int, gold: int, equipped_weapon: Optional[int], equipped_armor: Optional[int],
+                 equipment: Optional[EquipmentStats] = None):
+        self.level = level
+        self.total_characters = total_characters
+        self.gold = gold
+        self.equipped_weapon = equipped_weapon
+        self.equipped_armor = equipped_armor
+        # None は未計算。装備の変更やリロールで None に戻し、次の get_equipment() で読み直す
+        self.equipment = equipment
+
+
+class UserProfileCache:
+    """
+    (user_id, guild_id) をキーにした users 行の LRU キャッシュ。
+    users を更新する処理は、コミット後に必ずこのキャッシュの更新メソッドを呼ぶこと (write-through)。
+    level / total_characters は XPAccumulator の値を優先する。
+    """
+
+    def __init__(self, bot, xp_buffer: 'XPAccumulator', maxsize: int = 2048):
+        self.bot = bot
+        self.xp_buffer = xp_buffer
+        self.maxsize = maxsize
+        self._profiles: "OrderedDict[UserKey, UserProfile]" = OrderedDict()
+        # 書き込みのたびに進む世代番号。ロード中に書き込みがあった結果はキャッシュしない。
+        self._write_epoch = 0
+        # コミット後の更新を伝える先 (RPG cog が設定する)
+        self.leaderboards: Optional['Leaderboards'] = None
+
+    async def get(self, user_id: int, guild_id: int) -> Optional[UserProfile]:
+        """プロフィールを返す。users に行が無ければ None。"""
+        key = (user_id, guild_id)
+        profile = self._profiles.get(key)
+        if profile is not None:
+            self._profiles.move_to_end(key)
+        else:
+            epoch_before_load = self._write_epoch
+            async with self.bot.db.read() as conn:
+                async with conn.execute(_PROFILE_SQL, (user_id, guild_id)) as cursor:
+                    row = await cursor.fetchone()
+            if row is None:
+                return None
+            equipment = EquipmentStats(_equipped_item(row[3], row[5], row[6]), _equipped_item(row[4], row[7], row[8]))
+            profile = UserProfile(row[0] or 0, row[1] or 0, row[2] or 0, row[3], row[4], equipment)
+            if epoch_before_load == self._write_epoch:
+                self._profiles[key] = profile
+                if len(self._profiles) > self.maxsize:
+                    self._profiles.popitem(last=False)
+
+        cached_xp = self.xp_buffer.get_cached(user_id, guild_id)
+        if cached_xp:
+            profile.total_characters, profile.level = cached_xp
+        return profile
+
+    async def get_equipment(self, user_id: int, guild_id: int) -> Optional[EquipmentStats]:
+        """装備の能力値を返す。キャッシュ済みならDBを読まない。users に行が無ければ None。"""
+        profile = await self.get(user_id, guild_id)
+        if profile is None:
+            return None
+        if profile.equipment is not None:
+            return profile.equipment
+
+        epoch_before_load = self._write_epoch
+        weapon_id, armor_id = profile.equipped_weapon, profile.equipped_armor
+        rows = {}
+        slot_ids = [i for i in (weapon_id, armor_id) if i]
+        if slot_ids:
+            async with self.bot.db.read() as conn:
+                async with conn.execute(
+                        f"SELECT inventory_id, item_id, effect_id FROM inventory WHERE user_id = ? AND guild_id = ? "
+                        f"AND inventory_id IN ({', '.join('?' * len(slot_ids))})",
+                        (user_id, guild_id, *slot_ids)) as cursor:
+                    rows = {r[0]: r for r in await cursor.fetchall()}
+        equipment = EquipmentStats(
+            _equipped_item(*rows[weapon_id]) if weapon_id in rows else None,
+            _equipped_item(*rows[armor_id]) if armor_id in rows else None,
+        )
+        if epoch_before_load == self._write_epoch:
+            profile.equipment = equipment
+        return equipment
+
+    def adjust_gold(self, user_id: int, guild_id: int, delta: int):
+        """コミット済みの gold = gold + delta を反映する。"""
+        self._write_epoch += 1
+        profile = self._profiles.get((user_id, guild_id))
+        if profile is not None:
+            profile.gold += delta
+        if self.leaderboards is not None:
+            self.leaderboards.adjust(user_id, guild_id, "gold", delta)
+
+    def set_fields(self, user_id: int, guild_id: int, **fields):
+        """コミット済みの絶対値の更新 (装備スロットなど) を反映する。"""
+        self._write_epoch += 1
+        profile = self._profiles.get((user_id, guild_id))
+        if profile is not None:
+            for name, value in fields.items():
+                setattr(profile, name, value)
+            if "equipped_weapon" in fields or "equipped_armor" in fields:
+                profile.equipment = None
+        if self.leaderboards is not None and ("equipped_weapon" in fields or "equipped_armor" in fields):
+            self.leaderboards.refresh_later(user_id, guild_id)
+
+    def invalidate_equipment(self, user_id: int, guild_id: int):
+        """装備中のアイテムの中身が変わったかもしれないとき (リロールなど) に呼ぶ。"""
+        self._write_epoch += 1
+        profile = self._profiles.get((user_id, guild_id))
+        if profile is not None:
+            profile.equipment = None
+        if self.leaderboards is not None:
+            self.leaderboards.refresh_later(user_id, guild_id)
+
+    def invalidate(self, user_id: int, guild_id: int):
+        """結果が不明な書き込み (エラー時など) の後に呼び、次回DBから読み直させる。"""
+        self._write_epoch += 1
+        self._profiles.pop((user_id, guild_id), None)
+        if self.leaderboards is not None:
+            self.leaderboards.refresh_later(user_id, guild_id)
+
+    def clear(self):
+        self._write_epoch += 1
+        self._profiles.clear()
+        if self.leaderboards is not None:
+            self.leaderboards.clear()
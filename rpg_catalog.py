@@ -0,0 +1,81 @@
+# rpg_catalog.py
+import random
+import logging
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from rpg_data import ITEMS_TABLE_DATA, EFFECTS_TABLE_DATA
+
+logger = logging.getLogger('SophiaBot.RPGCatalog')
+
+
+class ItemRecord(NamedTuple):
+    item_id: int
+    base_name: str
+    type: str
+    rarity: str
+    base_attack: int
+    base_defense: int
+
+
+class EffectRecord(NamedTuple):
+    effect_id: int
+    prefix_name: str
+    rarity: str
+    attack_bonus: int
+    defense_bonus: int
+
+
+# 効果なし (effect_id = 0) を表すレコード
+NO_EFFECT = EffectRecord(0, "", "N/A", 0, 0)
+
+
+class ItemCatalog:
+    """
+    rpg_data の ITEMS_TABLE_DATA / EFFECTS_TABLE_DATA から作る読み取り専用の索引。
+    items / effects テーブルは同じデータから作られるため、ID はDBと一致する。
+    """
+
+    def __init__(self, items_data: List[tuple], effects_data: List[tuple]):
+        items_by_key: Dict[Tuple[str, str], List[ItemRecord]] = {}
+        effects_by_rarity: Dict[str, List[EffectRecord]] = {}
+        items_by_id: Dict[int, ItemRecord] = {}
+        effects_by_id: Dict[int, EffectRecord] = {}
+
+        for row in items_data:
+            item = ItemRecord(*row)
+            items_by_id[item.item_id] = item
+            items_by_key.setdefault((item.type, item.rarity), []).append(item)
+        for row in effects_data:
+            effect = EffectRecord(*row)
+            effects_by_id[effect.effect_id] = effect
+            effects_by_rarity.setdefault(effect.rarity, []).append(effect)
+
+        self.items_by_key: Mapping[Tuple[str, str], Tuple[ItemRecord, ...]] = MappingProxyType({k: tuple(v) for k, v in items_by_key.items()})
+        self.effects_by_rarity: Mapping[str, Tuple[EffectRecord, ...]] = MappingProxyType({k: tuple(v) for k, v in effects_by_rarity.items()})
+        self.items_by_id: Mapping[int, ItemRecord] = MappingProxyType(items_by_id)
+        self.effects_by_id: Mapping[int, EffectRecord] = MappingProxyType(effects_by_id)
+
+    def random_item(self, item_type: str, rarity: str, rng: random.Random = random) -> Optional[ItemRecord]:
+        """指定タイプ・レアリティのベースアイテムを一つ選ぶ。該当なしなら None。"""
+        candidates = self.items_by_key.get((item_type, rarity))
+        if not candidates:
+            return None
+        return rng.choice(candidates)
+
+    def random_effect(self, rarity: str, rng: random.Random = random) -> Optional[EffectRecord]:
+        """指定レアリティの効果を一つ選ぶ。該当なしなら None。"""
+        candidates = self.effects_by_rarity.get(rarity)
+        if not candidates:
+            return None
+        return rng.choice(candidates)
+
+    def get_item(self, item_id: int) -> Optional[ItemRecord]:
+        return self.items_by_id.get(item_id)
+
+    def get_effect(self, effect_id: int) -> EffectRecord:
+        """効果を返す。未知のIDや 0 は NO_EFFECT。"""
+        return self.effects_by_id.get(effect_id, NO_EFFECT)
+
+
+CATALOG = ItemCatalog(ITEMS_TABLE_DATA, EFFECTS_TABLE_DATA)
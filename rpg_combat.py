@@ -0,0 +1,157 @@
+# rpg_combat.py
+"""
+戦闘の計算部分。Discord にも時間にも依存しないので、BattleSession とシミュレーター
+(battle_simulator.py) の両方から使う。乱数は呼び出し側が渡す rng だけを使う。
+"""
+import random
+from typing import Callable, Dict, List, Sequence, Tuple, Type
+
+from rpg_enemies import (
+    EnemyRecord, EnemyAction, AttackAction, DefenseBuffAction, HealAction, AtkBuffAction, AttackDebuffAction, NothingAction
+)
+
+PLAYER_BASE_HP = 10
+PLAYER_MAX_HP_CAP = 1000
+DEFEND_HEAL_RATIO = 0.25
+
+
+def player_max_hp(level: int) -> int:
+    return min(level + PLAYER_BASE_HP, PLAYER_MAX_HP_CAP)
+
+
+class CombatState:
+    """1戦闘分の数値の状態。"""
+    __slots__ = (
+        "player_hp", "player_max_hp", "player_atk", "player_def", "player_is_defending",
+        "enemy_hp", "enemy_max_hp", "enemy_atk", "enemy_def",
+        "enemy_current_def_buff", "enemy_atk_buff", "enemy_buff_durations",
+    )
+
+    def __init__(self, player_hp: int, player_atk: int, player_def: int, enemy: EnemyRecord):
+        self.player_hp = player_hp
+        self.player_max_hp = player_hp
+        self.player_atk = player_atk
+        self.player_def = player_def
+        self.player_is_defending = False
+
+        self.enemy_hp = enemy.hp
+        self.enemy_max_hp = enemy.hp
+        self.enemy_atk = enemy.atk
+        self.enemy_def = enemy.defense
+        self.enemy_current_def_buff = 0
+        self.enemy_atk_buff = 0
+        # "defense_buff" / "atk_buff" -> 残りターン数
+        self.enemy_buff_durations: Dict[str, int] = {}
+
+    def to_list(self) -> list:
+        """永続化用。__slots__ の順に値を並べる (JSON にそのまま書ける)。"""
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_list(cls, values: Sequence) -> "CombatState":
+        if len(values) != len(cls.__slots__):
+            raise ValueError(f"CombatState expects {len(cls.__slots__)} values, got {len(values)}")
+        state = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, values):
+            setattr(state, name, value)
+        state.player_is_defending = bool(state.player_is_defending)
+        state.enemy_buff_durations = {str(k): int(v) for k, v in state.enemy_buff_durations.items()}
+        return state
+
+
+# --- プレイヤーの行動 ---
+
+def player_attack(state: CombatState) -> int:
+    """敵にダメージを与え、与えたダメージを返す。"""
+    state.player_is_defending = False
+    damage = max(1, state.player_atk - (state.enemy_def + state.enemy_current_def_buff))
+    state.enemy_hp = max(0, state.enemy_hp - damage)
+    return damage
+
+
+def player_defend(state: CombatState) -> int:
+    """防御して DEF の一定割合を回復し、回復量を返す。次の敵の通常攻撃は半減する。"""
+    heal_amount = round(state.player_def * DEFEND_HEAL_RATIO)
+    state.player_hp = min(state.player_max_hp, state.player_hp + heal_amount)
+    state.player_is_defending = True
+    return heal_amount
+
+
+# --- 敵の行動 ---
+
+def expire_enemy_buffs(state: CombatState) -> List[str]:
+    """敵のターン開始時にバフの残りターンを減らし、切れたバフのキーを返す。"""
+    expired = []
+    for buff_key in list(state.enemy_buff_durations):
+        state.enemy_buff_durations[buff_key] -= 1
+        if state.enemy_buff_durations[buff_key] <= 0:
+            if buff_key == "defense_buff":
+                state.enemy_current_def_buff = 0
+            elif buff_key == "atk_buff":
+                state.enemy_atk_buff = 0
+            del state.enemy_buff_durations[buff_key]
+            expired.append(buff_key)
+    return expired
+
+
+def choose_enemy_action(actions: Sequence[EnemyAction], rng: random.Random = random) -> EnemyAction:
+    return rng.choice(actions)
+
+
+def _enemy_damage(state: CombatState, multiplier: float) -> int:
+    return max(1, round((state.enemy_atk + state.enemy_atk_buff) * multiplier) - state.player_def)
+
+
+def _attack(state: CombatState, action: AttackAction) -> int:
+    damage = _enemy_damage(state, action.damage_multiplier)
+    if state.player_is_defending:
+        damage = max(0, damage // 2)
+    state.player_hp = max(0, state.player_hp - damage)
+    return damage
+
+
+def _defense_buff(state: CombatState, action: DefenseBuffAction) -> int:
+    state.enemy_current_def_buff = action.defense_increase
+    state.enemy_buff_durations["defense_buff"] = action.duration + 1
+    return action.defense_increase
+
+
+def _heal(state: CombatState, action: HealAction) -> int:
+    state.enemy_hp = min(state.enemy_max_hp, state.enemy_hp + action.amount)
+    return action.amount
+
+
+def _atk_buff(state: CombatState, action: AtkBuffAction) -> int:
+    state.enemy_atk_buff += action.atk_increase
+    state.enemy_buff_durations["atk_buff"] = action.duration + 1
+    return action.atk_increase
+
+
+def _attack_debuff(state: CombatState, action: AttackDebuffAction) -> int:
+    # 防御中でも半減しない
+    damage = _enemy_damage(state, action.damage_multiplier)
+    state.player_hp = max(0, state.player_hp - damage)
+    return damage
+
+
+def _nothing(state: CombatState, action: NothingAction) -> int:
+    return 0
+
+
+# 行動クラス -> 処理。戻り値はダメージ量・回復量・バフ量 (行動ごとの主な数値)。
+ENEMY_ACTION_HANDLERS: Dict[Type, Callable[[CombatState, EnemyAction], int]] = {
+    AttackAction: _attack,
+    DefenseBuffAction: _defense_buff,
+    HealAction: _heal,
+    AtkBuffAction: _atk_buff,
+    AttackDebuffAction: _attack_debuff,
+    NothingAction: _nothing,
+}
+
+
+def apply_enemy_action(state: CombatState, action: EnemyAction) -> int:
+    return ENEMY_ACTION_HANDLERS[type(action)](state, action)
+
+
+def roll_gold_drop(gold_drop: Tuple[int, int], rng: random.Random = random) -> int:
+    return rng.randint(gold_drop[0], gold_drop[1])
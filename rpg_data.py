@@ -1,12 +1,89 @@
 # rpg_data.py
 import logging
 import random
+from typing import Dict
+
+from rpg_migrations import run_migrations
 
 logger = logging.getLogger('SophiaBot.RPGData')
 
 INVENTORY_LIMIT = 30
 DEVELOPER_ID = 1033218587676123146
 
+# --- レベル/経験値設定 ---
+CHARS_PER_LEVEL = 250
+XP_FLUSH_INTERVAL_SECONDS = 30
+XP_FLUSH_THRESHOLD = 200
+# XPAccumulator がメモリに持つユーザー数の上限 (超えたら書き込み済みのものから古い順に捨てる)
+XP_BUFFER_MAX_ENTRIES = 10000
+
+# --- データベース設定 (rpg_db.RPGDatabase) ---
+DB_READER_CONNECTIONS = 4
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_CACHE_SIZE_KIB = 16 * 1024
+DB_BUSY_TIMEOUT_MS = 5000
+
+# --- ユーザー単位の排他 (rpg_locks.UserLockManager) ---
+USER_LOCK_IDLE_SECONDS = 300
+USER_LOCK_MAX_ENTRIES = 4096
+
+# --- 敵データ (rpg_enemies.EnemyRegistry) ---
+ENEMY_RESCAN_INTERVAL_SECONDS = 60
+
+# --- 戦闘メッセージの編集 (rpg_render.MessageRenderer) ---
+# 同じメッセージへの message.edit はこの秒数に1回までにまとめる
+BATTLE_RENDER_WINDOW_SECONDS = 1.0
+
+# --- 戦闘の永続化 (rpg_battle_store.BattleStore) ---
+# 最後の更新からこの秒数が過ぎた保存済みの戦闘は、再起動しても復元せずに破棄する
+BATTLE_STATE_TTL_SECONDS = 15 * 60
+BATTLE_STATE_MAX_ROWS = 5000
+
+# --- 進行中の戦闘の管理 ---
+# 最後の行動からこの秒数が過ぎた戦闘は時間切れとして終了する (BattleView のタイムアウトと同じ)
+BATTLE_IDLE_TIMEOUT_SECONDS = 300
+BATTLE_REAPER_INTERVAL_SECONDS = 30
+# 同時に進行できる戦闘の数 (全体 / サーバーごと)。超えた分の /vbattle は断る
+MAX_CONCURRENT_BATTLES = 500
+MAX_CONCURRENT_BATTLES_PER_GUILD = 50
+# 永続化するバトルログの行数 (戦闘画面に表示する行数と同じ)
+BATTLE_LOG_TAIL = 7
+
+# --- 装備ロール (rpg_roles.RoleManager) ---
+# 装備変更からロールの付け替えまで待つ秒数。この間の付け替えは1回の編集にまとめる
+ROLE_UPDATE_DELAY_SECONDS = 5.0
+# 誰も持っていない装備ロールを消す間隔と、1回に消す上限
+ROLE_GC_INTERVAL_SECONDS = 60 * 60
+ROLE_GC_MAX_DELETIONS = 25
+# 作られてからこの秒数以内のロールは、まだ付け替え待ちの可能性があるので消さない
+ROLE_GC_GRACE_SECONDS = 10 * 60
+
+# --- ボタン・セレクトの操作 (rpg_router / rpg_actions.PendingActionStore) ---
+# 選択肢の有効期限。過ぎた後に押されたボタンは「期限切れ」として扱う
+CONFIRM_TTL_SECONDS = 60
+ITEM_CHOICE_TTL_SECONDS = 120
+GACHA_CHOICE_TTL_SECONDS = 180
+BATTLE_CONTINUE_TTL_SECONDS = 180
+# 期限切れの保留中の操作を片付ける間隔 (時間切れで売却する選択肢はここで処理する)
+PENDING_ACTION_SWEEP_INTERVAL_SECONDS = 30
+
+# --- 効果の再抽選 (/vreroll, rpg_reroll) ---
+# 1回の再抽選で消費する、対象と同じベースレアリティの装備の数
+REROLL_CONSUME_COUNT = 5
+# 1回のコマンドでまとめて行える再抽選の回数の上限 (消費するIDは IN 句に入るので REROLL_CONSUME_COUNT 倍まで)
+REROLL_MAX_ROUNDS = 20
+
+# --- ゴールドの台帳 (rpg_ledger) ---
+# この日数より古い記録は (ユーザー, 日, 理由) ごとの集計に移す
+LEDGER_RETENTION_DAYS = 30
+LEDGER_COMPACT_INTERVAL_SECONDS = 60 * 60
+# 1回の集約で移す記録の上限 (書き込みのトランザクションを短く保つ)
+LEDGER_COMPACT_BATCH_ROWS = 5000
+
+# --- ランキング (/vleaderboard, rpg_leaderboard) ---
+# 表示する上位の人数
+LEADERBOARD_TOP_N = 10
+
 SELL_PRICES = {
     "common": 500,
     "uncommon": 1000,
@@ -39,6 +116,60 @@ RARITY_ORDER = {
     "unique": 7
 }
 
+# --- ガチャ設定 ---
+GACHA_SETTINGS: Dict[str, Dict] = {
+    "junk": {
+        "name": "ジャンクパーツ詰め合わせ",
+        "cost_single": 5000,
+        "rarity_pool": {"common": 0.60, "uncommon": 0.29, "rare": 0.10, "epic": 0.01},
+        "guaranteed_rarity_above_single": None,
+        "description": (
+            "```\n"
+            "ガラクタの山から掘り出し物が見つかるかも？ハードオフよりはマシ\n\n"
+            "ベースアイテム提供割合:\n"
+            "コモン:　　　　　60.000%\n"
+            "アンコモン:　　　29.000%\n"
+            "レア:　　　　　　10.000%\n"
+            "エピック:　　 　　1.000%\n\n"
+            "(効果のレアリティは上記とは別に抽選されます)\n"
+            "```\n\n"
+        )
+    },
+    "influencer": {
+        "name": "インフルエンサーおすすめセット",
+        "cost_single": 30000,
+        "rarity_pool": {"uncommon": 0.50, "rare": 0.33, "epic": 0.15, "legendary": 0.02},
+        "guaranteed_rarity_above_single": "uncommon",
+        "description": (
+            "```\n"
+            "あの人も使ってる最新トレンドアイテム！（PR案件）\n\n"
+            "ベースアイテム提供割合:\n"
+            "アンコモン:　　　50.000%\n"
+            "レア:　　　　　　33.000%\n"
+            "エピック:　　　　15.000%\n"
+            "レジェンダリー:　 2.000%\n\n"
+            "(効果のレアリティは上記とは別に抽選されます)\n"
+            "```\n\n"
+        )
+    },
+    "vip": {
+        "name": "VIP供給品",
+        "cost_single": 100000,
+        "rarity_pool": {"legendary": 0.70, "mythic": 0.25, "unique": 0.05},
+        "guaranteed_rarity_above_single": "legendary",
+        "description": (
+            "```\n"
+            "選ばれし者のみが手にできる至高の逸品。\n\n"
+            "ベースアイテム提供割合:\n"
+            "レジェンダリー:　70.000%\n"
+            "ミシック:　　　　25.000%\n"
+            "ユニーク:　　　　 5.000%\n\n"
+            "(効果のレアリティは上記とは別に抽選されます)\n"
+            "```"
+        )
+    }
+}
+
 # --- Base Equipment Names and Effect Prefixes (200 weapons, 200 armors, 200 effects) ---
 # Each tuple: (name, ATK, DEF) for items or (prefix, ATK_bonus, DEF_bonus) for effects
 
@@ -249,33 +380,20 @@ for rarity, effects in EFFECT_PREFIX_DEFINITIONS.items():
         EFFECTS_TABLE_DATA.append((effect_id_counter, prefix, rarity, atk_bonus, def_bonus))
         effect_id_counter += 1
 
-async def init_database(db_conn):
-    await db_conn.execute('''CREATE TABLE IF NOT EXISTS items (
-        item_id INTEGER PRIMARY KEY, base_name TEXT, type TEXT, rarity TEXT,
-        base_attack INTEGER, base_defense INTEGER )''')
-    await db_conn.execute('''CREATE TABLE IF NOT EXISTS effects (
-        effect_id INTEGER PRIMARY KEY, prefix_name TEXT, rarity TEXT,
-        attack_bonus INTEGER, defense_bonus INTEGER )''')
-    await db_conn.execute('''CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER, guild_id INTEGER, level INTEGER, total_characters INTEGER,
-        equipped_weapon INTEGER, equipped_armor INTEGER, gold INTEGER DEFAULT 0,
-        PRIMARY KEY (user_id, guild_id) )''')
-    await db_conn.execute('''CREATE TABLE IF NOT EXISTS inventory (
-        inventory_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, guild_id INTEGER,
-        item_id INTEGER, effect_id INTEGER,
-        FOREIGN KEY (user_id, guild_id) REFERENCES users (user_id, guild_id),
-        FOREIGN KEY (item_id) REFERENCES items (item_id),
-        FOREIGN KEY (effect_id) REFERENCES effects (effect_id) )''')
+async def init_database(db):
+    """スキーマのマイグレーションを適用し、items / effects が空なら基本データを入れる。db は rpg_db.RPGDatabase。"""
+    async with db.exclusive() as conn:
+        await run_migrations(conn)
 
-    async with db_conn.execute("SELECT COUNT(*) FROM items") as cursor:
-        if (await cursor.fetchone())[0] == 0:
-            await db_conn.executemany("INSERT INTO items VALUES (?, ?, ?, ?, ?, ?)", ITEMS_TABLE_DATA)
-            logger.info(f"{len(ITEMS_TABLE_DATA)} ベースアイテムデータをデータベースに挿入しました。")
+    async with db.write() as conn:
+        async with conn.execute("SELECT COUNT(*) FROM items") as cursor:
+            if (await cursor.fetchone())[0] == 0:
+                await conn.executemany("INSERT INTO items VALUES (?, ?, ?, ?, ?, ?)", ITEMS_TABLE_DATA)
+                logger.info(f"{len(ITEMS_TABLE_DATA)} ベースアイテムデータをデータベースに挿入しました。")
 
-    async with db_conn.execute("SELECT COUNT(*) FROM effects") as cursor:
-        if (await cursor.fetchone())[0] == 0:
-            await db_conn.executemany("INSERT INTO effects VALUES (?, ?, ?, ?, ?)", EFFECTS_TABLE_DATA)
-            logger.info(f"{len(EFFECTS_TABLE_DATA)} 効果接頭辞データをデータベースに挿入しました。")
+        async with conn.execute("SELECT COUNT(*) FROM effects") as cursor:
+            if (await cursor.fetchone())[0] == 0:
+                await conn.executemany("INSERT INTO effects VALUES (?, ?, ?, ?, ?)", EFFECTS_TABLE_DATA)
+                logger.info(f"{len(EFFECTS_TABLE_DATA)} 効果接頭辞データをデータベースに挿入しました。")
 
-    await db_conn.commit()
     logger.info("RPGデータベースの初期化/確認が完了しました。")
\ No newline at end of file
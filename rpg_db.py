@@ -0,0 +1,111 @@
+# rpg_db.py
+import asyncio
+import contextlib
+import logging
+from typing import AsyncIterator, List, Optional
+
+import aiosqlite
+
+from rpg_data import DB_READER_CONNECTIONS, DB_MMAP_SIZE, DB_CACHE_SIZE_KIB, DB_BUSY_TIMEOUT_MS
+from rpg_utils import transaction
+from rpg_ledger import LEDGER
+
+logger = logging.getLogger('SophiaBot.RPGDatabase')
+
+
+class RPGDatabase:
+    """
+    rpg_database.db への接続をまとめるクラス。bot.db としてすべての cog / view から共有する。
+
+    WAL モードで書き込み用の接続を1本、読み取り用の接続を reader_count 本開く。
+    - read(): 空いている読み取り接続を借りる。書き込み中でもコミット済みのデータを読める。
+    - write(): 書き込み接続を順番待ちで確保し、1つのトランザクションとして実行する。
+      トランザクション内の読み取りは必ず yield された接続で行うこと。
+      write() の中で write() / exclusive() を呼ぶとデッドロックする。
+      rpg_ledger.record_gold() で溜めた台帳の記録はコミットの直前に書き込む (巻き戻すときは捨てる)。
+    - exclusive(): トランザクションを張らずに書き込み接続を確保する (マイグレーションなど自前で BEGIN するもの用)。
+    どの接続も isolation_level=None (自動コミット) で開くので、トランザクションは明示した BEGIN のみ。
+    """
+
+    def __init__(self, path: str, reader_count: int = DB_READER_CONNECTIONS):
+        self.path = path
+        self.reader_count = max(1, reader_count)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._idle_readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        # asyncio.Lock は待ち行列順に取得されるため、書き込みは到着順に1本の接続で処理される
+        self._write_lock = asyncio.Lock()
+
+    async def _connect(self, query_only: bool) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, isolation_level=None)
+        await conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+        await conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+        # 負の値は KiB 単位の指定
+        await conn.execute(f"PRAGMA cache_size = -{int(DB_CACHE_SIZE_KIB)}")
+        await conn.execute("PRAGMA temp_store = MEMORY")
+        if query_only:
+            await conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    async def open(self):
+        # journal_mode はファイルに保存されるので、読み取り接続より先に書き込み接続で設定する
+        self._writer = await self._connect(query_only=False)
+        async with self._writer.execute("PRAGMA journal_mode = WAL") as cursor:
+            journal_mode = (await cursor.fetchone())[0]
+        if str(journal_mode).lower() != "wal":
+            logger.warning(f"WAL モードを有効にできませんでした (journal_mode={journal_mode})。")
+        await self._writer.execute("PRAGMA synchronous = NORMAL")
+
+        for _ in range(self.reader_count):
+            reader = await self._connect(query_only=True)
+            self._readers.append(reader)
+            self._idle_readers.put_nowait(reader)
+        logger.info(f"RPGデータベースを開きました (journal_mode={journal_mode}, readers={self.reader_count})。")
+
+    @contextlib.asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        conn = await self._idle_readers.get()
+        try:
+            yield conn
+        finally:
+            self._idle_readers.put_nowait(conn)
+
+    @contextlib.asynccontextmanager
+    async def write(self) -> AsyncIterator[aiosqlite.Connection]:
+        async with self._write_lock:
+            async with transaction(self._writer) as conn:
+                try:
+                    yield conn
+                    # ゴールドの台帳は同じトランザクションの最後にまとめて追記する
+                    await LEDGER.flush(conn)
+                finally:
+                    LEDGER.discard(conn)
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self) -> AsyncIterator[aiosqlite.Connection]:
+        async with self._write_lock:
+            yield self._writer
+
+    async def close(self):
+        async with self._write_lock:
+            for reader in self._readers:
+                await reader.close()
+            self._readers.clear()
+            if self._writer is not None:
+                try:
+                    # 終了時に WAL をメインのDBファイルへ書き戻しておく
+                    await self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                except Exception as e:
+                    logger.warning(f"WAL チェックポイントに失敗しました: {e}")
+                await self._writer.close()
+                self._writer = None
+
+
+async def open_database(path: str, reader_count: int = DB_READER_CONNECTIONS) -> RPGDatabase:
+    db = RPGDatabase(path, reader_count)
+    try:
+        await db.open()
+    except Exception:
+        await db.close()
+        raise
+    return db
@@ -0,0 +1,114 @@
+# rpg_drops.py
+import logging
+import random
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from rpg_data import RARITY_WEIGHTS, TOTAL_RARITY_WEIGHT, SELL_PRICES
+from rpg_catalog import CATALOG, NO_EFFECT, ItemRecord, EffectRecord
+from rpg_sampler import RARITY_SAMPLER
+from rpg_ledger import apply_gold
+
+logger = logging.getLogger('SophiaBot.RPGDrops')
+
+ITEM_TYPE_DISPLAY = {"weapon": "武器", "armor": "防具"}
+
+
+class RolledDrop(NamedTuple):
+    item: ItemRecord
+    effect: EffectRecord
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.effect.prefix_name}{self.item.base_name}"
+
+    @property
+    def item_type_display(self) -> str:
+        return ITEM_TYPE_DISPLAY.get(self.item.type, self.item.type)
+
+    @property
+    def sell_price(self) -> int:
+        return SELL_PRICES.get(self.item.rarity, 0)
+
+    @property
+    def combined_probability_percent(self) -> float:
+        if TOTAL_RARITY_WEIGHT <= 0 or self.effect.rarity == "N/A":
+            return 0.0
+        prob_item = RARITY_WEIGHTS.get(self.item.rarity, 0) / TOTAL_RARITY_WEIGHT
+        prob_effect = RARITY_WEIGHTS.get(self.effect.rarity, 0) / TOTAL_RARITY_WEIGHT
+        return prob_item * prob_effect * 100
+
+    @property
+    def ref_id(self) -> str:
+        """台帳などに残す "item_id/effect_id"。"""
+        return f"{self.item.item_id}/{self.effect.effect_id}"
+
+    def describe(self) -> str:
+        return f"{self.full_name} ({self.item_type_display} / {self.item.rarity}/{self.effect.rarity})"
+
+
+def roll_drop(rng: random.Random = random) -> Optional[RolledDrop]:
+    """レベルアップ1回分のドロップを抽選する。ベースアイテムが見つからなければ None。"""
+    item_type = rng.choice(("weapon", "armor"))
+    base_rarity = RARITY_SAMPLER.sample(rng)
+    item = CATALOG.random_item(item_type, base_rarity, rng)
+    if item is None:
+        logger.error(f"No base item found for type {item_type} and rarity {base_rarity}")
+        return None
+    effect_rarity = RARITY_SAMPLER.sample(rng)
+    effect = CATALOG.random_effect(effect_rarity, rng)
+    if effect is None:
+        logger.warning(f"No effect found for rarity {effect_rarity}. Assigning 'no effect' (ID 0).")
+        effect = NO_EFFECT
+    return RolledDrop(item, effect)
+
+
+def roll_drops(count: int, rng: random.Random = random) -> List[RolledDrop]:
+    """count 回分のドロップをメモリ上でまとめて抽選する (DB には触れない)。"""
+    drops = []
+    for _ in range(count):
+        drop = roll_drop(rng)
+        if drop is not None:
+            drops.append(drop)
+    return drops
+
+
+async def store_drops(conn, user_id: int, guild_id: int, drops: Sequence[RolledDrop],
+                      inventory_limit: int) -> Tuple[List[RolledDrop], List[RolledDrop]]:
+    """
+    空き枠に入る分だけ drops を先頭から inventory に追加し、(追加したもの, 入りきらなかったもの) を返す。
+    conn は bot.db.write() のトランザクション内の接続を渡すこと。空き枠の確認は COUNT 1回だけ。
+    """
+    async with conn.execute("SELECT COUNT(*) FROM inventory WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+        count_row = await cursor.fetchone()
+    free_slots = max(0, inventory_limit - (count_row[0] if count_row else 0))
+    stored, overflow = list(drops[:free_slots]), list(drops[free_slots:])
+    if stored:
+        await conn.executemany(
+            "INSERT INTO inventory (user_id, guild_id, item_id, effect_id) VALUES (?, ?, ?, ?)",
+            [(user_id, guild_id, drop.item.item_id, drop.effect.effect_id) for drop in stored])
+    return stored, overflow
+
+
+async def settle_overflow(conn, user_id: int, guild_id: int, drops: Sequence[RolledDrop], keep_indices: Sequence[int],
+                          inventory_limit: int) -> Tuple[List[RolledDrop], List[RolledDrop]]:
+    """
+    入りきらなかったドロップの扱いを確定する。keep_indices のものは空きがあれば追加し、
+    それ以外 (空きが足りず追加できなかったものを含む) はすべて売却する。(追加したもの, 売却したもの) を返す。
+    conn は bot.db.write() のトランザクション内の接続を渡すこと。
+    """
+    keep = set(keep_indices)
+    stored, not_stored = await store_drops(conn, user_id, guild_id, [d for i, d in enumerate(drops) if i in keep],
+                                           inventory_limit)
+    sold = [d for i, d in enumerate(drops) if i not in keep] + not_stored
+    total_price = sum(d.sell_price for d in sold)
+    if total_price:
+        await apply_gold(conn, user_id, guild_id, total_price, "drop_overflow", (d.ref_id for d in sold))
+    return stored, sold
+
+
+def drop_from_ids(item_id: int, effect_id: int) -> Optional[RolledDrop]:
+    """pending_actions などに (item_id, effect_id) で保存したドロップを戻す。"""
+    item = CATALOG.get_item(item_id)
+    if item is None:
+        return None
+    return RolledDrop(item, CATALOG.get_effect(effect_id))
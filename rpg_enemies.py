@@ -0,0 +1,349 @@
+# rpg_enemies.py
+"""
+enemy/*.json の読み込み・検証・コンパイル。
+
+    python rpg_enemies.py [enemy_dir]
+
+で enemy/ 内の全ファイルを検証し、不正なファイルとその理由を一度にすべて表示する。
+"""
+import json
+import logging
+import os
+import random
+import sys
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple, Type, Union
+
+logger = logging.getLogger('SophiaBot.RPGEnemies')
+
+# ファイル名 -> (mtime_ns, size)
+FileStamps = Dict[str, Tuple[int, int]]
+
+DEFAULT_ACTION_MESSAGE = "{enemy_name}の行動！"
+
+
+# --- コンパイル済みの敵の行動 ---
+# message は {enemy_name} を埋め込み済み。数値パラメータは既定値を解決済み。
+
+class AttackAction(NamedTuple):
+    name: str
+    message: str
+    damage_multiplier: float = 1.0
+    kind = "attack"
+
+
+class DefenseBuffAction(NamedTuple):
+    name: str
+    message: str
+    defense_increase: int = 0
+    duration: int = 1
+    kind = "defense_buff"
+
+
+class HealAction(NamedTuple):
+    name: str
+    message: str
+    amount: int = 0
+    kind = "heal"
+
+
+class AtkBuffAction(NamedTuple):
+    name: str
+    message: str
+    atk_increase: int = 0
+    duration: int = 1
+    kind = "buff_self_atk"
+
+
+class AttackDebuffAction(NamedTuple):
+    name: str
+    message: str
+    damage_multiplier: float = 0.5
+    kind = "attack_debuff_target_def"
+
+
+class NothingAction(NamedTuple):
+    name: str
+    message: str
+    kind = "nothing"
+
+
+EnemyAction = Union[AttackAction, DefenseBuffAction, HealAction, AtkBuffAction, AttackDebuffAction, NothingAction]
+ACTION_TYPES: Mapping[str, Type] = MappingProxyType({
+    cls.kind: cls for cls in (AttackAction, DefenseBuffAction, HealAction, AtkBuffAction, AttackDebuffAction, NothingAction)
+})
+
+
+class EnemyRecord(NamedTuple):
+    """enemy/*.json 1ファイル分をコンパイルしたもの。読み込み後は変更しない。"""
+    key: str
+    name: str
+    hp: int
+    atk: int
+    defense: int
+    image_url: Optional[str]
+    gold_drop: Tuple[int, int]
+    dialogues: Mapping[str, str]
+    actions: Tuple[EnemyAction, ...]
+
+
+class EnemyDataError(ValueError):
+    """検証エラー。errors に見つかった問題をすべて持つ。"""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+# --- スキーマ ---
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_gold_drop(value) -> bool:
+    if _is_int(value):
+        return value >= 0
+    return isinstance(value, list) and len(value) == 2 and all(_is_int(v) and v >= 0 for v in value) and value[0] <= value[1]
+
+
+class FieldSpec(NamedTuple):
+    check: Callable[[Any], bool]
+    expected: str
+    required: bool = False
+
+
+ENEMY_SCHEMA: Mapping[str, FieldSpec] = MappingProxyType({
+    "name": FieldSpec(lambda v: isinstance(v, str) and bool(v), "non-empty string", required=True),
+    "hp": FieldSpec(lambda v: _is_int(v) and v > 0, "positive integer", required=True),
+    "atk": FieldSpec(lambda v: _is_int(v) and v >= 0, "non-negative integer", required=True),
+    "def": FieldSpec(lambda v: _is_int(v) and v >= 0, "non-negative integer", required=True),
+    "actions": FieldSpec(lambda v: isinstance(v, list) and bool(v), "non-empty list", required=True),
+    "image_url": FieldSpec(lambda v: v is None or isinstance(v, str), "string or null"),
+    "gold_drop": FieldSpec(_is_gold_drop, "non-negative integer or [min, max]"),
+    "dialogues": FieldSpec(lambda v: isinstance(v, dict) and all(isinstance(t, str) for t in v.values()), "object of strings"),
+})
+
+DIALOGUE_KEYS = frozenset({"encounter", "player_attack", "player_win", "player_lose", "player_flee"})
+
+_ACTION_COMMON_SCHEMA: Mapping[str, FieldSpec] = MappingProxyType({
+    "type": FieldSpec(lambda v: isinstance(v, str), "string", required=True),
+    "name": FieldSpec(lambda v: isinstance(v, str), "string"),
+    "message": FieldSpec(lambda v: isinstance(v, str), "string"),
+})
+
+# 行動タイプごとの追加パラメータ (省略時は各 Action クラスの既定値)
+ACTION_PARAM_SCHEMAS: Mapping[str, Mapping[str, FieldSpec]] = MappingProxyType({
+    "attack": {"damage_multiplier": FieldSpec(lambda v: _is_number(v) and v >= 0, "non-negative number")},
+    "defense_buff": {"defense_increase": FieldSpec(_is_int, "integer"),
+                     "duration": FieldSpec(lambda v: _is_int(v) and v >= 1, "integer >= 1")},
+    "heal": {"amount": FieldSpec(lambda v: _is_int(v) and v >= 0, "non-negative integer")},
+    "buff_self_atk": {"atk_increase": FieldSpec(_is_int, "integer"),
+                      "duration": FieldSpec(lambda v: _is_int(v) and v >= 1, "integer >= 1")},
+    "attack_debuff_target_def": {"damage_multiplier": FieldSpec(lambda v: _is_number(v) and v >= 0, "non-negative number")},
+    "nothing": {},
+})
+
+
+def _check_fields(data: dict, schema: Mapping[str, FieldSpec], where: str, errors: List[str]):
+    for field, spec in schema.items():
+        if field not in data:
+            if spec.required:
+                errors.append(f"{where}missing required '{field}'")
+            continue
+        if not spec.check(data[field]):
+            errors.append(f"{where}'{field}' must be {spec.expected} (got {data[field]!r})")
+
+
+def _compile_action(index: int, raw, enemy_name: str, errors: List[str]) -> Optional[EnemyAction]:
+    where = f"actions[{index}]: "
+    if not isinstance(raw, dict):
+        errors.append(f"{where}must be an object")
+        return None
+    error_count = len(errors)
+    _check_fields(raw, _ACTION_COMMON_SCHEMA, where, errors)
+    action_type = raw.get("type")
+    param_schema = ACTION_PARAM_SCHEMAS.get(action_type) if isinstance(action_type, str) else None
+    if isinstance(action_type, str) and param_schema is None:
+        errors.append(f"{where}unknown type '{action_type}' (expected one of {', '.join(ACTION_PARAM_SCHEMAS)})")
+    if param_schema is not None:
+        _check_fields(raw, param_schema, where, errors)
+        unknown = raw.keys() - _ACTION_COMMON_SCHEMA.keys() - param_schema.keys()
+        if unknown:
+            errors.append(f"{where}unknown field(s) {sorted(unknown)} for type '{action_type}'")
+
+    message_template = raw.get("message", DEFAULT_ACTION_MESSAGE)
+    try:
+        message = str(message_template).format(enemy_name=enemy_name)
+    except (KeyError, IndexError, ValueError) as e:
+        errors.append(f"{where}'message' has an invalid placeholder: {e}")
+        message = ""
+
+    if len(errors) != error_count:
+        return None
+    params = {field: raw[field] for field in param_schema if field in raw}
+    return ACTION_TYPES[action_type](name=raw.get("name", "不明な技"), message=message, **params)
+
+
+def compile_enemy(key: str, data) -> EnemyRecord:
+    """JSON から読んだ値をスキーマで検証し EnemyRecord にする。問題があればすべてまとめて EnemyDataError。"""
+    if not isinstance(data, dict):
+        raise EnemyDataError(["top level must be an object"])
+    errors: List[str] = []
+    _check_fields(data, ENEMY_SCHEMA, "", errors)
+    unknown = data.keys() - ENEMY_SCHEMA.keys()
+    if unknown:
+        errors.append(f"unknown field(s) {sorted(unknown)}")
+    dialogues = data.get("dialogues") or {}
+    if isinstance(dialogues, dict) and dialogues.keys() - DIALOGUE_KEYS:
+        errors.append(f"unknown dialogue key(s) {sorted(dialogues.keys() - DIALOGUE_KEYS)}")
+
+    name = data.get("name") if isinstance(data.get("name"), str) else key
+    actions = []
+    raw_actions = data.get("actions")
+    if isinstance(raw_actions, list):
+        for index, raw_action in enumerate(raw_actions):
+            action = _compile_action(index, raw_action, name, errors)
+            if action is not None:
+                actions.append(action)
+
+    if errors:
+        raise EnemyDataError(errors)
+
+    raw_gold_drop = data.get("gold_drop", [0, 0])
+    gold_drop = (raw_gold_drop, raw_gold_drop) if _is_int(raw_gold_drop) else (raw_gold_drop[0], raw_gold_drop[1])
+    return EnemyRecord(
+        key=key,
+        name=data["name"],
+        hp=data["hp"],
+        atk=data["atk"],
+        defense=data["def"],
+        image_url=data.get("image_url") or None,
+        gold_drop=gold_drop,
+        dialogues=MappingProxyType(dict(dialogues)),
+        actions=tuple(actions),
+    )
+
+
+def load_enemy_file(path: str) -> EnemyRecord:
+    key = os.path.splitext(os.path.basename(path))[0]
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except json.JSONDecodeError as e:
+        raise EnemyDataError([f"invalid JSON: {e}"]) from e
+    return compile_enemy(key, data)
+
+
+class EnemyRegistry:
+    """
+    enemy/ ディレクトリの全ファイルを一度に読み込んで保持する。
+    ファイル I/O を伴う scan() / rescan_if_changed() は同期関数なので、cog からは asyncio.to_thread で呼ぶ。
+    戦闘開始時の random_enemy() はメモリ上のタプルから選ぶだけ。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._records: Dict[str, EnemyRecord] = {}
+        self._choices: Tuple[EnemyRecord, ...] = ()
+        self._dir_mtime_ns: Optional[int] = None
+        self._file_stamps: FileStamps = {}
+        # ファイル名 -> 検証エラー (最後の scan 時点)
+        self.invalid_files: Dict[str, List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._choices)
+
+    def get(self, key: str) -> Optional[EnemyRecord]:
+        return self._records.get(key)
+
+    def records(self) -> Tuple[EnemyRecord, ...]:
+        """読み込み済みの全敵 (ファイル名順)。"""
+        return self._choices
+
+    def random_enemy(self, rng: random.Random = random) -> Optional[EnemyRecord]:
+        choices = self._choices
+        if not choices:
+            return None
+        return rng.choice(choices)
+
+    def _stat_directory(self) -> Tuple[Optional[int], FileStamps]:
+        try:
+            dir_mtime_ns = os.stat(self.directory).st_mtime_ns
+            stamps: FileStamps = {}
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.json') and entry.is_file():
+                        st = entry.stat()
+                        stamps[entry.name] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None, {}
+        return dir_mtime_ns, stamps
+
+    def scan(self) -> int:
+        """ディレクトリを読み直し、変更されたファイルだけ再コンパイルする。読み込めた敵の数を返す。"""
+        dir_mtime_ns, stamps = self._stat_directory()
+        if dir_mtime_ns is None:
+            logger.error(f"Enemy data path not found or not a directory: {self.directory}")
+
+        records: Dict[str, EnemyRecord] = {}
+        invalid_files: Dict[str, List[str]] = {}
+        for filename, stamp in sorted(stamps.items()):
+            key = os.path.splitext(filename)[0]
+            unchanged = self._file_stamps.get(filename) == stamp
+            if unchanged and key in self._records:
+                records[key] = self._records[key]
+                continue
+            if unchanged and filename in self.invalid_files:
+                # 壊れたままのファイルは直るまで毎回ログを出さない
+                invalid_files[filename] = self.invalid_files[filename]
+                continue
+            try:
+                records[key] = load_enemy_file(os.path.join(self.directory, filename))
+            except EnemyDataError as e:
+                invalid_files[filename] = e.errors
+                logger.error(f"Skipping invalid enemy file {filename}: {e}")
+            except OSError as e:
+                invalid_files[filename] = [str(e)]
+                logger.error(f"Skipping unreadable enemy file {filename}: {e}")
+
+        added = records.keys() - self._records.keys()
+        removed = self._records.keys() - records.keys()
+        self._records = records
+        self._choices = tuple(records.values())
+        self._dir_mtime_ns = dir_mtime_ns
+        self._file_stamps = stamps
+        self.invalid_files = invalid_files
+        logger.info(f"Loaded {len(records)} enemies from {self.directory} (+{len(added)} / -{len(removed)}, invalid {len(invalid_files)}).")
+        return len(records)
+
+    def rescan_if_changed(self) -> bool:
+        """ディレクトリかファイルの mtime が変わっていれば scan() する。読み直したら True。"""
+        dir_mtime_ns, stamps = self._stat_directory()
+        if dir_mtime_ns == self._dir_mtime_ns and stamps == self._file_stamps:
+            return False
+        self.scan()
+        return True
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    directory = argv[0] if argv else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'enemy')
+    # 問題は下でまとめて表示するので、scan() のエラーログは出さない
+    logging.disable(logging.ERROR)
+    registry = EnemyRegistry(directory)
+    loaded = registry.scan()
+    for filename, errors in sorted(registry.invalid_files.items()):
+        print(f"{filename}:")
+        for error in errors:
+            print(f"  - {error}")
+    print(f"{loaded} valid, {len(registry.invalid_files)} invalid enemy file(s) in {directory}")
+    return 1 if registry.invalid_files else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+# rpg_inventory.py
+import logging
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from rpg_data import RARITY_ORDER
+
+logger = logging.getLogger('SophiaBot.RPGInventory')
+
+# 装備スロットの更新。対象がまだ本人のインベントリにある場合だけ書き換える (売却済みの ID を装備しない)。
+# {field} には equipped_weapon / equipped_armor のどちらかを入れる。
+# パラメータ: (inventory_id, user_id, guild_id, inventory_id, user_id, guild_id)
+EQUIP_IF_OWNED_SQL = (
+    "UPDATE users SET {field} = ? WHERE user_id = ? AND guild_id = ? "
+    "AND EXISTS (SELECT 1 FROM inventory WHERE inventory_id = ? AND user_id = ? AND guild_id = ?)"
+)
+
+
+class InventoryRow(NamedTuple):
+    inventory_id: int
+    base_name: str
+    item_type: str
+    base_rarity: str
+    item_id: int
+    effect_prefix: str
+    effect_rarity: str
+    effect_id: int
+    attack: int
+    defense: int
+    # ベースと効果のレアリティ順位の合計 (効果なしは 0)
+    rarity_score: int
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.effect_prefix}{self.base_name}"
+
+
+class InventoryFilter(NamedTuple):
+    item_type: Optional[str] = None
+    rarity: Optional[str] = None
+
+    def describe(self) -> str:
+        parts = []
+        if self.item_type:
+            parts.append("武器" if self.item_type == "weapon" else "防具")
+        if self.rarity:
+            parts.append(self.rarity)
+        return " / ".join(parts)
+
+
+class SortSpec(NamedTuple):
+    label: str
+    # 並べ替えに使う列 (None は inventory_id だけで並べる)。同じ値の中では常に inventory_id 昇順。
+    column: Optional[str]
+    descending: bool
+
+
+SORT_ORDERS: Dict[str, SortSpec] = {
+    "id_asc": SortSpec("ID昇順", None, False),
+    "rarity_asc": SortSpec("レア度総合昇順", "rarity_score", False),
+    "rarity_desc": SortSpec("レア度総合降順", "rarity_score", True),
+    "atk_desc": SortSpec("ATK降順", "attack", True),
+    "def_desc": SortSpec("DEF降順", "defense", True),
+}
+DEFAULT_SORT = "id_asc"
+
+# 次のページの開始位置。直前のページの最後の行の (並べ替えの値, inventory_id)。
+PageCursor = Tuple[Optional[int], int]
+
+
+def _rarity_rank_sql(column: str) -> str:
+    cases = " ".join(f"WHEN '{rarity}' THEN {rank}" for rarity, rank in RARITY_ORDER.items())
+    return f"(CASE {column} {cases} ELSE 0 END)"
+
+
+# 本人のインベントリを1行ずつ、ATK/DEF とレアリティの合計順位を計算した形で返す。
+# 効果の無い行 (effect_id = 0 など) も落とさないよう effects は LEFT JOIN にする。
+_INVENTORY_ROWS_SQL = f"""
+    SELECT inv.inventory_id, i.base_name, i.type AS item_type, i.rarity AS base_rarity, i.item_id,
+           COALESCE(e.prefix_name, '') AS effect_prefix, COALESCE(e.rarity, 'N/A') AS effect_rarity,
+           inv.effect_id,
+           i.base_attack + COALESCE(e.attack_bonus, 0) AS attack,
+           i.base_defense + COALESCE(e.defense_bonus, 0) AS defense,
+           {_rarity_rank_sql('i.rarity')} + {_rarity_rank_sql('e.rarity')} AS rarity_score
+    FROM inventory inv
+    JOIN items i ON inv.item_id = i.item_id
+    LEFT JOIN effects e ON inv.effect_id = e.effect_id
+    WHERE inv.user_id = ? AND inv.guild_id = ?
+"""
+
+
+def _filter_sql(item_filter: InventoryFilter) -> Tuple[str, List]:
+    clauses, params = [], []
+    if item_filter.item_type:
+        clauses.append("item_type = ?")
+        params.append(item_filter.item_type)
+    if item_filter.rarity:
+        clauses.append("base_rarity = ?")
+        params.append(item_filter.rarity)
+    return " AND ".join(clauses), params
+
+
+def cursor_for(row: InventoryRow, sort: str) -> PageCursor:
+    spec = SORT_ORDERS[sort]
+    return (getattr(row, spec.column) if spec.column else None), row.inventory_id
+
+
+async def count_inventory(conn, user_id: int, guild_id: int,
+                          item_filter: InventoryFilter = InventoryFilter()) -> Tuple[int, int]:
+    """(全件数, フィルターに一致する件数) を1回のクエリで返す。"""
+    where, params = _filter_sql(item_filter)
+    matched = f"SUM(CASE WHEN {where} THEN 1 ELSE 0 END)" if where else "COUNT(*)"
+    # 絞り込み条件のプレースホルダーは SELECT 句にあるので、サブクエリの所有者より先に来る
+    async with conn.execute(f"SELECT COUNT(*), COALESCE({matched}, 0) FROM ({_INVENTORY_ROWS_SQL})",
+                            (*params, user_id, guild_id)) as cursor:
+        total, matching = await cursor.fetchone()
+    return total, matching
+
+
+async def fetch_inventory_page(conn, user_id: int, guild_id: int, sort: str = DEFAULT_SORT,
+                               item_filter: InventoryFilter = InventoryFilter(), limit: int = 5,
+                               after: Optional[PageCursor] = None) -> Tuple[List[InventoryRow], bool]:
+    """
+    並べ替えとフィルターをSQL側で行い、after の次から limit 件だけ返す (キーセット方式)。
+    戻り値は (行, 次のページがあるか)。
+    """
+    spec = SORT_ORDERS[sort]
+    where, params = _filter_sql(item_filter)
+    clauses = [where] if where else []
+    if after is not None:
+        value, last_id = after
+        if spec.column is None:
+            clauses.append("inventory_id > ?")
+            params.append(last_id)
+        else:
+            op = "<" if spec.descending else ">"
+            clauses.append(f"({spec.column} {op} ? OR ({spec.column} = ? AND inventory_id > ?))")
+            params.extend((value, value, last_id))
+
+    order_by = "inventory_id ASC"
+    if spec.column is not None:
+        order_by = f"{spec.column} {'DESC' if spec.descending else 'ASC'}, {order_by}"
+    sql = f"SELECT * FROM ({_INVENTORY_ROWS_SQL})"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += f" ORDER BY {order_by} LIMIT ?"
+
+    async with conn.execute(sql, (user_id, guild_id, *params, limit + 1)) as cursor:
+        rows = [InventoryRow(*row) for row in await cursor.fetchall()]
+    return rows[:limit], len(rows) > limit
+
+
+async def fetch_inventory_rows(conn, user_id: int, guild_id: int, where: str = "", params: Sequence = (),
+                               order_by: str = "inventory_id ASC", limit: Optional[int] = None) -> List[InventoryRow]:
+    """InventoryRow の列名で条件と並び順を指定して行を返す (ページ送りしない用途向け)。"""
+    sql = f"SELECT * FROM ({_INVENTORY_ROWS_SQL})"
+    if where:
+        sql += f" WHERE {where}"
+    sql += f" ORDER BY {order_by}"
+    query_params = [user_id, guild_id, *params]
+    if limit is not None:
+        sql += " LIMIT ?"
+        query_params.append(limit)
+    async with conn.execute(sql, query_params) as cursor:
+        return [InventoryRow(*row) for row in await cursor.fetchall()]
@@ -0,0 +1,334 @@
+# rpg_leaderboard.py
+import asyncio
+import logging
+import random
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from rpg_xp_buffer import XPAccumulator
+
+logger = logging.getLogger('SophiaBot.RPGLeaderboard')
+
+# ランキングの種類と表示名。power は装備中の武器・防具の ATK+DEF の合計
+LEADERBOARD_METRICS: Dict[str, str] = {
+    "level": "レベル",
+    "gold": "所持ゴールド",
+    "total_characters": "総文字数",
+    "power": "装備の強さ (ATK+DEF)",
+}
+
+# (-値, user_id) の昇順 = 値の大きい順、同じ値の中では user_id 順
+RankKey = Tuple[int, int]
+
+_MAX_LEVEL = 32
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key: Optional[RankKey], level: int):
+        self.key = key
+        self.next: List[Optional['_Node']] = [None] * level
+        # next[i] までに level 0 で何ステップ進むか (順位の計算に使う)
+        self.width: List[int] = [0] * level
+
+
+class RankedSkipList:
+    """
+    順位付きのスキップリスト。追加・削除・「key より小さい要素の数」・「i 番目の要素」がすべて O(log n)。
+    各リンクに飛び越す要素数 (width) を持たせて、たどった幅の合計から順位を求める。
+    """
+
+    def __init__(self, rng: Optional[random.Random] = None):
+        self._rng = rng or random.Random()
+        self._head = _Node(None, _MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < _MAX_LEVEL and self._rng.getrandbits(1):
+            level += 1
+        return level
+
+    def insert(self, key: RankKey):
+        update: List[_Node] = [self._head] * _MAX_LEVEL
+        rank = [0] * _MAX_LEVEL
+        node = self._head
+        for i in reversed(range(self._level)):
+            rank[i] = rank[i + 1] if i + 1 < self._level else 0
+            while node.next[i] is not None and node.next[i].key < key:
+                rank[i] += node.width[i]
+                node = node.next[i]
+            update[i] = node
+
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                rank[i] = 0
+                update[i] = self._head
+                self._head.width[i] = self._size
+            self._level = level
+
+        new_node = _Node(key, level)
+        for i in range(level):
+            new_node.next[i] = update[i].next[i]
+            update[i].next[i] = new_node
+            new_node.width[i] = update[i].width[i] - (rank[0] - rank[i])
+            update[i].width[i] = rank[0] - rank[i] + 1
+        for i in range(level, self._level):
+            update[i].width[i] += 1
+        self._size += 1
+
+    def remove(self, key: RankKey) -> bool:
+        update: List[_Node] = [self._head] * _MAX_LEVEL
+        node = self._head
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+        target = node.next[0]
+        if target is None or target.key != key:
+            return False
+
+        for i in range(self._level):
+            if update[i].next[i] is target:
+                update[i].width[i] += target.width[i] - 1
+                update[i].next[i] = target.next[i]
+            else:
+                update[i].width[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._size -= 1
+        return True
+
+    def count_less(self, key: RankKey) -> int:
+        """key より小さい要素の数。"""
+        count = 0
+        node = self._head
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                count += node.width[i]
+                node = node.next[i]
+        return count
+
+    def iter_from(self, index: int) -> Iterator[RankKey]:
+        """index 番目 (0 始まり) から順に key を返す。先頭の位置を探すのは O(log n)。"""
+        if index < 0 or index >= self._size:
+            return
+        target = index + 1
+        traversed = 0
+        node = self._head
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and traversed + node.width[i] <= target:
+                traversed += node.width[i]
+                node = node.next[i]
+            if traversed == target:
+                break
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+
+class RankEntry(NamedTuple):
+    # 同じ値なら同じ順位 (1, 2, 2, 4, ...)
+    rank: int
+    user_id: int
+    value: int
+
+
+class GuildLeaderboard:
+    """1サーバー分のランキング。種類ごとの RankedSkipList と、ユーザーごとの現在の値を持つ。"""
+
+    def __init__(self):
+        self.boards: Dict[str, RankedSkipList] = {metric: RankedSkipList() for metric in LEADERBOARD_METRICS}
+        self.values: Dict[int, Dict[str, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def set(self, user_id: int, metric: str, value: int):
+        values = self.values.setdefault(user_id, {})
+        old = values.get(metric)
+        if old == value:
+            return
+        board = self.boards[metric]
+        if old is not None:
+            board.remove((-old, user_id))
+        board.insert((-value, user_id))
+        values[metric] = value
+
+    def _rank_of_value(self, metric: str, value: int) -> int:
+        # 自分より値が大きい人数 + 1 (user_id は 0 以上なので (-value, -1) は同じ値の誰よりも前)
+        return self.boards[metric].count_less((-value, -1)) + 1
+
+    def top(self, metric: str, count: int, offset: int = 0) -> List[RankEntry]:
+        entries = []
+        for negative_value, user_id in self.boards[metric].iter_from(offset):
+            if len(entries) >= count:
+                break
+            value = -negative_value
+            if entries and entries[-1].value == value:
+                rank = entries[-1].rank
+            else:
+                rank = self._rank_of_value(metric, value)
+            entries.append(RankEntry(rank, user_id, value))
+        return entries
+
+    def rank_of(self, metric: str, user_id: int) -> Optional[RankEntry]:
+        value = self.values.get(user_id, {}).get(metric)
+        if value is None:
+            return None
+        return RankEntry(self._rank_of_value(metric, value), user_id, value)
+
+
+# 装備中の武器・防具の ATK+DEF の合計 (rpg_cache.EquipmentStats と同じ計算)
+_EQUIPPED_POWER_SQL = """
+    COALESCE(wi.base_attack + wi.base_defense + COALESCE(we.attack_bonus, 0) + COALESCE(we.defense_bonus, 0), 0)
+    + COALESCE(ai.base_attack + ai.base_defense + COALESCE(ae.attack_bonus, 0) + COALESCE(ae.defense_bonus, 0), 0)
+"""
+
+_LEADERBOARD_ROWS_SQL = f"""
+    SELECT u.user_id, COALESCE(u.level, 0), COALESCE(u.total_characters, 0), COALESCE(u.gold, 0), {_EQUIPPED_POWER_SQL}
+    FROM users u
+    LEFT JOIN inventory w ON w.inventory_id = u.equipped_weapon AND w.user_id = u.user_id AND w.guild_id = u.guild_id
+    LEFT JOIN items wi ON wi.item_id = w.item_id
+    LEFT JOIN effects we ON we.effect_id = w.effect_id
+    LEFT JOIN inventory a ON a.inventory_id = u.equipped_armor AND a.user_id = u.user_id AND a.guild_id = u.guild_id
+    LEFT JOIN items ai ON ai.item_id = a.item_id
+    LEFT JOIN effects ae ON ae.effect_id = a.effect_id
+    WHERE u.guild_id = ?
+"""
+
+
+class Leaderboards:
+    """
+    サーバーごとのランキングをメモリに持つ。/vleaderboard のたびに users を並べ替えない。
+
+    - サーバーごとに最初に使われたときに1回だけ SQLite から読み込む (読み込み中の更新は読み込み後に上書きする)。
+    - level / total_characters は XPAccumulator から、gold と装備の強さは UserProfileCache の
+      コミット後の更新メソッドから呼ばれて更新する。結果が不明な書き込みの後はそのユーザーだけ読み直す。
+    """
+
+    def __init__(self, bot, xp_buffer: 'XPAccumulator'):
+        self.bot = bot
+        self.xp_buffer = xp_buffer
+        self._guilds: Dict[int, GuildLeaderboard] = {}
+        self._loading: Dict[int, asyncio.Task] = {}
+        # 読み込み中に届いた更新 (guild_id -> user_id -> {種類: 値})。読み込み後に適用する
+        self._early: Dict[int, Dict[int, Dict[str, int]]] = {}
+        self._refresh_tasks: Dict[Tuple[int, int], asyncio.Task] = {}
+        # 読み直し中のユーザーごとの世代番号。gold / 装備の強さが変わるたびに進め、読み直し中に変わったらやり直す
+        # (読み直していないユーザーの更新では他人の読み直しをやり直させない)
+        self._write_epochs: Dict[Tuple[int, int], int] = {}
+
+    async def get(self, guild_id: int) -> GuildLeaderboard:
+        board = self._guilds.get(guild_id)
+        if board is not None:
+            return board
+        task = self._loading.get(guild_id)
+        if task is None:
+            self._early[guild_id] = {}
+            task = self._loading[guild_id] = asyncio.create_task(self._load(guild_id))
+        return await asyncio.shield(task)
+
+    async def _load(self, guild_id: int) -> GuildLeaderboard:
+        try:
+            async with self.bot.db.read() as conn:
+                async with conn.execute(_LEADERBOARD_ROWS_SQL, (guild_id,)) as cursor:
+                    rows = await cursor.fetchall()
+            board = GuildLeaderboard()
+            for user_id, level, total_characters, gold, power in rows:
+                # 経験値はバッファにまだ書き込まれていない分があるので、メモリ上の値を優先する
+                cached_xp = self.xp_buffer.get_cached(user_id, guild_id)
+                if cached_xp:
+                    total_characters, level = cached_xp
+                self._set_all(board, user_id, level=level, total_characters=total_characters, gold=gold, power=power)
+            for user_id, values in self._early.get(guild_id, {}).items():
+                self._set_all(board, user_id, **values)
+            self._guilds[guild_id] = board
+            logger.info(f"Loaded leaderboard for guild {guild_id} ({len(board)} users).")
+            return board
+        finally:
+            # forget_guild() の後に始まった次の読み込みの状態は消さない
+            if self._loading.get(guild_id) is asyncio.current_task():
+                del self._loading[guild_id]
+                self._early.pop(guild_id, None)
+
+    @staticmethod
+    def _set_all(board: GuildLeaderboard, user_id: int, **values: int):
+        for metric, value in values.items():
+            board.set(user_id, metric, value)
+
+    def update(self, user_id: int, guild_id: int, **values: int):
+        """コミット済み (経験値はメモリ上) の値を反映する。まだ読み込んでいないサーバーは読み込み時に拾うので何もしない。"""
+        board = self._guilds.get(guild_id)
+        if board is not None:
+            self._set_all(board, user_id, **values)
+        elif guild_id in self._early:
+            self._early[guild_id].setdefault(user_id, {}).update(values)
+
+    def _bump_epoch(self, key: Tuple[int, int]):
+        if key in self._write_epochs:
+            self._write_epochs[key] += 1
+
+    def adjust(self, user_id: int, guild_id: int, metric: str, delta: int):
+        self._bump_epoch((guild_id, user_id))
+        board = self._guilds.get(guild_id)
+        if board is not None:
+            current = board.values.get(user_id, {}).get(metric)
+            if current is not None:
+                board.set(user_id, metric, current + delta)
+                return
+        # 元の値が分からない (読み込み中・未登録) ときは読み直す
+        self.refresh_later(user_id, guild_id)
+
+    def refresh_later(self, user_id: int, guild_id: int):
+        """そのユーザーの gold と装備の強さを DB から読み直す (読み込み済みのサーバーのみ)。"""
+        key = (guild_id, user_id)
+        self._bump_epoch(key)
+        if guild_id not in self._guilds and guild_id not in self._loading:
+            return
+        if key not in self._refresh_tasks:
+            self._write_epochs[key] = 0
+            self._refresh_tasks[key] = asyncio.create_task(self._refresh(key))
+
+    async def _refresh(self, key: Tuple[int, int]):
+        guild_id, user_id = key
+        try:
+            while True:
+                epoch_before_load = self._write_epochs[key]
+                async with self.bot.db.read() as conn:
+                    async with conn.execute(f"{_LEADERBOARD_ROWS_SQL} AND u.user_id = ?", (guild_id, user_id)) as cursor:
+                        row = await cursor.fetchone()
+                if epoch_before_load == self._write_epochs[key]:
+                    break
+            if row is not None:
+                self.update(user_id, guild_id, gold=row[3], power=row[4])
+        except Exception as e:
+            logger.error(f"Failed to refresh leaderboard entry for user {user_id} in guild {guild_id}: {e}", exc_info=True)
+        finally:
+            if self._refresh_tasks.get(key) is asyncio.current_task():
+                del self._refresh_tasks[key]
+                self._write_epochs.pop(key, None)
+
+    def forget_guild(self, guild_id: int):
+        """サーバーから抜けたときに呼ぶ。読み込み・読み直しの途中のものも取り消す。"""
+        self._guilds.pop(guild_id, None)
+        self._early.pop(guild_id, None)
+        task = self._loading.pop(guild_id, None)
+        if task is not None:
+            task.cancel()
+        for key in [key for key in self._refresh_tasks if key[0] == guild_id]:
+            self._refresh_tasks.pop(key).cancel()
+            self._write_epochs.pop(key, None)
+
+    def clear(self):
+        """/vreset_rpg のときに呼ぶ。リセット前の値を書き戻さないよう、読み込み・読み直しの途中のものも取り消す。"""
+        guild_ids = set(self._guilds) | set(self._loading) | set(self._early)
+        guild_ids.update(guild_id for guild_id, _ in self._refresh_tasks)
+        for guild_id in guild_ids:
+            self.forget_guild(guild_id)
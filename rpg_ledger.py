@@ -0,0 +1,162 @@
+# rpg_ledger.py
+import logging
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from rpg_data import LEDGER_COMPACT_BATCH_ROWS
+
+logger = logging.getLogger('SophiaBot.RPGLedger')
+
+# 台帳の source (ゴールドが動いた理由) と /vledger での表示名
+LEDGER_SOURCES: Dict[str, str] = {
+    "battle": "戦闘の報酬",
+    "drop_sell": "ドロップの売却",
+    "drop_overflow": "入りきらないドロップの売却",
+    "drop_overflow_expired": "入りきらないドロップの売却 (時間切れ)",
+    "gacha": "ガチャ",
+    "gacha_sell": "ガチャ景品の売却",
+    "sell": "/vsell",
+}
+
+
+class LedgerEntry(NamedTuple):
+    user_id: int
+    guild_id: int
+    source: str
+    delta: int
+    # 変更後の所持ゴールド (同じトランザクションの中で読んだ値)
+    balance_after: int
+    # 関係する ID (インベントリID・アイテムID・敵の種類など) をカンマ区切りで
+    ref_ids: str
+    created_at: float
+
+
+class LedgerRollup(NamedTuple):
+    day: str
+    source: str
+    entries: int
+    total_delta: int
+    closing_balance: int
+
+
+def _format_ref_ids(ref_ids: Iterable) -> str:
+    return ",".join(str(ref) for ref in ref_ids)
+
+
+class LedgerBuffer:
+    """
+    economy_ledger への追記を、書き込みトランザクションの最後に executemany でまとめて行うためのバッファ。
+    接続ごとに溜め、RPGDatabase.write() がコミットの直前に flush() し、巻き戻すときは discard() で捨てる。
+    ゴールドの更新と台帳の追記は必ず同じトランザクションに入るので、片方だけが残ることはない。
+    """
+
+    def __init__(self):
+        self._pending: Dict[int, List[LedgerEntry]] = {}
+        self.written = 0
+
+    def add(self, conn, entry: LedgerEntry):
+        self._pending.setdefault(id(conn), []).append(entry)
+
+    async def flush(self, conn) -> int:
+        entries = self._pending.pop(id(conn), None)
+        if not entries:
+            return 0
+        await conn.executemany(
+            "INSERT INTO economy_ledger (user_id, guild_id, source, delta, balance_after, ref_ids, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", entries)
+        self.written += len(entries)
+        return len(entries)
+
+    def discard(self, conn):
+        self._pending.pop(id(conn), None)
+
+
+LEDGER = LedgerBuffer()
+
+
+async def record_gold(conn, user_id: int, guild_id: int, delta: int, source: str, ref_ids: Iterable = ()) -> Optional[int]:
+    """
+    既に users.gold に反映した delta を台帳に記録し、変更後の所持ゴールドを返す。
+    conn は bot.db.write() のトランザクション内の接続を渡すこと (delta が 0 なら何もしない)。
+    """
+    if not delta:
+        return None
+    if source not in LEDGER_SOURCES:
+        logger.warning(f"Unknown ledger source {source!r}.")
+    async with conn.execute("SELECT gold FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+        row = await cursor.fetchone()
+    balance_after = row[0] if row else 0
+    LEDGER.add(conn, LedgerEntry(user_id, guild_id, source, delta, balance_after, _format_ref_ids(ref_ids), time.time()))
+    return balance_after
+
+
+async def apply_gold(conn, user_id: int, guild_id: int, delta: int, source: str, ref_ids: Iterable = (),
+                     require_funds: bool = False) -> bool:
+    """
+    users.gold に delta を加えて台帳に記録する。require_funds=True なら所持ゴールドが足りる場合だけ減らす。
+    ゴールドを更新できなければ False (台帳にも記録しない)。
+    """
+    if require_funds:
+        cursor = await conn.execute("UPDATE users SET gold = gold + ? WHERE user_id = ? AND guild_id = ? AND gold + ? >= 0",
+                                    (delta, user_id, guild_id, delta))
+    else:
+        cursor = await conn.execute("UPDATE users SET gold = gold + ? WHERE user_id = ? AND guild_id = ?",
+                                    (delta, user_id, guild_id))
+    if cursor.rowcount == 0:
+        return False
+    await record_gold(conn, user_id, guild_id, delta, source, ref_ids)
+    return True
+
+
+async def fetch_ledger(conn, user_id: int, guild_id: int, limit: int = 20,
+                       source: Optional[str] = None) -> List[Tuple[int, LedgerEntry]]:
+    """新しい順に (entry_id, LedgerEntry) を返す。idx_economy_ledger_owner を使う。"""
+    sql = ("SELECT entry_id, user_id, guild_id, source, delta, balance_after, ref_ids, created_at "
+           "FROM economy_ledger WHERE user_id = ? AND guild_id = ?")
+    params: List = [user_id, guild_id]
+    if source:
+        sql += " AND source = ?"
+        params.append(source)
+    sql += " ORDER BY entry_id DESC LIMIT ?"
+    params.append(limit)
+    async with conn.execute(sql, params) as cursor:
+        return [(row[0], LedgerEntry(*row[1:])) for row in await cursor.fetchall()]
+
+
+async def fetch_rollups(conn, user_id: int, guild_id: int, limit: int = 10) -> List[LedgerRollup]:
+    """集約済みの古い記録を新しい日から返す。"""
+    async with conn.execute(
+            "SELECT day, source, entries, total_delta, closing_balance FROM economy_ledger_rollups "
+            "WHERE user_id = ? AND guild_id = ? ORDER BY day DESC, source LIMIT ?",
+            (user_id, guild_id, limit)) as cursor:
+        return [LedgerRollup(*row) for row in await cursor.fetchall()]
+
+
+async def compact_ledger(conn, before: float, max_rows: int = LEDGER_COMPACT_BATCH_ROWS) -> int:
+    """
+    created_at が before より古い記録を、古いものから max_rows 件まで (ユーザー, 日, source) ごとの集計に移す。
+    conn は bot.db.write() のトランザクション内の接続を渡すこと。移した件数を返す。
+    """
+    async with conn.execute(
+            "SELECT MAX(entry_id) FROM (SELECT entry_id FROM economy_ledger WHERE created_at < ? ORDER BY entry_id LIMIT ?)",
+            (before, max_rows)) as cursor:
+        row = await cursor.fetchone()
+    last_entry_id = row[0] if row else None
+    if last_entry_id is None:
+        return 0
+
+    # MAX() と一緒に選んだ素の列 (balance_after) は、SQLite では MAX の行の値になる
+    await conn.execute("""
+        INSERT INTO economy_ledger_rollups (user_id, guild_id, day, source, entries, total_delta, closing_balance, last_entry_id)
+        SELECT user_id, guild_id, date(created_at, 'unixepoch'), source, COUNT(*), SUM(delta), balance_after, MAX(entry_id)
+        FROM economy_ledger
+        WHERE entry_id <= ? AND created_at < ?
+        GROUP BY user_id, guild_id, date(created_at, 'unixepoch'), source
+        ON CONFLICT (user_id, guild_id, day, source) DO UPDATE SET
+            entries = entries + excluded.entries,
+            total_delta = total_delta + excluded.total_delta,
+            closing_balance = CASE WHEN excluded.last_entry_id > last_entry_id THEN excluded.closing_balance ELSE closing_balance END,
+            last_entry_id = MAX(last_entry_id, excluded.last_entry_id)
+    """, (last_entry_id, before))
+    cursor = await conn.execute("DELETE FROM economy_ledger WHERE entry_id <= ? AND created_at < ?", (last_entry_id, before))
+    return cursor.rowcount
@@ -0,0 +1,86 @@
+# rpg_locks.py
+import asyncio
+import contextlib
+import logging
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Tuple
+
+from rpg_data import USER_LOCK_IDLE_SECONDS, USER_LOCK_MAX_ENTRIES
+
+logger = logging.getLogger('SophiaBot.RPGLocks')
+
+UserKey = Tuple[int, int]
+
+
+class _LockEntry:
+    __slots__ = ("lock", "holders", "last_used")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # 取得待ちも含めてこのロックを使っているコルーチンの数。0 のものだけ捨ててよい。
+        self.holders = 0
+        self.last_used = time.monotonic()
+
+
+class UserLockManager:
+    """
+    (user_id, guild_id) ごとの asyncio.Lock を配る。
+    ゴールド・インベントリ・装備を変更する処理は hold() の中で「読む → 計算する → 書く」を行うこと。
+    使われていないロックは idle_seconds 経過後、または max_entries を超えた時点で古い順に捨てる。
+    """
+
+    def __init__(self, idle_seconds: float = USER_LOCK_IDLE_SECONDS, max_entries: int = USER_LOCK_MAX_ENTRIES):
+        self.idle_seconds = idle_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[UserKey, _LockEntry]" = OrderedDict()
+        self._last_sweep = time.monotonic()
+
+    @contextlib.asynccontextmanager
+    async def hold(self, user_id: int, guild_id: int) -> AsyncIterator[None]:
+        key = (user_id, guild_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _LockEntry()
+            self._entries[key] = entry
+            self._evict(time.monotonic())
+        else:
+            self._entries.move_to_end(key)
+
+        entry.holders += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.holders -= 1
+            entry.last_used = time.monotonic()
+
+    def is_locked(self, user_id: int, guild_id: int) -> bool:
+        entry = self._entries.get((user_id, guild_id))
+        return entry is not None and entry.lock.locked()
+
+    def _evict(self, now: float):
+        """上限超過分と、一定時間使われていないロックを捨てる。使用中のものは残す。"""
+        overflow = len(self._entries) - self.max_entries
+        sweep_idle = now - self._last_sweep >= self.idle_seconds
+        if overflow <= 0 and not sweep_idle:
+            return
+        if sweep_idle:
+            self._last_sweep = now
+
+        removed = 0
+        for key in list(self._entries.keys()):
+            entry = self._entries[key]
+            if entry.holders:
+                continue
+            if overflow > 0 or now - entry.last_used >= self.idle_seconds:
+                del self._entries[key]
+                overflow -= 1
+                removed += 1
+            elif not sweep_idle:
+                break
+        if removed:
+            logger.debug(f"Evicted {removed} idle user locks ({len(self._entries)} remaining).")
+
+    def __len__(self) -> int:
+        return len(self._entries)
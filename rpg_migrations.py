@@ -0,0 +1,113 @@
+# rpg_migrations.py
+import logging
+from typing import NamedTuple, Tuple
+
+from rpg_utils import transaction
+
+logger = logging.getLogger('SophiaBot.RPGMigrations')
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    statements: Tuple[str, ...]
+
+
+# スキーマ変更はここに追記する。適用済みのマイグレーションは書き換えないこと。
+# バージョン1は PRAGMA user_version 導入前のスキーマそのもの (既存DBでは IF NOT EXISTS で何もしない)。
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(1, "initial schema", (
+        '''CREATE TABLE IF NOT EXISTS items (
+        item_id INTEGER PRIMARY KEY, base_name TEXT, type TEXT, rarity TEXT,
+        base_attack INTEGER, base_defense INTEGER )''',
+        '''CREATE TABLE IF NOT EXISTS effects (
+        effect_id INTEGER PRIMARY KEY, prefix_name TEXT, rarity TEXT,
+        attack_bonus INTEGER, defense_bonus INTEGER )''',
+        '''CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER, guild_id INTEGER, level INTEGER, total_characters INTEGER,
+        equipped_weapon INTEGER, equipped_armor INTEGER, gold INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, guild_id) )''',
+        '''CREATE TABLE IF NOT EXISTS inventory (
+        inventory_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, guild_id INTEGER,
+        item_id INTEGER, effect_id INTEGER,
+        FOREIGN KEY (user_id, guild_id) REFERENCES users (user_id, guild_id),
+        FOREIGN KEY (item_id) REFERENCES items (item_id),
+        FOREIGN KEY (effect_id) REFERENCES effects (effect_id) )''',
+    )),
+    Migration(2, "covering indexes for inventory and item lookups", (
+        # インベントリ一覧・売却・リロール・ガチャの件数確認は全て (user_id, guild_id) で絞って
+        # inventory_id 順に item_id / effect_id を読むため、テーブル本体を引かずに済むようにする
+        "CREATE INDEX IF NOT EXISTS idx_inventory_owner ON inventory (user_id, guild_id, inventory_id, item_id, effect_id)",
+        "CREATE INDEX IF NOT EXISTS idx_items_type_rarity ON items (type, rarity, item_id)",
+        "CREATE INDEX IF NOT EXISTS idx_effects_rarity ON effects (rarity, effect_id)",
+    )),
+    Migration(3, "persisted battle sessions", (
+        # 進行中の戦闘 (rpg_battle_store.BattleStore)。1ユーザー1行で、数値やログは state に JSON で持つ
+        '''CREATE TABLE IF NOT EXISTS battles (
+        user_id INTEGER PRIMARY KEY, guild_id INTEGER, channel_id INTEGER, message_id INTEGER,
+        enemy_key TEXT, state TEXT, updated_at REAL )''',
+        "CREATE INDEX IF NOT EXISTS idx_battles_updated_at ON battles (updated_at)",
+    )),
+    Migration(4, "pending component actions", (
+        # ボタン・セレクトの保留中の操作 (rpg_actions.PendingActionStore)。custom_id に入りきらない状態を payload に JSON で持つ
+        '''CREATE TABLE IF NOT EXISTS pending_actions (
+        token INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, user_id INTEGER, guild_id INTEGER,
+        payload TEXT, expires_at REAL )''',
+        "CREATE INDEX IF NOT EXISTS idx_pending_actions_expires_at ON pending_actions (expires_at)",
+    )),
+    Migration(5, "economy ledger", (
+        # ゴールドの増減の記録 (rpg_ledger)。追記のみで、古い記録は economy_ledger_rollups に集約してから消す
+        '''CREATE TABLE IF NOT EXISTS economy_ledger (
+        entry_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, guild_id INTEGER, source TEXT,
+        delta INTEGER, balance_after INTEGER, ref_ids TEXT, created_at REAL )''',
+        # /vledger はユーザーごとに新しい順で読む。集約は created_at の古いものから
+        "CREATE INDEX IF NOT EXISTS idx_economy_ledger_owner ON economy_ledger (user_id, guild_id, entry_id)",
+        "CREATE INDEX IF NOT EXISTS idx_economy_ledger_created_at ON economy_ledger (created_at)",
+        '''CREATE TABLE IF NOT EXISTS economy_ledger_rollups (
+        user_id INTEGER, guild_id INTEGER, day TEXT, source TEXT, entries INTEGER, total_delta INTEGER,
+        closing_balance INTEGER, last_entry_id INTEGER,
+        PRIMARY KEY (user_id, guild_id, day, source) )''',
+    )),
+    Migration(6, "users by guild", (
+        # ランキング (rpg_leaderboard) はサーバーごとに users を1回だけ読み込む
+        "CREATE INDEX IF NOT EXISTS idx_users_guild ON users (guild_id)",
+    )),
+    Migration(7, "equipment roles created by the bot", (
+        # RoleManager が作った装備ロールの記録。使われなくなったロールの回収はここにあるものだけを対象にする
+        '''CREATE TABLE IF NOT EXISTS equipment_roles (
+        role_id INTEGER PRIMARY KEY, guild_id INTEGER, name TEXT, created_at REAL )''',
+        "CREATE INDEX IF NOT EXISTS idx_equipment_roles_guild ON equipment_roles (guild_id)",
+    )),
+)
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+async def get_schema_version(db_conn) -> int:
+    async with db_conn.execute("PRAGMA user_version") as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else 0
+
+
+async def run_migrations(db_conn) -> int:
+    """
+    PRAGMA user_version より新しいマイグレーションを順に適用し、適用後のバージョンを返す。
+    各マイグレーションは user_version の更新と同じトランザクションで実行するので、
+    途中で失敗してもそのバージョンは未適用のまま残り、次回起動時に再実行される。
+    """
+    current = await get_schema_version(db_conn)
+    if current > SCHEMA_VERSION:
+        logger.warning(f"RPG database schema version {current} is newer than this code ({SCHEMA_VERSION}). Skipping migrations.")
+        return current
+
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        async with transaction(db_conn):
+            for statement in migration.statements:
+                await db_conn.execute(statement)
+            # PRAGMA はパラメータを受け付けないため整数をそのまま埋め込む
+            await db_conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+        current = migration.version
+        logger.info(f"RPGデータベースのマイグレーション v{migration.version} ({migration.description}) を適用しました。")
+    return current
@@ -0,0 +1,115 @@
+# rpg_render.py
+import asyncio
+import json
+import logging
+import time
+from typing import Callable, Optional, Tuple
+
+import discord
+
+from rpg_data import BATTLE_RENDER_WINDOW_SECONDS
+
+logger = logging.getLogger('SophiaBot.RPGRender')
+
+RenderResult = Tuple[discord.Embed, Optional[discord.ui.View]]
+
+
+def _view_signature(view: Optional[discord.ui.View]):
+    if view is None:
+        return None
+    return id(view), tuple(
+        (getattr(item, "custom_id", None), getattr(item, "label", None), getattr(item, "disabled", None))
+        for item in view.children
+    )
+
+
+def render_signature(embed: discord.Embed, view: Optional[discord.ui.View]) -> int:
+    # 描画内容そのものではなくハッシュだけを覚えておく
+    return hash((json.dumps(embed.to_dict(), sort_keys=True, ensure_ascii=False), _view_signature(view)))
+
+
+class MessageRenderer:
+    """
+    1つのメッセージへの編集をまとめる。
+    request() は「状態が変わった」印を付けるだけで、実際の message.edit は前回の編集から
+    window 秒以上空けて行う。その間の変更は1回の編集にまとめられ、編集直前に render() で
+    その時点の embed / view を組み立てる。前回送った内容と同じなら編集しない。
+    """
+    __slots__ = (
+        "_render", "window", "_on_message_lost", "message", "_dirty", "_task",
+        "_last_edit", "_last_signature", "closed",
+    )
+
+    def __init__(self, render: Callable[[], RenderResult], window: float = BATTLE_RENDER_WINDOW_SECONDS,
+                 on_message_lost: Optional[Callable[[], None]] = None):
+        self._render = render
+        self.window = window
+        self._on_message_lost = on_message_lost
+        self.message: Optional[discord.Message] = None
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+        self._last_edit = float("-inf")
+        self._last_signature: Optional[int] = None
+        self.closed = False
+
+    def attach(self, message: discord.Message, embed: Optional[discord.Embed] = None,
+               view: Optional[discord.ui.View] = None):
+        """
+        最初に送信したメッセージとその内容を登録する。
+        embed を渡さない場合 (再起動後に既存のメッセージを引き継いだときなど) は、次の request() で必ず編集する。
+        """
+        self.message = message
+        if embed is None:
+            self._last_signature = None
+            return
+        self._last_edit = time.monotonic()
+        self._last_signature = render_signature(embed, view)
+
+    def request(self):
+        if self.closed or self.message is None:
+            return
+        self._dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def flush(self):
+        """予約中の編集が終わるまで待つ。"""
+        task = self._task
+        if task is not None and not task.done():
+            await asyncio.shield(task)
+
+    def close(self):
+        """以降の編集を止める。予約中の編集も取り消す。"""
+        self.closed = True
+        self._dirty = False
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    async def _run(self):
+        # 編集の HTTP 待ちの間に request() されても、ループの次の周回で拾う
+        while self._dirty and not self.closed:
+            delay = self._last_edit + self.window - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._dirty = False
+            await self._edit()
+
+    async def _edit(self):
+        embed, view = self._render()
+        signature = render_signature(embed, view)
+        if signature == self._last_signature:
+            return
+        try:
+            await self.message.edit(embed=embed, view=view)
+        except discord.NotFound:
+            logger.warning(f"Message (ID: {self.message.id}) not found. Stopping updates.")
+            self.closed = True
+            if self._on_message_lost:
+                self._on_message_lost()
+            return
+        except Exception as e:
+            logger.error(f"Error editing message (ID: {self.message.id}): {e}", exc_info=True)
+            return
+        finally:
+            self._last_edit = time.monotonic()
+        self._last_signature = signature
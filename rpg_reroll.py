@@ -0,0 +1,137 @@
+# rpg_reroll.py
+import logging
+import random
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from rpg_data import RARITY_ORDER, REROLL_CONSUME_COUNT, REROLL_MAX_ROUNDS
+from rpg_catalog import CATALOG, NO_EFFECT, EffectRecord
+from rpg_inventory import InventoryRow, fetch_inventory_rows
+from rpg_sampler import RARITY_SAMPLER
+
+logger = logging.getLogger('SophiaBot.RPGReroll')
+
+# 消費する装備の選び方 (自動選択)。対象と同じベースレアリティで、対象・装備中のものを除いた中から
+#   1. 効果のレアリティが低いもの (効果なしが最初)
+#   2. ATK+DEF の合計が低いもの
+#   3. インベントリIDが小さい (古い) もの
+# の順に選ぶ。ベースレアリティは全員同じなので、rarity_score の順は効果のレアリティの順と同じになる。
+CONSUME_ORDER_SQL = "rarity_score ASC, attack + defense ASC, inventory_id ASC"
+
+
+class RerollError(Exception):
+    """再抽選を実行できなかった (対象が無い・消費できる装備が足りないなど)。トランザクションは巻き戻す。"""
+
+
+class RerollRound(NamedTuple):
+    effect: EffectRecord
+    consumed: Tuple[InventoryRow, ...]
+
+
+class RerollResult(NamedTuple):
+    target: InventoryRow
+    rounds: Tuple[RerollRound, ...]
+    # stop_at_rarity を指定した場合、そのレアリティ以上の効果が出て途中で止まったか
+    reached_target: bool
+
+    @property
+    def final_effect(self) -> EffectRecord:
+        return self.rounds[-1].effect
+
+    @property
+    def final_name(self) -> str:
+        return f"{self.final_effect.prefix_name}{self.target.base_name}"
+
+    @property
+    def consumed_ids(self) -> Tuple[int, ...]:
+        return tuple(row.inventory_id for r in self.rounds for row in r.consumed)
+
+
+def _placeholders(count: int) -> str:
+    return ", ".join("?" * count)
+
+
+def reaches_rarity(effect: EffectRecord, stop_at_rarity: Optional[str]) -> bool:
+    if stop_at_rarity is None:
+        return False
+    return RARITY_ORDER.get(effect.rarity, 0) >= RARITY_ORDER[stop_at_rarity]
+
+
+def roll_effect(rng: random.Random = random) -> EffectRecord:
+    effect_rarity = RARITY_SAMPLER.sample(rng)
+    effect = CATALOG.random_effect(effect_rarity, rng)
+    if effect is None:
+        logger.warning(f"No effect found for rarity {effect_rarity}. Assigning 'no effect' (ID 0).")
+        return NO_EFFECT
+    return effect
+
+
+async def fetch_reroll_target(conn, user_id: int, guild_id: int, inventory_id: int) -> Optional[InventoryRow]:
+    rows = await fetch_inventory_rows(conn, user_id, guild_id, "inventory_id = ?", (inventory_id,))
+    return rows[0] if rows else None
+
+
+async def fetch_consumables(conn, user_id: int, guild_id: int, target: InventoryRow,
+                            keep_ids: Iterable[Optional[int]] = (), only_ids: Optional[Sequence[int]] = None,
+                            limit: Optional[int] = None) -> List[InventoryRow]:
+    """
+    target の再抽選に消費できる装備を、CONSUME_ORDER_SQL の順 (先に消費するものから) で返す。
+    keep_ids (装備中のものなど) は除く。only_ids を渡すとその中からだけ選ぶ (確認画面で見せたものに限る場合)。
+    """
+    clauses = ["base_rarity = ?", "inventory_id != ?"]
+    params: List = [target.base_rarity, target.inventory_id]
+    keep = [i for i in keep_ids if i]
+    if keep:
+        clauses.append(f"inventory_id NOT IN ({_placeholders(len(keep))})")
+        params.extend(keep)
+    if only_ids is not None:
+        if not only_ids:
+            return []
+        clauses.append(f"inventory_id IN ({_placeholders(len(only_ids))})")
+        params.extend(only_ids)
+    return await fetch_inventory_rows(conn, user_id, guild_id, " AND ".join(clauses), params,
+                                      order_by=CONSUME_ORDER_SQL, limit=limit)
+
+
+async def execute_rerolls(conn, user_id: int, guild_id: int, target_id: int, max_rounds: int,
+                          stop_at_rarity: Optional[str] = None, keep_ids: Iterable[Optional[int]] = (),
+                          only_ids: Optional[Sequence[int]] = None, rng: random.Random = random) -> RerollResult:
+    """
+    最大 max_rounds 回の再抽選をまとめて行う。conn は bot.db.write() のトランザクション内の接続を渡すこと。
+    抽選はメモリ上で1回ずつ行い、stop_at_rarity 以上の効果が出たらそこで止める。
+    消費する装備の削除 (DELETE 1回) と対象の効果の更新 (UPDATE 1回) は最後にまとめて行う。
+    途中で止まった場合、残りの回数分の装備は消費しない。
+    """
+    max_rounds = min(max_rounds, REROLL_MAX_ROUNDS)
+    target = await fetch_reroll_target(conn, user_id, guild_id, target_id)
+    if target is None:
+        raise RerollError(f"ID {target_id} は存在しないかあなたのアイテムではありません。")
+    if max_rounds < 1:
+        raise RerollError("再抽選の回数は1回以上を指定してください。")
+
+    candidates = await fetch_consumables(conn, user_id, guild_id, target, keep_ids, only_ids,
+                                         limit=max_rounds * REROLL_CONSUME_COUNT)
+    rounds_available = min(max_rounds, len(candidates) // REROLL_CONSUME_COUNT)
+    if rounds_available < 1:
+        raise RerollError(f"同じベースレアリティ ({target.base_rarity}) の装備が他に{REROLL_CONSUME_COUNT}個必要です。"
+                          f"(消費できるもの: {len(candidates)}個)")
+
+    rounds: List[RerollRound] = []
+    reached_target = False
+    for i in range(rounds_available):
+        effect = roll_effect(rng)
+        consumed = tuple(candidates[i * REROLL_CONSUME_COUNT:(i + 1) * REROLL_CONSUME_COUNT])
+        rounds.append(RerollRound(effect, consumed))
+        if reaches_rarity(effect, stop_at_rarity):
+            reached_target = True
+            break
+
+    result = RerollResult(target, tuple(rounds), reached_target)
+    consumed_ids = result.consumed_ids
+    delete_cursor = await conn.execute(
+        f"DELETE FROM inventory WHERE user_id = ? AND guild_id = ? AND inventory_id IN ({_placeholders(len(consumed_ids))})",
+        (user_id, guild_id, *consumed_ids))
+    if delete_cursor.rowcount != len(consumed_ids):
+        raise RerollError(f"消費アイテムの削除に失敗しました。{delete_cursor.rowcount}個しか削除できませんでした。")
+    await conn.execute("UPDATE inventory SET effect_id = ? WHERE inventory_id = ? AND user_id = ? AND guild_id = ?",
+                       (result.final_effect.effect_id, target.inventory_id, user_id, guild_id))
+    return result
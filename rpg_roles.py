@@ -0,0 +1,260 @@
+# rpg_roles.py
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import discord
+
+from rpg_data import ROLE_UPDATE_DELAY_SECONDS, ROLE_GC_MAX_DELETIONS, ROLE_GC_GRACE_SECONDS
+
+logger = logging.getLogger('SophiaBot.RPGRoles')
+
+# 装備ロールの種別 (ロール名の接頭辞)
+RPG_ROLE_TYPES = ("武器", "防具")
+ROLE_NAME_MAX_LENGTH = 100
+
+MemberKey = Tuple[int, int]
+
+
+def equipment_role_name(item_type_display: str, full_item_name: str) -> str:
+    name = f"{item_type_display}: {full_item_name}"
+    if len(name) > ROLE_NAME_MAX_LENGTH:
+        name = name[:ROLE_NAME_MAX_LENGTH - 3] + "..."
+    return name
+
+
+def is_equipment_role_name(name: str, item_type_display: Optional[str] = None) -> bool:
+    types = (item_type_display,) if item_type_display else RPG_ROLE_TYPES
+    return any(name.startswith(f"{t}:") for t in types)
+
+
+class RoleManager:
+    """
+    装備ロール ("武器: <アイテム名>" など) の付け替えをまとめて行う。
+
+    - サーバーごとに ロール名 -> ロールID の索引を持ち、guild.roles を毎回走査しない。
+      索引はロールの作成・削除・更新イベントで更新する (RPG cog のリスナーから呼ぶ)。
+    - request() は付けたいロールを覚えるだけで、delay 秒後にユーザーごとに1回の member.edit で反映する。
+      その間に何度装備を変えても最後の状態だけが反映される。
+    - collect_orphan_roles() は誰も持っていない装備ロールを消す。対象は自分で作ったと記録してある
+      (equipment_roles テーブルにある) ロールだけで、サーバーの管理者が作った同じ名前のロールには触らない。
+    """
+
+    def __init__(self, bot, delay: float = ROLE_UPDATE_DELAY_SECONDS, max_deletions: int = ROLE_GC_MAX_DELETIONS,
+                 grace_seconds: float = ROLE_GC_GRACE_SECONDS):
+        self.bot = bot
+        self.delay = delay
+        self.max_deletions = max_deletions
+        self.grace_seconds = grace_seconds
+        self._index: Dict[int, Dict[str, int]] = {}
+        # (guild_id, user_id) -> {種別: 付けたいロール名}
+        self._pending: Dict[MemberKey, Dict[str, str]] = {}
+        self._tasks: Dict[MemberKey, asyncio.Task] = {}
+        self._create_locks: Dict[int, asyncio.Lock] = {}
+        # 監視用: requested / applied / unchanged / created / collected
+        self.counters: Counter = Counter()
+
+    # --- ロール名の索引 ---
+
+    def _guild_index(self, guild: discord.Guild) -> Dict[str, int]:
+        index = self._index.get(guild.id)
+        if index is None:
+            index = {}
+            # 同名のロールが複数ある場合は discord.utils.get と同じく先に見つかった方を使う
+            for role in guild.roles:
+                index.setdefault(role.name, role.id)
+            self._index[guild.id] = index
+        return index
+
+    def get_role(self, guild: discord.Guild, name: str) -> Optional[discord.Role]:
+        index = self._guild_index(guild)
+        role_id = index.get(name)
+        if role_id is None:
+            return None
+        role = guild.get_role(role_id)
+        if role is None or role.name != name:
+            # イベントを取りこぼした場合に備えて、食い違っていたら引き直す
+            del index[name]
+            role = discord.utils.get(guild.roles, name=name)
+            if role is not None:
+                index[name] = role.id
+        return role
+
+    def on_role_create(self, role: discord.Role):
+        index = self._index.get(role.guild.id)
+        if index is not None:
+            index.setdefault(role.name, role.id)
+
+    def on_role_delete(self, role: discord.Role):
+        index = self._index.get(role.guild.id)
+        if index is None or index.get(role.name) != role.id:
+            return
+        del index[role.name]
+        other = next((r for r in role.guild.roles if r.name == role.name and r.id != role.id), None)
+        if other is not None:
+            index[role.name] = other.id
+
+    def on_role_update(self, before: discord.Role, after: discord.Role):
+        if before.name != after.name:
+            self.on_role_delete(before)
+            self.on_role_create(after)
+
+    def forget_guild(self, guild_id: int):
+        self._index.pop(guild_id, None)
+        self._create_locks.pop(guild_id, None)
+
+    async def _ensure_role(self, guild: discord.Guild, name: str) -> Optional[discord.Role]:
+        role = self.get_role(guild, name)
+        if role is not None:
+            return role
+        lock = self._create_locks.setdefault(guild.id, asyncio.Lock())
+        async with lock:
+            # 待っている間に同じ名前のロールが作られていればそれを使う
+            role = self.get_role(guild, name)
+            if role is not None:
+                return role
+            try:
+                role = await guild.create_role(name=name, mentionable=False, reason=f"RPG装備: {name}")
+            except discord.Forbidden:
+                logger.warning(f"Missing permissions to create role {name} in {guild.name}.")
+                return None
+            except Exception as e:
+                logger.error(f"Error creating role {name} in {guild.name}: {e}", exc_info=True)
+                return None
+            self._guild_index(guild)[name] = role.id
+            self.counters["created"] += 1
+            await self._record_created(role)
+            return role
+
+    # --- 自分で作ったロールの記録 ---
+
+    async def _record_created(self, role: discord.Role):
+        try:
+            async with self.bot.db.write() as conn:
+                await conn.execute(
+                    "INSERT OR REPLACE INTO equipment_roles (role_id, guild_id, name, created_at) VALUES (?, ?, ?, ?)",
+                    (role.id, role.guild.id, role.name, time.time()))
+        except Exception as e:
+            # 記録できなかったロールは回収の対象にならないだけ (消しすぎることはない)
+            logger.error(f"Failed to record created role {role.name} ({role.id}) in {role.guild.name}: {e}", exc_info=True)
+
+    async def _owned_role_ids(self, guild_id: int) -> Set[int]:
+        async with self.bot.db.read() as conn:
+            async with conn.execute("SELECT role_id FROM equipment_roles WHERE guild_id = ?", (guild_id,)) as cursor:
+                return {row[0] for row in await cursor.fetchall()}
+
+    async def _forget_roles(self, role_ids: Iterable[int]):
+        rows = [(role_id,) for role_id in role_ids]
+        if not rows:
+            return
+        async with self.bot.db.write() as conn:
+            await conn.executemany("DELETE FROM equipment_roles WHERE role_id = ?", rows)
+
+    # --- 付け替えのキュー ---
+
+    def request(self, member: discord.Member, item_type_display: str, full_item_name: str):
+        """member の item_type_display 種別のロールを full_item_name のものにする (delay 秒後にまとめて反映)。"""
+        key = (member.guild.id, member.id)
+        self._pending.setdefault(key, {})[item_type_display] = equipment_role_name(item_type_display, full_item_name)
+        self.counters["requested"] += 1
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    async def _run(self, key: MemberKey):
+        try:
+            # 反映中に新しい request() が来たら、もう一度待ってから反映する
+            while key in self._pending:
+                await asyncio.sleep(self.delay)
+                desired = self._pending.pop(key, None)
+                if desired:
+                    await self._apply(key, desired)
+        finally:
+            self._tasks.pop(key, None)
+
+    async def _apply(self, key: MemberKey, desired: Dict[str, str]):
+        guild_id, user_id = key
+        guild = self.bot.get_guild(guild_id)
+        member = guild.get_member(user_id) if guild else None
+        if member is None:
+            return
+
+        current = [role for role in member.roles if not role.is_default()]
+        roles = [role for role in current if not any(is_equipment_role_name(role.name, t) for t in desired)]
+        for name in desired.values():
+            role = await self._ensure_role(guild, name)
+            if role is not None and role not in roles:
+                roles.append(role)
+
+        if set(roles) == set(current):
+            self.counters["unchanged"] += 1
+            return
+        try:
+            await member.edit(roles=roles, reason="RPG装備変更")
+            self.counters["applied"] += 1
+        except discord.Forbidden:
+            logger.warning(f"Missing permissions to edit roles of {member.name} in {guild.name}.")
+        except discord.NotFound:
+            pass
+        except Exception as e:
+            logger.error(f"Error editing roles of {member.name} in {guild.name}: {e}", exc_info=True)
+
+    async def flush(self):
+        """待っている付け替えを今すぐ反映する (cog のアンロード時など)。"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        pending, self._pending = self._pending, {}
+        for key, desired in pending.items():
+            try:
+                await self._apply(key, desired)
+            except Exception as e:
+                logger.error(f"Failed to apply pending roles for {key}: {e}", exc_info=True)
+
+    # --- 使われなくなったロールの回収 ---
+
+    async def collect_orphan_roles(self) -> int:
+        """
+        自分で作った装備ロールのうち誰も持っていないものを消し、消した数を返す。1回に消すのは max_deletions 個まで。
+        既に無くなったロールの記録もここで消す。
+        """
+        removed = 0
+        cutoff = discord.utils.utcnow() - timedelta(seconds=self.grace_seconds)
+        for guild in self.bot.guilds:
+            if removed >= self.max_deletions:
+                break
+            # メンバーのキャッシュが揃っていないと role.members が空に見えるので、そのサーバーは飛ばす
+            if not guild.chunked:
+                continue
+            owned = await self._owned_role_ids(guild.id)
+            if not owned:
+                continue
+            waiting = {name for (guild_id, _), desired in self._pending.items() if guild_id == guild.id
+                       for name in desired.values()}
+            gone = {role_id for role_id in owned if guild.get_role(role_id) is None}
+            for role_id in owned - gone:
+                if removed >= self.max_deletions:
+                    break
+                role = guild.get_role(role_id)
+                if (not is_equipment_role_name(role.name) or role.managed or role.members
+                        or role.name in waiting or role.created_at > cutoff):
+                    continue
+                try:
+                    await role.delete(reason="RPG装備ロール: 所持者なし")
+                    removed += 1
+                    gone.add(role_id)
+                except discord.NotFound:
+                    gone.add(role_id)
+                except discord.Forbidden:
+                    logger.warning(f"Missing permissions to delete role {role.name} in {guild.name}.")
+                    break
+                except Exception as e:
+                    logger.error(f"Error deleting role {role.name} in {guild.name}: {e}", exc_info=True)
+            await self._forget_roles(gone)
+        if removed:
+            self.counters["collected"] += removed
+            logger.info(f"Deleted {removed} unused equipment roles.")
+        return removed
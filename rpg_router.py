@@ -0,0 +1,115 @@
+# rpg_router.py
+import logging
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import discord
+
+logger = logging.getLogger('SophiaBot.RPGRouter')
+
+CUSTOM_ID_PREFIX = "rpg"
+CUSTOM_ID_MAX_LENGTH = 100
+
+# handler(rpg_cog, interaction, *args) — args は custom_id のユーザーIDより後ろの部分 (文字列のまま)
+ComponentHandler = Callable[..., Awaitable[None]]
+
+
+class ComponentId(NamedTuple):
+    action: str
+    user_id: int
+    args: List[str]
+
+
+def component_id(action: str, user_id: int, *args) -> str:
+    """rpg:<action>:<操作できるユーザーID>:<引数...> 形式の custom_id を作る。"""
+    custom_id = ":".join((CUSTOM_ID_PREFIX, action, str(user_id), *map(str, args)))
+    if len(custom_id) > CUSTOM_ID_MAX_LENGTH:
+        raise ValueError(f"custom_id too long: {custom_id!r}")
+    return custom_id
+
+
+def parse_component_id(custom_id: Optional[str]) -> Optional[ComponentId]:
+    if not custom_id:
+        return None
+    parts = custom_id.split(":")
+    if len(parts) < 3 or parts[0] != CUSTOM_ID_PREFIX or not parts[2].isdigit():
+        return None
+    return ComponentId(parts[1], int(parts[2]), parts[3:])
+
+
+class StaticView(discord.ui.View):
+    """
+    描画するだけの View。ボタンの処理は ComponentRouter が custom_id から行うので、
+    送信前に stop() しておき discord.py の ViewStore にインスタンスを残さない。
+    """
+
+    def __init__(self, *items: discord.ui.Item):
+        super().__init__(timeout=None)
+        for item in items:
+            self.add_item(item)
+        self.stop()
+
+
+class ComponentRoutes:
+    """action 名 -> ハンドラーの登録簿。モジュールの読み込み時に @ROUTES.route(...) で登録する。"""
+
+    def __init__(self):
+        self.handlers: Dict[str, ComponentHandler] = {}
+        # 本人以外が押したときのメッセージ (action ごとに変えたい場合)
+        self.owner_messages: Dict[str, str] = {}
+
+    def route(self, action: str, owner_message: Optional[str] = None):
+        def decorator(handler: ComponentHandler) -> ComponentHandler:
+            if action in self.handlers:
+                raise ValueError(f"duplicate component route: {action}")
+            self.handlers[action] = handler
+            if owner_message:
+                self.owner_messages[action] = owner_message
+            return handler
+        return decorator
+
+
+ROUTES = ComponentRoutes()
+DEFAULT_OWNER_MESSAGE = "この操作は <@{user_id}> さんのみ可能です。"
+
+
+class ComponentRouter:
+    """RPG のボタン・セレクトをまとめて受ける。RPG cog の on_interaction から dispatch() を呼ぶ。"""
+
+    def __init__(self, rpg_cog, routes: ComponentRoutes = ROUTES):
+        self.rpg_cog = rpg_cog
+        self.routes = routes
+
+    async def dispatch(self, interaction: discord.Interaction) -> bool:
+        """RPG のコンポーネントなら処理して True を返す。"""
+        if interaction.type != discord.InteractionType.component:
+            return False
+        parsed = parse_component_id((interaction.data or {}).get("custom_id"))
+        if parsed is None:
+            return False
+        handler = self.routes.handlers.get(parsed.action)
+        if handler is None:
+            logger.warning(f"No handler for component action {parsed.action!r}.")
+            return False
+
+        if interaction.user.id != parsed.user_id:
+            message = self.routes.owner_messages.get(parsed.action, DEFAULT_OWNER_MESSAGE)
+            await interaction.response.send_message(message.format(user_id=parsed.user_id), ephemeral=True)
+            return True
+        try:
+            await handler(self.rpg_cog, interaction, *parsed.args)
+        except Exception as e:
+            logger.error(f"Error handling component {parsed.action} for user {parsed.user_id}: {e}", exc_info=True)
+            embed = discord.Embed(title="エラー", description="操作の処理中にエラーが発生しました。", color=discord.Color.red())
+            try:
+                if interaction.response.is_done():
+                    await interaction.followup.send(embed=embed, ephemeral=True)
+                else:
+                    await interaction.response.send_message(embed=embed, ephemeral=True)
+            except discord.HTTPException:
+                pass
+        return True
+
+
+def selected_values(interaction: discord.Interaction) -> List[str]:
+    """セレクトメニューで選ばれた値 (View を持たないので interaction.data から読む)。"""
+    return list((interaction.data or {}).get("values", []))
@@ -0,0 +1,108 @@
+# rpg_sampler.py
+import random
+import logging
+from typing import Dict, List, Mapping, NamedTuple, Sequence
+
+from rpg_data import RARITY_WEIGHTS, RARITY_ORDER
+
+logger = logging.getLogger('SophiaBot.RPGSampler')
+
+
+class AliasSampler:
+    """
+    重み付き抽選用の Walker のエイリアステーブル (Vose 法で構築)。
+    構築は O(n)、1回の抽選は乱数1つで O(1)。
+    """
+    __slots__ = ("outcomes", "weights", "_prob", "_alias")
+
+    def __init__(self, weights: Mapping[str, float]):
+        outcomes = [key for key, weight in weights.items() if weight > 0]
+        if not outcomes:
+            raise ValueError(f"AliasSampler needs at least one positive weight: {dict(weights)}")
+        total = float(sum(weights[key] for key in outcomes))
+        n = len(outcomes)
+
+        self.outcomes: Sequence[str] = tuple(outcomes)
+        self.weights: Mapping[str, float] = {key: weights[key] / total for key in outcomes}
+
+        scaled = [weights[key] * n / total for key in outcomes]
+        prob = [0.0] * n
+        alias = [0] * n
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # 浮動小数点誤差で残ったものは確率1で自分自身
+        for i in large + small:
+            prob[i] = 1.0
+            alias[i] = i
+
+        self._prob = tuple(prob)
+        self._alias = tuple(alias)
+
+    def sample(self, rng: random.Random = random) -> str:
+        u = rng.random() * len(self._prob)
+        i = int(u)
+        if u - i < self._prob[i]:
+            return self.outcomes[i]
+        return self.outcomes[self._alias[i]]
+
+    def sample_many(self, k: int, rng: random.Random = random) -> List[str]:
+        """k 回分をまとめて抽選する。"""
+        n = len(self._prob)
+        prob, alias, outcomes = self._prob, self._alias, self.outcomes
+        results = []
+        append = results.append
+        rand = rng.random
+        for _ in range(k):
+            u = rand() * n
+            i = int(u)
+            append(outcomes[i] if u - i < prob[i] else outcomes[alias[i]])
+        return results
+
+
+class GachaPoolSamplers(NamedTuple):
+    base: AliasSampler
+    effect: AliasSampler
+
+
+RARITY_SAMPLER = AliasSampler(RARITY_WEIGHTS)
+
+
+def build_gacha_samplers(gacha_settings: Mapping[str, Mapping]) -> Dict[str, GachaPoolSamplers]:
+    """
+    GACHA_SETTINGS の各プールからベース用・効果用のサンプラーを作る。
+    ベース用は guaranteed_rarity_above_single 未満を除いたプール。
+    プールが空や重み0の場合は全体の RARITY_WEIGHTS にフォールバックする。
+    """
+    samplers: Dict[str, GachaPoolSamplers] = {}
+    for gacha_key, gacha_info in gacha_settings.items():
+        pool = gacha_info.get("rarity_pool") or {}
+        threshold = gacha_info.get("guaranteed_rarity_above_single")
+
+        base_pool = pool
+        if threshold:
+            base_pool = {r: w for r, w in pool.items() if RARITY_ORDER.get(r, 0) >= RARITY_ORDER.get(threshold, 0)}
+            if not base_pool:
+                logger.warning(f"Gacha '{gacha_key}' guaranteed threshold '{threshold}' not met by pool. Using full defined pool.")
+                base_pool = pool
+
+        if sum(base_pool.values()) > 0:
+            base_sampler = AliasSampler(base_pool)
+        else:
+            logger.error(f"Gacha '{gacha_key}' has a total weight of 0 or empty pool ({base_pool}). Falling back to global rarity weights.")
+            base_sampler = RARITY_SAMPLER
+
+        if sum(pool.values()) > 0:
+            effect_sampler = AliasSampler(pool)
+        else:
+            logger.warning(f"Gacha '{gacha_key}' has total weight 0 or empty pool for effect rarity. Falling back to global rarity weights.")
+            effect_sampler = RARITY_SAMPLER
+
+        samplers[gacha_key] = GachaPoolSamplers(base_sampler, effect_sampler)
+    return samplers
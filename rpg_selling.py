@@ -0,0 +1,136 @@
+# rpg_selling.py
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from rpg_data import SELL_PRICES, RARITY_ORDER
+from rpg_catalog import CATALOG
+from rpg_ledger import record_gold
+
+logger = logging.getLogger('SophiaBot.RPGSelling')
+
+# 1回の /vsell で指定できる ID の数 (IN 句のプレースホルダー数の上限も兼ねる)
+SELL_MAX_IDS = 100
+
+
+class TooManySellIdsError(ValueError):
+    pass
+
+
+class SellLine(NamedTuple):
+    inventory_id: int
+    full_name: str
+    base_rarity: str
+    effect_rarity: str
+    price: int
+
+    def describe(self) -> str:
+        return f"・ID:{self.inventory_id} {self.full_name} ({self.base_rarity}/{self.effect_rarity}) - {self.price}G"
+
+
+class SellPlan(NamedTuple):
+    lines: Tuple[SellLine, ...]
+    # 指定されたが本人のインベントリに無かった ID
+    missing_ids: Tuple[int, ...]
+
+    @property
+    def total_price(self) -> int:
+        return sum(line.price for line in self.lines)
+
+    @property
+    def inventory_ids(self) -> Tuple[int, ...]:
+        return tuple(line.inventory_id for line in self.lines)
+
+
+class SellResult(NamedTuple):
+    plan: SellPlan
+    # 売却によって外れた装備スロット (equipped_weapon / equipped_armor -> None)
+    unequipped_fields: Dict[str, None]
+
+
+def _placeholders(count: int) -> str:
+    return ", ".join("?" * count)
+
+
+def _sell_line(inventory_id: int, item_id: int, effect_id: int) -> Optional[SellLine]:
+    item = CATALOG.get_item(item_id)
+    if item is None:
+        logger.warning(f"Inventory {inventory_id} refers to unknown item {item_id}.")
+        return None
+    effect = CATALOG.get_effect(effect_id)
+    return SellLine(inventory_id, f"{effect.prefix_name}{item.base_name}", item.rarity, effect.rarity,
+                    SELL_PRICES.get(item.rarity, 0))
+
+
+def _build_plan(requested_ids: Sequence[int], rows: Iterable[Tuple[int, int, int]]) -> SellPlan:
+    by_id = {}
+    for inventory_id, item_id, effect_id in rows:
+        line = _sell_line(inventory_id, item_id, effect_id)
+        if line is not None:
+            by_id[inventory_id] = line
+    lines = tuple(by_id[i] for i in requested_ids if i in by_id)
+    missing = tuple(i for i in requested_ids if i not in by_id)
+    return SellPlan(lines, missing)
+
+
+async def plan_sale(conn, user_id: int, guild_id: int, inventory_ids: Sequence[int]) -> SellPlan:
+    """指定 ID のうち本人が持っているものを1回のクエリで引き、売却内容を返す (順序は指定順、重複は除く)。"""
+    requested = list(dict.fromkeys(inventory_ids))
+    if not requested:
+        return SellPlan((), ())
+    if len(requested) > SELL_MAX_IDS:
+        raise TooManySellIdsError(f"一度に売却できるのは {SELL_MAX_IDS} 個までです。")
+    async with conn.execute(
+            f"SELECT inventory_id, item_id, effect_id FROM inventory "
+            f"WHERE user_id = ? AND guild_id = ? AND inventory_id IN ({_placeholders(len(requested))})",
+            (user_id, guild_id, *requested)) as cursor:
+        rows = await cursor.fetchall()
+    return _build_plan(requested, rows)
+
+
+async def plan_sale_below_rarity(conn, user_id: int, guild_id: int, rarity: str,
+                                 keep_ids: Iterable[Optional[int]] = ()) -> SellPlan:
+    """ベースレアリティが rarity より低いアイテムをすべて選ぶ。keep_ids (装備中のものなど) は除く。"""
+    threshold = RARITY_ORDER[rarity]
+    keep = {i for i in keep_ids if i}
+    async with conn.execute(
+            "SELECT inventory_id, item_id, effect_id FROM inventory WHERE user_id = ? AND guild_id = ? ORDER BY inventory_id",
+            (user_id, guild_id)) as cursor:
+        rows = await cursor.fetchall()
+    selected = []
+    for inventory_id, item_id, effect_id in rows:
+        item = CATALOG.get_item(item_id)
+        if inventory_id in keep or item is None:
+            continue
+        if RARITY_ORDER.get(item.rarity, 0) < threshold:
+            selected.append((inventory_id, item_id, effect_id))
+    return _build_plan([row[0] for row in selected], selected)
+
+
+async def settle_sale(conn, user_id: int, guild_id: int, inventory_ids: Sequence[int],
+                      equipped_weapon: Optional[int], equipped_armor: Optional[int]) -> SellResult:
+    """
+    売却を確定する。conn は bot.db.write() のトランザクション内の接続を渡すこと。
+    対象の確認 (SELECT 1回)、装備解除とゴールド加算 (UPDATE 1回)、削除 (DELETE 1回) だけで済ませる。
+    売却額は台帳 (rpg_ledger) にも記録する。
+    equipped_* は呼び出し側がユーザーロックの中で読んだ現在の装備。
+    """
+    plan = await plan_sale(conn, user_id, guild_id, inventory_ids)
+    sold_ids = plan.inventory_ids
+    if not sold_ids:
+        return SellResult(plan, {})
+
+    unequipped_fields: Dict[str, None] = {}
+    if equipped_weapon in sold_ids:
+        unequipped_fields["equipped_weapon"] = None
+    if equipped_armor in sold_ids:
+        unequipped_fields["equipped_armor"] = None
+
+    set_clauses: List[str] = ["gold = gold + ?"]
+    set_clauses.extend(f"{field} = NULL" for field in unequipped_fields)
+    await conn.execute(f"UPDATE users SET {', '.join(set_clauses)} WHERE user_id = ? AND guild_id = ?",
+                       (plan.total_price, user_id, guild_id))
+    await record_gold(conn, user_id, guild_id, plan.total_price, "sell", sold_ids)
+    await conn.execute(
+        f"DELETE FROM inventory WHERE user_id = ? AND guild_id = ? AND inventory_id IN ({_placeholders(len(sold_ids))})",
+        (user_id, guild_id, *sold_ids))
+    return SellResult(plan, unequipped_fields)
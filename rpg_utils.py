@@ -1,19 +1,40 @@
 # rpg_utils.py
+import asyncio
 import contextlib
 import logging
+import sqlite3
 
 logger = logging.getLogger('SophiaBot.RPGUtils')
 
+
 @contextlib.asynccontextmanager
 async def transaction(connection):
+    """
+    BEGIN〜COMMIT を張る。例外だけでなくキャンセル (CancelledError) でも必ず ROLLBACK してから投げ直す
+    (書き込み接続は共有なので、開いたままのトランザクションを残すと以降の BEGIN がすべて失敗する)。
+    呼び出し側は想定内のエラーもここを通して投げるので、ログは DEBUG に留める。
+    """
     logger.debug(f"Transaction started on connection: {connection}")
     await connection.execute("BEGIN")
+    committed = False
     try:
         yield connection
         await connection.execute("COMMIT")
+        committed = True
         logger.debug(f"Transaction committed on connection: {connection}")
-    except Exception as e:
-        logger.error(f"Transaction failed on connection {connection}, rolling back: {e}", exc_info=True)
-        await connection.execute("ROLLBACK")
+    except BaseException as e:
+        logger.debug(f"Transaction failed on connection {connection}, rolling back: {e!r}")
+        raise
+    finally:
+        if not committed:
+            await _rollback(connection)
+
+
+async def _rollback(connection):
+    try:
+        # キャンセル中でも ROLLBACK 自体は最後まで実行させる
+        await asyncio.shield(connection.execute("ROLLBACK"))
         logger.debug(f"Transaction rolled back on connection: {connection}")
-        raise
\ No newline at end of file
+    except sqlite3.OperationalError as e:
+        # COMMIT の途中でキャンセルされ、実際にはコミット済みだった場合など
+        logger.warning(f"ROLLBACK failed on connection {connection}: {e}")
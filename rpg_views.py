@@ -2,298 +2,448 @@
 import discord
 import logging
 import asyncio
+import time
 from typing import Optional, List, TYPE_CHECKING
-from rpg_data import SELL_PRICES, RARITY_PROBABILITIES, RARITY_ORDER, RARITY_WEIGHTS, TOTAL_RARITY_WEIGHT
-from rpg_utils import transaction
+from rpg_data import (
+    RARITY_PROBABILITIES, RARITY_ORDER, RARITY_WEIGHTS, TOTAL_RARITY_WEIGHT, BATTLE_IDLE_TIMEOUT_SECONDS,
+    BATTLE_CONTINUE_TTL_SECONDS, REROLL_CONSUME_COUNT
+)
+from rpg_catalog import CATALOG
+from rpg_drops import drop_from_ids
+from rpg_ledger import apply_gold
+from rpg_reroll import RerollError
+from rpg_router import ROUTES, StaticView, component_id, selected_values
+from rpg_inventory import (
+    EQUIP_IF_OWNED_SQL, InventoryFilter, InventoryRow, PageCursor, SORT_ORDERS, DEFAULT_SORT, count_inventory, fetch_inventory_page, cursor_for
+)
 
 if TYPE_CHECKING:
     from RPG_cog import RPG, BattleSession
+    from rpg_drops import RolledDrop
 
 logger = logging.getLogger('SophiaBot.RPGViews')
 
-class EquipConfirmView(discord.ui.View):
-    def __init__(self, bot, inventory_id, full_item_name: str, item_type_display: str, equip_field: str, interaction_user_id: int):
-        super().__init__(timeout=60)
-        self.bot = bot
-        self.inventory_id = inventory_id
-        self.full_item_name = full_item_name
-        self.item_type_display = item_type_display
-        self.equip_field = equip_field
-        self.interaction_user_id = interaction_user_id
-        self.rpg_cog: 'RPG' = self.bot.get_cog("RPG")
-
-    async def interaction_check(self, interaction: discord.Interaction) -> bool:
-        if interaction.user.id != self.interaction_user_id:
-            await interaction.response.send_message("この操作はコマンドを実行した本人のみ可能です。", ephemeral=True)
-            return False
-        return True
-
-    @discord.ui.button(label="入れ替える", style=discord.ButtonStyle.green)
-    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.defer(ephemeral=True)
-        user_id = interaction.user.id
-        guild_id = interaction.guild.id
-        try:
-            if not self.rpg_cog:
-                logger.error("RPGCog not found in EquipConfirmView confirm.")
-                raise Exception("RPGCog not found")
-
-            async with transaction(self.bot.db):
-                await self.bot.db.execute(f"UPDATE users SET {self.equip_field} = ? WHERE user_id = ? AND guild_id = ?", (self.inventory_id, user_id, guild_id))
+class EquipConfirmView(StaticView):
+    """/vequip で装備中のスロットを入れ替えるときの確認。"""
+    def __init__(self, inventory_id: int, interaction_user_id: int):
+        super().__init__(
+            discord.ui.Button(label="入れ替える", style=discord.ButtonStyle.green,
+                              custom_id=component_id("equip", interaction_user_id, inventory_id)),
+            discord.ui.Button(label="キャンセル", style=discord.ButtonStyle.red,
+                              custom_id=component_id("equip_cancel", interaction_user_id)),
+        )
 
-            await self.rpg_cog.manage_user_role(interaction.guild, interaction.user, self.full_item_name, self.item_type_display)
 
-            embed = discord.Embed(title="装備入れ替え完了", description=f"**{self.full_item_name}** を装備しました。", color=discord.Color.green())
+@ROUTES.route("equip", owner_message="この操作はコマンドを実行した本人のみ可能です。")
+async def _equip_confirm(rpg_cog: 'RPG', interaction: discord.Interaction, inventory_id: str):
+    await interaction.response.defer(ephemeral=True)
+    inventory_id = int(inventory_id)
+    user_id = interaction.user.id
+    guild_id = interaction.guild.id
+    try:
+        async with rpg_cog.bot.db.read() as conn:
+            async with conn.execute("SELECT item_id, effect_id FROM inventory WHERE inventory_id = ? AND user_id = ? AND guild_id = ?",
+                                    (inventory_id, user_id, guild_id)) as cursor:
+                row = await cursor.fetchone()
+        item = CATALOG.get_item(row[0]) if row else None
+        if item is None:
+            embed = discord.Embed(title="エラー", description="このアイテムはもうインベントリにありません。", color=discord.Color.red())
             await interaction.edit_original_response(embed=embed, view=None)
-        except Exception as e:
-            logger.error(f"Error in EquipConfirmView confirm: {e}", exc_info=True)
-            embed = discord.Embed(title="エラー", description="装備の入れ替え中にエラーが発生しました。", color=discord.Color.red())
-            try:
+            return
+        full_item_name = f"{CATALOG.get_effect(row[1]).prefix_name}{item.base_name}"
+        item_type_display = "武器" if item.type == "weapon" else "防具"
+        equip_field = "equipped_weapon" if item.type == "weapon" else "equipped_armor"
+
+        async with rpg_cog.user_locks.hold(user_id, guild_id):
+            async with rpg_cog.bot.db.write() as conn:
+                update_cursor = await conn.execute(EQUIP_IF_OWNED_SQL.format(field=equip_field),
+                                                   (inventory_id, user_id, guild_id, inventory_id, user_id, guild_id))
+            if update_cursor.rowcount == 0:
+                embed = discord.Embed(title="エラー", description="このアイテムはもうインベントリにありません。", color=discord.Color.red())
                 await interaction.edit_original_response(embed=embed, view=None)
-            except discord.errors.NotFound:
-                pass
-        finally:
-            self.stop()
+                return
+            rpg_cog.profile_cache.set_fields(user_id, guild_id, **{equip_field: inventory_id})
 
-    @discord.ui.button(label="キャンセル", style=discord.ButtonStyle.red)
-    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.defer(ephemeral=True)
-        embed = discord.Embed(title="キャンセル", description="装備の入れ替えをキャンセルしました。", color=discord.Color.red())
+        await rpg_cog.manage_user_role(interaction.guild, interaction.user, full_item_name, item_type_display)
+
+        embed = discord.Embed(title="装備入れ替え完了", description=f"**{full_item_name}** を装備しました。", color=discord.Color.green())
+        await interaction.edit_original_response(embed=embed, view=None)
+    except Exception as e:
+        rpg_cog.profile_cache.invalidate(user_id, guild_id)
+        logger.error(f"Error in equip confirm: {e}", exc_info=True)
+        embed = discord.Embed(title="エラー", description="装備の入れ替え中にエラーが発生しました。", color=discord.Color.red())
         try:
             await interaction.edit_original_response(embed=embed, view=None)
         except discord.errors.NotFound:
             pass
-        finally:
-            self.stop()
 
-class InventorySwapView(discord.ui.View):
-    def __init__(self, bot, user_id, guild_id,
-                 new_item_base_id, new_item_base_name, new_item_base_rarity, new_item_type_display,
-                 new_effect_id, new_effect_name_prefix, new_effect_rarity,
-                 inventory_items_tuples,
-                 interaction_user_id: int,
-                 is_inventory_full: bool):
-        super().__init__(timeout=120)
-        self.bot = bot
-        self.user_id = user_id
-        self.guild_id = guild_id
-        self.new_item_base_id = new_item_base_id
-        self.new_item_base_name = new_item_base_name
-        self.new_item_base_rarity = new_item_base_rarity
-        self.new_item_type_display = new_item_type_display
-        self.new_effect_id = new_effect_id
-        self.new_effect_name_prefix = new_effect_name_prefix
-        self.new_effect_rarity = new_effect_rarity
-        self.inventory_items_full_list = inventory_items_tuples
-        self.interaction_user_id = interaction_user_id
-        self.new_full_item_name = f"{self.new_effect_name_prefix}{self.new_item_base_name}"
-        self.message_with_view: Optional[discord.Message] = None
-        self.level_up_message_to_delete: Optional[discord.Message] = None
-
-        self.acquire_button = discord.ui.Button(
-            label=f"{self.new_full_item_name[:20]} ({self.new_item_base_rarity}/{self.new_effect_rarity}) を取得",
-            style=discord.ButtonStyle.green,
-            row=0,
-            disabled=is_inventory_full
-        )
-        self.acquire_button.callback = self.acquire_button_callback
-        self.add_item(self.acquire_button)
 
-        self.sell_button = discord.ui.Button(
-            label=f"{self.new_full_item_name[:20]} ({self.new_item_base_rarity}/{self.new_effect_rarity}) を売却",
-            style=discord.ButtonStyle.danger,
-            row=1
+@ROUTES.route("equip_cancel", owner_message="この操作はコマンドを実行した本人のみ可能です。")
+async def _equip_cancel(rpg_cog: 'RPG', interaction: discord.Interaction):
+    embed = discord.Embed(title="キャンセル", description="装備の入れ替えをキャンセルしました。", color=discord.Color.red())
+    await interaction.response.edit_message(embed=embed, view=None)
+
+
+class SellConfirmView(StaticView):
+    """/vsell の確認画面。確定時は表示した ID (pending_actions に置いたもの) だけを売却する。"""
+    def __init__(self, token: int, interaction_user_id: int):
+        super().__init__(
+            discord.ui.Button(label="売却する", style=discord.ButtonStyle.green,
+                              custom_id=component_id("sell", interaction_user_id, token)),
+            discord.ui.Button(label="キャンセル", style=discord.ButtonStyle.red,
+                              custom_id=component_id("sell_cancel", interaction_user_id, token)),
         )
-        self.sell_button.callback = self.sell_button_callback
-        self.add_item(self.sell_button)
 
-    async def interaction_check(self, interaction: discord.Interaction) -> bool:
-        if interaction.user.id != self.interaction_user_id:
-            await interaction.response.send_message(f"この操作は <@{self.interaction_user_id}> さんのみ可能です。", ephemeral=True)
-            return False
-        return True
 
-    async def _delete_associated_messages(self):
-        """Deletes the view's own message and the associated level-up message if present."""
-        if self.message_with_view:
-            try:
-                await self.message_with_view.delete()
-                logger.info(f"InventorySwapView: Successfully deleted view message (ID: {self.message_with_view.id}).")
-            except discord.errors.NotFound:
-                logger.warning(f"InventorySwapView: View message (ID: {self.message_with_view.id}) not found for deletion.")
-            except Exception as e:
-                logger.error(f"InventorySwapView: Error deleting view message (ID: {self.message_with_view.id}): {e}", exc_info=True)
-            finally:
-                self.message_with_view = None
-        
-        if self.level_up_message_to_delete:
-            try:
-                await self.level_up_message_to_delete.delete()
-                logger.info(f"InventorySwapView: Successfully deleted level up message (ID: {self.level_up_message_to_delete.id}).")
-            except discord.errors.NotFound:
-                logger.warning(f"InventorySwapView: Level up message (ID: {self.level_up_message_to_delete.id}) not found for deletion.")
-            except Exception as e:
-                logger.error(f"InventorySwapView: Error deleting level up message (ID: {self.level_up_message_to_delete.id}): {e}", exc_info=True)
-            finally:
-                self.level_up_message_to_delete = None
-
-
-    async def acquire_button_callback(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True, thinking=True)
-        try:
-            async with transaction(self.bot.db):
-                await self.bot.db.execute(
-                    "INSERT INTO inventory (user_id, guild_id, item_id, effect_id) VALUES (?, ?, ?, ?)",
-                    (self.user_id, self.guild_id, self.new_item_base_id, self.new_effect_id)
-                )
+@ROUTES.route("sell", owner_message="この操作はコマンドを実行した本人のみ可能です。")
+async def _sell_confirm(rpg_cog: 'RPG', interaction: discord.Interaction, token: str):
+    await interaction.response.defer(ephemeral=True)
+    try:
+        embed = await rpg_cog.execute_sale(interaction, int(token))
+        if embed is None:
+            embed = discord.Embed(title="タイムアウト", description="時間切れのため売却をキャンセルしました。", color=discord.Color.light_grey())
+    except Exception as e:
+        logger.error(f"Error in sell confirm: {e}", exc_info=True)
+        embed = discord.Embed(title="エラー", description="アイテム売却処理中にエラーが発生しました。もう一度お試しください。", color=discord.Color.red())
+    try:
+        await interaction.edit_original_response(embed=embed, view=None)
+    except discord.errors.NotFound:
+        pass
+
+
+@ROUTES.route("sell_cancel", owner_message="この操作はコマンドを実行した本人のみ可能です。")
+async def _sell_cancel(rpg_cog: 'RPG', interaction: discord.Interaction, token: str):
+    await rpg_cog.pending_actions.discard(int(token), "sell")
+    embed = discord.Embed(title="キャンセル", description="アイテムの売却をキャンセルしました。", color=discord.Color.red())
+    await interaction.response.edit_message(embed=embed, view=None)
+
+
+class InventorySwapView(StaticView):
+    """レベルアップで見つけたアイテムの取得/売却。アイテムは pending_actions の "drop" に置く。"""
+    def __init__(self, user_id: int, token: int, drop: 'RolledDrop', is_inventory_full: bool):
+        label = f"{drop.full_name[:20]} ({drop.item.rarity}/{drop.effect.rarity})"
+        super().__init__(
+            discord.ui.Button(label=f"{label} を取得", style=discord.ButtonStyle.green, row=0, disabled=is_inventory_full,
+                              custom_id=component_id("drop_take", user_id, token)),
+            discord.ui.Button(label=f"{label} を売却", style=discord.ButtonStyle.danger, row=1,
+                              custom_id=component_id("drop_sell", user_id, token)),
+        )
 
-            prob_item = (RARITY_WEIGHTS.get(self.new_item_base_rarity, 0) / TOTAL_RARITY_WEIGHT) if TOTAL_RARITY_WEIGHT > 0 else 0
-            prob_effect = (RARITY_WEIGHTS.get(self.new_effect_rarity, 0) / TOTAL_RARITY_WEIGHT) if TOTAL_RARITY_WEIGHT > 0 else 0
-            combined_prob_percent = prob_item * prob_effect * 100
-
-            embed = discord.Embed(
-                title="アイテム取得完了",
-                description=(
-                    f"**{self.new_full_item_name}** (装備:{self.new_item_base_rarity}/効果:{self.new_effect_rarity}) をインベントリに追加しました。\n"
-                    f"　┣ 装備レアリティ: {self.new_item_base_rarity} ({RARITY_PROBABILITIES.get(self.new_item_base_rarity, 'N/A')})\n"
-                    f"　┣ 効果レアリティ: {self.new_effect_rarity} ({RARITY_PROBABILITIES.get(self.new_effect_rarity, 'N/A')})\n"
-                    f"　┗ 組み合わせ出現率: {combined_prob_percent:.3f}%"
-                ),
-                color=discord.Color.green()
-            )
-            await interaction.followup.send(embed=embed, ephemeral=True)
-        except Exception as e:
-            logger.error(f"InventorySwapView - acquire_button error: {e}", exc_info=True)
-            await interaction.followup.send(f"アイテム取得処理中にエラーが発生しました: {str(e)}", ephemeral=True)
-        finally:
-            await self._delete_associated_messages()
-            self.stop()
 
-    async def sell_button_callback(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True, thinking=True)
+async def _delete_drop_messages(interaction: discord.Interaction, level_up_message_id: Optional[int]):
+    """選択肢のメッセージと、対応するレベルアップのメッセージを消す。"""
+    messages = [interaction.message]
+    if level_up_message_id and hasattr(interaction.channel, "get_partial_message"):
+        messages.append(interaction.channel.get_partial_message(level_up_message_id))
+    for message in messages:
+        if message is None:
+            continue
         try:
-            sell_price = SELL_PRICES.get(self.new_item_base_rarity, 0)
-            async with self.bot.db.execute("SELECT gold FROM users WHERE user_id = ? AND guild_id = ?", (self.user_id, self.guild_id)) as cursor:
-                row = await cursor.fetchone()
-            current_gold = row[0] if row else 0
-            new_gold = current_gold + sell_price
-
-            async with transaction(self.bot.db):
-                await self.bot.db.execute("UPDATE users SET gold = ? WHERE user_id = ? AND guild_id = ?", (new_gold, self.user_id, self.guild_id))
-
-            embed = discord.Embed(
-                title="アイテム売却完了",
-                description=f"**{self.new_full_item_name}** (装備:{self.new_item_base_rarity}/効果:{self.new_effect_rarity}) を売却し、{sell_price} ゴールドを獲得しました。\n"
-                            "インベントリに変更はありません。",
-                color=discord.Color.green()
-            )
-            await interaction.followup.send(embed=embed, ephemeral=True)
+            await message.delete()
+        except discord.errors.NotFound:
+            logger.warning(f"Drop message (ID: {message.id}) not found for deletion.")
         except Exception as e:
-            logger.error(f"InventorySwapView - sell_button error: {e}", exc_info=True)
-            await interaction.followup.send("アイテム売却処理中にエラーが発生しました。", ephemeral=True)
-        finally:
-            await self._delete_associated_messages()
-            self.stop()
+            logger.error(f"Error deleting drop message (ID: {message.id}): {e}", exc_info=True)
+
+
+DROP_ALREADY_RESOLVED_MESSAGE = "このアイテムは既に処理済みか、選択の期限が切れています。"
+DROP_UNKNOWN_ITEM_MESSAGE = "このアイテムのデータが見つからないため、処理できませんでした。"
+
+
+async def _report_unknown_drop(interaction: discord.Interaction, action):
+    # アイテムのマスタデータが消えた場合など。保留中の操作は消費済みなので、同じボタンは二度と効かない
+    logger.warning(f"Pending action {action.token} refers to unknown item {action.payload.get('item_id')} "
+                   f"(effect {action.payload.get('effect_id')}).")
+    await interaction.followup.send(DROP_UNKNOWN_ITEM_MESSAGE, ephemeral=True)
+
+
+@ROUTES.route("drop_take")
+async def _drop_take(rpg_cog: 'RPG', interaction: discord.Interaction, token: str):
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    user_id = interaction.user.id
+    guild_id = interaction.guild.id
+    async with rpg_cog.user_locks.hold(user_id, guild_id):
+        async with rpg_cog.bot.db.write() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM inventory WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+                count_row = await cursor.fetchone()
+            inventory_full = (count_row[0] if count_row else 0) >= rpg_cog.inventory_limit
+            action = None
+            drop = None
+            if not inventory_full:
+                action = await rpg_cog.pending_actions.claim(int(token), "drop", conn)
+                if action is not None:
+                    drop = drop_from_ids(action.payload["item_id"], action.payload["effect_id"])
+                if drop is not None:
+                    await conn.execute(
+                        "INSERT INTO inventory (user_id, guild_id, item_id, effect_id) VALUES (?, ?, ?, ?)",
+                        (user_id, guild_id, action.payload["item_id"], action.payload["effect_id"])
+                    )
+    if inventory_full:
+        await interaction.followup.send("インベントリがいっぱいのため取得できませんでした。`/vsell` で空きを作るか、売却を選んでください。", ephemeral=True)
+        return
+    if action is None:
+        await interaction.followup.send(DROP_ALREADY_RESOLVED_MESSAGE, ephemeral=True)
+        return
+    if drop is None:
+        await _report_unknown_drop(interaction, action)
+        return
+
+    embed = discord.Embed(
+        title="アイテム取得完了",
+        description=(
+            f"**{drop.full_name}** (装備:{drop.item.rarity}/効果:{drop.effect.rarity}) をインベントリに追加しました。\n"
+            f"　┣ 装備レアリティ: {drop.item.rarity} ({RARITY_PROBABILITIES.get(drop.item.rarity, 'N/A')})\n"
+            f"　┣ 効果レアリティ: {drop.effect.rarity} ({RARITY_PROBABILITIES.get(drop.effect.rarity, 'N/A')})\n"
+            f"　┗ 組み合わせ出現率: {drop.combined_probability_percent:.3f}%"
+        ),
+        color=discord.Color.green()
+    )
+    await interaction.followup.send(embed=embed, ephemeral=True)
+    await _delete_drop_messages(interaction, action.payload.get("level_up_message_id"))
+
+
+@ROUTES.route("drop_sell")
+async def _drop_sell(rpg_cog: 'RPG', interaction: discord.Interaction, token: str):
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    user_id = interaction.user.id
+    guild_id = interaction.guild.id
+    async with rpg_cog.user_locks.hold(user_id, guild_id):
+        try:
+            async with rpg_cog.bot.db.write() as conn:
+                action = await rpg_cog.pending_actions.claim(int(token), "drop", conn)
+                drop = drop_from_ids(action.payload["item_id"], action.payload["effect_id"]) if action is not None else None
+                if drop is not None:
+                    await apply_gold(conn, user_id, guild_id, drop.sell_price, "drop_sell", (drop.ref_id,))
+        except Exception:
+            rpg_cog.profile_cache.invalidate(user_id, guild_id)
+            raise
+        if drop is not None:
+            rpg_cog.profile_cache.adjust_gold(user_id, guild_id, drop.sell_price)
+    if action is None:
+        await interaction.followup.send(DROP_ALREADY_RESOLVED_MESSAGE, ephemeral=True)
+        return
+    if drop is None:
+        await _report_unknown_drop(interaction, action)
+        return
+
+    embed = discord.Embed(
+        title="アイテム売却完了",
+        description=f"**{drop.full_name}** (装備:{drop.item.rarity}/効果:{drop.effect.rarity}) を売却し、{drop.sell_price} ゴールドを獲得しました。\n"
+                    "インベントリに変更はありません。",
+        color=discord.Color.green()
+    )
+    await interaction.followup.send(embed=embed, ephemeral=True)
+    await _delete_drop_messages(interaction, action.payload.get("level_up_message_id"))
+
+
+class DropOverflowView(StaticView):
+    """
+    複数レベル上昇でインベントリに入りきらなかったドロップをまとめて処理する ("drop_overflow")。
+    選んだものは空きがあれば取得し、残りはすべて売却する。時間切れの場合もすべて売却する。
+    """
+    MAX_OPTIONS = 25
+
+    def __init__(self, user_id: int, token: int, drops: List['RolledDrop']):
+        # 選択肢に出せない分 (26個目以降) は売却扱いになる
+        options = [
+            discord.SelectOption(label=drop.full_name[:100], value=str(i),
+                                 description=f"{drop.item_type_display} | {drop.item.rarity}/{drop.effect.rarity} | 売値 {drop.sell_price}G")
+            for i, drop in enumerate(drops[:self.MAX_OPTIONS])
+        ]
+        super().__init__(
+            discord.ui.Select(placeholder="取得するアイテムを選択 (選ばなかったものは売却)", min_values=0, max_values=len(options),
+                              options=options, row=0, custom_id=component_id("drop_keep", user_id, token)),
+            discord.ui.Button(label="決定", style=discord.ButtonStyle.green, row=1,
+                              custom_id=component_id("drop_overflow", user_id, token)),
+            discord.ui.Button(label="すべて売却", style=discord.ButtonStyle.danger, row=1,
+                              custom_id=component_id("drop_overflow_sell", user_id, token)),
+        )
 
-class RerollSelectView(discord.ui.View):
-    def __init__(self, bot, inventory_id_to_reroll, new_effect_id, new_effect_name_prefix, new_effect_rarity, consumable_items, target_item_base_rarity, interaction_user_id: int):
-        super().__init__(timeout=120)
-        self.bot = bot
-        self.inventory_id_to_reroll = inventory_id_to_reroll
-        self.new_effect_id = new_effect_id
-        self.new_effect_name_prefix = new_effect_name_prefix
-        self.new_effect_rarity = new_effect_rarity
-        self.consumable_items = consumable_items
-        self.target_item_base_rarity = target_item_base_rarity
-        self.interaction_user_id = interaction_user_id
 
+@ROUTES.route("drop_keep")
+async def _drop_keep(rpg_cog: 'RPG', interaction: discord.Interaction, token: str):
+    await interaction.response.defer()
+    action = await rpg_cog.pending_actions.get(int(token), "drop_overflow")
+    if action is None:
+        await interaction.followup.send(DROP_ALREADY_RESOLVED_MESSAGE, ephemeral=True)
+        return
+    payload = dict(action.payload, keep=[int(v) for v in selected_values(interaction)])
+    await rpg_cog.pending_actions.update_payload(action.token, "drop_overflow", payload)
+
+
+async def _finish_drop_overflow(rpg_cog: 'RPG', interaction: discord.Interaction, token: str, sell_all: bool):
+    await interaction.response.defer()
+    embed = await rpg_cog.resolve_drop_overflow(interaction.user.id, interaction.guild.id, int(token), sell_all)
+    if embed is None:
+        await interaction.followup.send(DROP_ALREADY_RESOLVED_MESSAGE, ephemeral=True)
+        return
+    try:
+        await interaction.edit_original_response(embed=embed, view=None)
+    except discord.errors.NotFound:
+        pass
+
+
+@ROUTES.route("drop_overflow")
+async def _drop_overflow_confirm(rpg_cog: 'RPG', interaction: discord.Interaction, token: str):
+    await _finish_drop_overflow(rpg_cog, interaction, token, sell_all=False)
+
+
+@ROUTES.route("drop_overflow_sell")
+async def _drop_overflow_sell_all(rpg_cog: 'RPG', interaction: discord.Interaction, token: str):
+    await _finish_drop_overflow(rpg_cog, interaction, token, sell_all=True)
+
+
+class RerollSelectView(StaticView):
+    """/vreroll の消費アイテム選択。対象と新しい効果は pending_actions の "reroll" に置く。"""
+    def __init__(self, user_id: int, token: int, consumable_items, target_item_base_rarity: str):
         options = [
             discord.SelectOption(
                 label=f"ID:{item[0]} | {item[5]}{item[1][:20]} ({item[3]}/{item[6]})",
                 value=str(item[0])
             ) for item in consumable_items[:25]
         ]
-        self.select_menu = discord.ui.Select(
-            placeholder=f"{self.target_item_base_rarity}の装備を5個選択してください",
+        super().__init__(discord.ui.Select(
+            placeholder=f"{target_item_base_rarity}の装備を{REROLL_CONSUME_COUNT}個選択してください",
             options=options if options else [discord.SelectOption(label="選択可能なアイテムなし", value="no_op_placeholder")],
-            min_values=5,
-            max_values=5,
-            disabled=not options or len(options) < 5
-        )
-        self.select_menu.callback = self.select_callback
-        self.add_item(self.select_menu)
-
-    async def interaction_check(self, interaction: discord.Interaction) -> bool:
-        if interaction.user.id != self.interaction_user_id:
-            await interaction.response.send_message("この操作はコマンドを実行した本人のみ可能です。", ephemeral=True)
-            return False
-        return True
-
-    async def select_callback(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True, thinking=True)
-        if not self.select_menu.values or self.select_menu.values[0] == "no_op_placeholder":
-            try:
-                await interaction.edit_original_response(content="有効なアイテムが選択されていません。", embed=None, view=None)
-            except discord.errors.NotFound:
-                pass
-            self.stop()
-            return
-
-        user_id = interaction.user.id
-        guild_id = interaction.guild.id
-        selected_ids_to_consume = [int(value) for value in self.select_menu.values]
-
+            min_values=REROLL_CONSUME_COUNT,
+            max_values=REROLL_CONSUME_COUNT,
+            disabled=not options or len(options) < REROLL_CONSUME_COUNT,
+            custom_id=component_id("reroll", user_id, token)
+        ))
+
+
+@ROUTES.route("reroll", owner_message="この操作はコマンドを実行した本人のみ可能です。")
+async def _reroll_select(rpg_cog: 'RPG', interaction: discord.Interaction, token: str):
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    values = selected_values(interaction)
+    if not values or values[0] == "no_op_placeholder":
         try:
-            async with transaction(self.bot.db):
+            await interaction.edit_original_response(content="有効なアイテムが選択されていません。", embed=None, view=None)
+        except discord.errors.NotFound:
+            pass
+        return
+
+    user_id = interaction.user.id
+    guild_id = interaction.guild.id
+    selected_ids_to_consume = [int(value) for value in values]
+
+    try:
+        async with rpg_cog.user_locks.hold(user_id, guild_id):
+            async with rpg_cog.bot.db.write() as conn:
+                action = await rpg_cog.pending_actions.claim(int(token), "reroll", conn)
+                if action is None:
+                    raise RerollError("このリロールは既に実行済みか、選択の期限が切れています。")
+                target_id = action.payload["inventory_id"]
+                new_effect_id = action.payload["effect_id"]
+                if target_id in selected_ids_to_consume:
+                    raise RerollError("リロール対象のアイテムは消費できません。")
+                # 選択肢を出した後に装備を変えた・別の装備と入れ替えた場合に備えて、消費できる条件をここでも確かめる
                 placeholders = ', '.join('?' for _ in selected_ids_to_consume)
-                delete_cursor = await self.bot.db.execute(
-                    f"DELETE FROM inventory WHERE inventory_id IN ({placeholders}) AND user_id = ? AND guild_id = ?",
-                    (*selected_ids_to_consume, user_id, guild_id)
+                delete_cursor = await conn.execute(
+                    f"""
+                    DELETE FROM inventory
+                    WHERE inventory_id IN ({placeholders}) AND user_id = ? AND guild_id = ?
+                      AND inventory_id != ?
+                      AND item_id IN (SELECT item_id FROM items WHERE rarity = ?)
+                      AND inventory_id NOT IN (
+                          SELECT COALESCE(equipped_weapon, -1) FROM users WHERE user_id = ? AND guild_id = ?
+                          UNION ALL
+                          SELECT COALESCE(equipped_armor, -1) FROM users WHERE user_id = ? AND guild_id = ?
+                      )
+                    """,
+                    (*selected_ids_to_consume, user_id, guild_id, target_id, action.payload["base_rarity"],
+                     user_id, guild_id, user_id, guild_id)
                 )
-                if delete_cursor.rowcount != 5:
-                    logger.warning(f"Reroll: Expected to delete 5 items, but deleted {delete_cursor.rowcount} for user {user_id}.")
-                    raise Exception(f"消費アイテムの削除に失敗しました。{delete_cursor.rowcount}個しか削除できませんでした。")
+                if delete_cursor.rowcount != REROLL_CONSUME_COUNT:
+                    logger.warning(f"Reroll: Expected to delete {REROLL_CONSUME_COUNT} items, but deleted {delete_cursor.rowcount} for user {user_id}.")
+                    raise RerollError(f"消費アイテムの削除に失敗しました。{delete_cursor.rowcount}個しか削除できませんでした。"
+                                      f"(対象以外の、装備していない{action.payload['base_rarity']}装備を選んでください)")
 
-                update_cursor = await self.bot.db.execute(
+                update_cursor = await conn.execute(
                     "UPDATE inventory SET effect_id = ? WHERE inventory_id = ? AND user_id = ? AND guild_id = ?",
-                    (self.new_effect_id, self.inventory_id_to_reroll, user_id, guild_id)
+                    (new_effect_id, target_id, user_id, guild_id)
                 )
                 if update_cursor.rowcount == 0:
-                    logger.warning(f"Reroll: Failed to update effect for item {self.inventory_id_to_reroll} for user {user_id}.")
-                    raise Exception("リロール対象のアイテムの効果更新に失敗しました。")
-
-            async with self.bot.db.execute("""
-                SELECT i.base_name, e.prefix_name
-                FROM inventory inv
-                JOIN items i ON inv.item_id = i.item_id
-                JOIN effects e ON inv.effect_id = e.effect_id
-                WHERE inv.inventory_id = ?
-            """, (self.inventory_id_to_reroll,)) as cursor:
-                rerolled_item_names = await cursor.fetchone()
-            rerolled_full_name = f"{rerolled_item_names[1]}{rerolled_item_names[0]}" if rerolled_item_names else "不明なアイテム"
-
-            embed = discord.Embed(
-                title="効果を更新",
-                description=f"アイテム「{rerolled_full_name}」の効果を **{self.new_effect_name_prefix}** (効果レアリティ: {self.new_effect_rarity}) に更新しました！\n"
-                            f"（{self.target_item_base_rarity}装備5個を消費）",
-                color=discord.Color.green()
-            )
-            await interaction.edit_original_response(embed=embed, view=None)
-        except Exception as e:
-            logger.error(f"RerollSelectView - select_callback error: {e}", exc_info=True)
-            error_embed = discord.Embed(title="エラー", description=f"リロール処理中にエラーが発生しました: {str(e)}", color=discord.Color.red())
-            try:
-                await interaction.edit_original_response(embed=error_embed, view=None)
-            except discord.errors.NotFound:
-                await interaction.followup.send(embed=error_embed, ephemeral=True)
-        finally:
-            self.stop()
+                    logger.warning(f"Reroll: Failed to update effect for item {target_id} for user {user_id}.")
+                    raise RerollError("リロール対象のアイテムの効果更新に失敗しました。")
+            # 装備中のアイテムの効果が変わった場合に備えて、キャッシュした ATK/DEF を捨てる
+            rpg_cog.profile_cache.invalidate_equipment(user_id, guild_id)
+
+        async with rpg_cog.bot.db.read() as conn:
+            async with conn.execute("SELECT item_id FROM inventory WHERE inventory_id = ?", (target_id,)) as cursor:
+                rerolled_row = await cursor.fetchone()
+        new_effect = CATALOG.get_effect(new_effect_id)
+        rerolled_item = CATALOG.get_item(rerolled_row[0]) if rerolled_row else None
+        rerolled_full_name = f"{new_effect.prefix_name}{rerolled_item.base_name}" if rerolled_item else "不明なアイテム"
+
+        embed = discord.Embed(
+            title="効果を更新",
+            description=f"アイテム「{rerolled_full_name}」の効果を **{new_effect.prefix_name}** (効果レアリティ: {new_effect.rarity}) に更新しました！\n"
+                        f"（{action.payload['base_rarity']}装備{REROLL_CONSUME_COUNT}個を消費）",
+            color=discord.Color.green()
+        )
+        await interaction.edit_original_response(embed=embed, view=None)
+    except RerollError as e:
+        # 利用者の操作による失敗なのでトレースバックは残さない (トランザクションは巻き戻し済み)
+        logger.info(f"Reroll select rejected for user {user_id}: {e}")
+        await _show_reroll_error(interaction, discord.Embed(title="エラー", description=str(e), color=discord.Color.red()))
+    except Exception as e:
+        logger.error(f"Reroll select error: {e}", exc_info=True)
+        error_embed = discord.Embed(title="エラー", description=f"リロール処理中にエラーが発生しました: {str(e)}", color=discord.Color.red())
+        await _show_reroll_error(interaction, error_embed)
+
+
+async def _show_reroll_error(interaction: discord.Interaction, embed: discord.Embed):
+    try:
+        await interaction.edit_original_response(embed=embed, view=None)
+    except discord.errors.NotFound:
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+class RerollAutoConfirmView(StaticView):
+    """/vreroll のまとめて再抽選の確認画面。条件と消費候補は pending_actions の "reroll_auto" に置く。"""
+    def __init__(self, token: int, interaction_user_id: int):
+        super().__init__(
+            discord.ui.Button(label="再抽選する", style=discord.ButtonStyle.green,
+                              custom_id=component_id("reroll_auto", interaction_user_id, token)),
+            discord.ui.Button(label="キャンセル", style=discord.ButtonStyle.red,
+                              custom_id=component_id("reroll_auto_cancel", interaction_user_id, token)),
+        )
+
+
+@ROUTES.route("reroll_auto", owner_message="この操作はコマンドを実行した本人のみ可能です。")
+async def _reroll_auto_confirm(rpg_cog: 'RPG', interaction: discord.Interaction, token: str):
+    await interaction.response.defer(ephemeral=True)
+    try:
+        embed = await rpg_cog.execute_auto_reroll(interaction, int(token))
+        if embed is None:
+            embed = discord.Embed(title="タイムアウト", description="時間切れのため再抽選をキャンセルしました。", color=discord.Color.light_grey())
+    except Exception as e:
+        logger.error(f"Error in auto reroll confirm: {e}", exc_info=True)
+        embed = discord.Embed(title="エラー", description="再抽選の処理中にエラーが発生しました。", color=discord.Color.red())
+    try:
+        await interaction.edit_original_response(embed=embed, view=None)
+    except discord.errors.NotFound:
+        pass
+
+
+@ROUTES.route("reroll_auto_cancel", owner_message="この操作はコマンドを実行した本人のみ可能です。")
+async def _reroll_auto_cancel(rpg_cog: 'RPG', interaction: discord.Interaction, token: str):
+    await rpg_cog.pending_actions.discard(int(token), "reroll_auto")
+    embed = discord.Embed(title="キャンセル", description="効果の再抽選をキャンセルしました。", color=discord.Color.red())
+    await interaction.response.edit_message(embed=embed, view=None)
 
 class InventoryEmbedView(discord.ui.View):
-    def __init__(self, items_data: List, items_per_page: int, user_name: str, inventory_limit: int, gold: int, rarity_probabilities: dict,
-                 initial_interaction: discord.Interaction, current_sort_order="id_asc", is_ephemeral=False, user_avatar_url=None):
+    """
+    /vinventory の表示。並べ替えとフィルターは SQL 側で行い、表示中のページだけを読み込む。
+    ページ送りはキーセット方式で、各ページの開始位置 (直前のページの最後の行) を積んでおき「前へ」で戻る。
+    """
+    def __init__(self, bot, user_id: int, guild_id: int, items_per_page: int, user_name: str, inventory_limit: int, gold: int,
+                 rarity_probabilities: dict, initial_interaction: discord.Interaction, current_sort_order=DEFAULT_SORT,
+                 item_filter: InventoryFilter = InventoryFilter(), is_ephemeral=False, user_avatar_url=None):
         super().__init__(timeout=180)
-        self.all_items_data_orig = list(items_data)
+        self.bot = bot
+        self.user_id = user_id
+        self.guild_id = guild_id
         self.items_per_page = items_per_page
         self.user_name = user_name
         self.user_avatar_url = user_avatar_url
@@ -304,36 +454,34 @@ class InventoryEmbedView(discord.ui.View):
         self.total_rarity_weight = TOTAL_RARITY_WEIGHT
         self.interaction_to_edit = initial_interaction
         self.current_sort_order = current_sort_order
+        self.item_filter = item_filter
         self.is_ephemeral = is_ephemeral
-        self.sorted_items_data = []
 
-        self.current_page = 0
-        self._sort_items()
-        self.total_pages = (len(self.sorted_items_data) - 1) // self.items_per_page + 1
-        if self.total_pages == 0: self.total_pages = 1
+        self.total_count = 0
+        self.matching_count = 0
+        self.page_items: List[InventoryRow] = []
+        self.has_next_page = False
+        # page_cursors[i] はページ i の開始位置 (最初のページは None)
+        self.page_cursors: List[Optional[PageCursor]] = [None]
 
         self.prev_button = discord.ui.Button(label="◀ 前へ", style=discord.ButtonStyle.grey, disabled=True, row=0)
         self.prev_button.callback = self.prev_page_callback
         self.add_item(self.prev_button)
 
-        self.page_label = discord.ui.Button(label=f"1/{self.total_pages}", style=discord.ButtonStyle.secondary, disabled=True, row=0)
+        self.page_label = discord.ui.Button(label="1/1", style=discord.ButtonStyle.secondary, disabled=True, row=0)
         self.add_item(self.page_label)
 
-        self.next_button = discord.ui.Button(label="次へ ▶", style=discord.ButtonStyle.grey, disabled=self.total_pages <= 1, row=0)
+        self.next_button = discord.ui.Button(label="次へ ▶", style=discord.ButtonStyle.grey, disabled=True, row=0)
         self.next_button.callback = self.next_page_callback
         self.add_item(self.next_button)
 
-        self.sort_id_button = discord.ui.Button(label="ID順", style=discord.ButtonStyle.primary if current_sort_order=="id_asc" else discord.ButtonStyle.secondary, row=1)
-        self.sort_id_button.callback = self.sort_by_id_callback
-        self.add_item(self.sort_id_button)
-
-        self.sort_rarity_asc_button = discord.ui.Button(label="レア度昇順", style=discord.ButtonStyle.primary if current_sort_order=="rarity_asc" else discord.ButtonStyle.secondary, row=1)
-        self.sort_rarity_asc_button.callback = self.sort_by_rarity_asc_callback
-        self.add_item(self.sort_rarity_asc_button)
-
-        self.sort_rarity_desc_button = discord.ui.Button(label="レア度降順", style=discord.ButtonStyle.primary if current_sort_order=="rarity_desc" else discord.ButtonStyle.secondary, row=1)
-        self.sort_rarity_desc_button.callback = self.sort_by_rarity_desc_callback
-        self.add_item(self.sort_rarity_desc_button)
+        # ボタンの表示名は /vinventory の sort の選択肢と同じ SORT_ORDERS の label を使う
+        self.sort_buttons = {}
+        for sort_order, spec in SORT_ORDERS.items():
+            button = discord.ui.Button(label=spec.label, style=discord.ButtonStyle.secondary, row=1)
+            button.callback = self._make_sort_callback(sort_order)
+            self.add_item(button)
+            self.sort_buttons[sort_order] = button
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if interaction.user.id != self.interaction_to_edit.user.id:
@@ -341,17 +489,21 @@ class InventoryEmbedView(discord.ui.View):
             return False
         return True
 
-    def _sort_items(self):
-        """Sorts the items based on the current_sort_order."""
-        if self.current_sort_order == "rarity_asc":
-            self.sorted_items_data = sorted(self.all_items_data_orig, key=lambda x: (RARITY_ORDER.get(x[3], 0) + RARITY_ORDER.get(x[6], 0), x[0]))
-        elif self.current_sort_order == "rarity_desc":
-            self.sorted_items_data = sorted(self.all_items_data_orig, key=lambda x: (RARITY_ORDER.get(x[3], 0) + RARITY_ORDER.get(x[6], 0), -x[0]), reverse=True)
-        else:
-            self.sorted_items_data = sorted(self.all_items_data_orig, key=lambda x: x[0])
-        self.current_page = 0
-        self.total_pages = (len(self.sorted_items_data) - 1) // self.items_per_page + 1
-        if self.total_pages == 0: self.total_pages = 1
+    @property
+    def current_page(self) -> int:
+        return len(self.page_cursors) - 1
+
+    @property
+    def total_pages(self) -> int:
+        return max(1, (self.matching_count - 1) // self.items_per_page + 1)
+
+    async def _load_page(self):
+        """現在のページの開始位置から1ページ分と件数だけを読み込む。"""
+        async with self.bot.db.read() as conn:
+            self.total_count, self.matching_count = await count_inventory(conn, self.user_id, self.guild_id, self.item_filter)
+            self.page_items, self.has_next_page = await fetch_inventory_page(
+                conn, self.user_id, self.guild_id, self.current_sort_order, self.item_filter,
+                limit=self.items_per_page, after=self.page_cursors[-1])
 
     def _calculate_combined_probability_str(self, item_base_rarity, effect_rarity):
         """Calculates and formats the combined probability string for an item."""
@@ -367,37 +519,34 @@ class InventoryEmbedView(discord.ui.View):
 
     def _create_page_embed(self):
         embed = discord.Embed(
-            title=f"{self.user_name} のインベントリ ({len(self.all_items_data_orig)}/{self.inventory_limit}) - ページ {self.current_page + 1}/{self.total_pages}",
+            title=f"{self.user_name} のインベントリ ({self.total_count}/{self.inventory_limit}) - ページ {self.current_page + 1}/{self.total_pages}",
             color=discord.Color.blue()
         )
         if self.user_avatar_url:
             embed.set_thumbnail(url=self.user_avatar_url)
 
-        sort_map = {"id_asc": "ID昇順", "rarity_asc": "レア度総合昇順", "rarity_desc": "レア度総合降順"}
-        embed.description = f"ソート順: {sort_map.get(self.current_sort_order, 'ID昇順')}"
+        sort_spec = SORT_ORDERS.get(self.current_sort_order, SORT_ORDERS[DEFAULT_SORT])
+        embed.description = f"ソート順: {sort_spec.label}"
+        if self.item_filter.describe():
+            embed.description += f"\n絞り込み: {self.item_filter.describe()} ({self.matching_count}件)"
         embed.add_field(name="所持ゴールド", value=f"{self.gold} ゴールド", inline=False)
 
-        start_index = self.current_page * self.items_per_page
-        end_index = start_index + self.items_per_page
-        page_items_data = self.sorted_items_data[start_index:end_index]
-
-        if not self.sorted_items_data:
+        if not self.total_count:
             embed.add_field(name="アイテム", value="インベントリは空です。", inline=False)
-        elif not page_items_data:
+        elif not self.page_items:
              embed.add_field(name="アイテム", value="このページにアイテムはありません。", inline=False)
         else:
             field_value = ""
             FIELD_VALUE_LIMIT = 1020
             separator = "\n\n"
 
-            for item_data in page_items_data:
-                full_item_name = f"{item_data[5]}{item_data[1]}"
-                combined_prob_str = self._calculate_combined_probability_str(item_data[3], item_data[6])
+            for item in self.page_items:
+                combined_prob_str = self._calculate_combined_probability_str(item.base_rarity, item.effect_rarity)
                 item_str = (
-                    f"**ID: {item_data[0]}** | {full_item_name}\n"
-                    f"　種別: {'武器' if item_data[2] == 'weapon' else '防具'} | 装備レアリティ: {item_data[3]}\n"
-                    f"　効果レアリティ: {item_data[6]} | 出現確率: {combined_prob_str}\n"
-                    f"　ATK: {item_data[8] + item_data[10]} | DEF: {item_data[9] + item_data[11]}"
+                    f"**ID: {item.inventory_id}** | {item.full_name}\n"
+                    f"　種別: {'武器' if item.item_type == 'weapon' else '防具'} | 装備レアリティ: {item.base_rarity}\n"
+                    f"　効果レアリティ: {item.effect_rarity} | 出現確率: {combined_prob_str}\n"
+                    f"　ATK: {item.attack} | DEF: {item.defense}"
                 )
                 if len(field_value) + len(item_str) + (len(separator) if field_value else 0) > FIELD_VALUE_LIMIT:
                     field_value += "\n...（このページの続きは表示しきれません）"
@@ -405,21 +554,22 @@ class InventoryEmbedView(discord.ui.View):
                 if field_value:
                     field_value += separator
                 field_value += item_str
-            embed.add_field(name=f"アイテム (表示数: {len(page_items_data)})", value=field_value if field_value else "なし", inline=False)
+            embed.add_field(name=f"アイテム (表示数: {len(self.page_items)})", value=field_value if field_value else "なし", inline=False)
         return embed
 
-    async def _update_view_and_buttons(self, interaction: discord.Interaction):
-        if not interaction.response.is_done():
-            await interaction.response.defer(ephemeral=self.is_ephemeral)
-
+    def _sync_buttons(self):
         self.prev_button.disabled = self.current_page == 0
-        self.next_button.disabled = self.current_page >= self.total_pages - 1
+        self.next_button.disabled = not self.has_next_page
         self.page_label.label = f"{self.current_page + 1}/{self.total_pages}"
+        for sort_order, button in self.sort_buttons.items():
+            button.style = discord.ButtonStyle.primary if self.current_sort_order == sort_order else discord.ButtonStyle.secondary
 
-        self.sort_id_button.style = discord.ButtonStyle.primary if self.current_sort_order == "id_asc" else discord.ButtonStyle.secondary
-        self.sort_rarity_asc_button.style = discord.ButtonStyle.primary if self.current_sort_order == "rarity_asc" else discord.ButtonStyle.secondary
-        self.sort_rarity_desc_button.style = discord.ButtonStyle.primary if self.current_sort_order == "rarity_desc" else discord.ButtonStyle.secondary
+    async def _update_view_and_buttons(self, interaction: discord.Interaction):
+        if not interaction.response.is_done():
+            await interaction.response.defer(ephemeral=self.is_ephemeral)
 
+        await self._load_page()
+        self._sync_buttons()
 
         embed = self._create_page_embed()
         try:
@@ -436,33 +586,27 @@ class InventoryEmbedView(discord.ui.View):
 
     async def prev_page_callback(self, interaction: discord.Interaction):
         if self.current_page > 0:
-            self.current_page -= 1
+            self.page_cursors.pop()
         await self._update_view_and_buttons(interaction)
 
     async def next_page_callback(self, interaction: discord.Interaction):
-        if self.current_page < self.total_pages - 1:
-            self.current_page += 1
-        await self._update_view_and_buttons(interaction)
-
-    async def sort_by_id_callback(self, interaction: discord.Interaction):
-        self.current_sort_order = "id_asc"
-        self._sort_items()
+        if self.has_next_page and self.page_items:
+            self.page_cursors.append(cursor_for(self.page_items[-1], self.current_sort_order))
         await self._update_view_and_buttons(interaction)
 
-    async def sort_by_rarity_asc_callback(self, interaction: discord.Interaction):
-        self.current_sort_order = "rarity_asc"
-        self._sort_items()
-        await self._update_view_and_buttons(interaction)
-
-    async def sort_by_rarity_desc_callback(self, interaction: discord.Interaction):
-        self.current_sort_order = "rarity_desc"
-        self._sort_items()
-        await self._update_view_and_buttons(interaction)
+    def _make_sort_callback(self, sort_order: str):
+        async def callback(interaction: discord.Interaction):
+            self.current_sort_order = sort_order
+            self.page_cursors = [None]
+            await self._update_view_and_buttons(interaction)
+        return callback
 
     async def send_initial_message(self):
         """Sends the initial inventory message with the view."""
-        embed = self._create_page_embed()
         try:
+            await self._load_page()
+            self._sync_buttons()
+            embed = self._create_page_embed()
             await self.interaction_to_edit.followup.send(embed=embed, view=self, ephemeral=self.is_ephemeral)
         except Exception as e:
             logger.error(f"Error sending initial inventory message for {self.user_name}: {e}", exc_info=True)
@@ -473,10 +617,20 @@ class InventoryEmbedView(discord.ui.View):
                 logger.error(f"Failed to send error fallback for initial inventory for {self.user_name}: {e2}", exc_info=True)
 
 class BattleView(discord.ui.View):
-    def __init__(self, battle_session: 'BattleSession'):
-        super().__init__(timeout=300)
+    def __init__(self, battle_session: 'BattleSession', timeout: Optional[float] = BATTLE_IDLE_TIMEOUT_SECONDS):
+        super().__init__(timeout=timeout)
         self.battle_session = battle_session
-        self.message: Optional[discord.WebhookMessage] = None
+        self.message: Optional[discord.PartialMessage] = None
+        # 再起動後も bot.add_view で復元できるよう、custom_id にプレイヤーIDを含める
+        for action, button in (("attack", self.attack_button), ("defend", self.defend_button), ("flee", self.flee_button)):
+            button.custom_id = f"battle:{action}:{battle_session.player_id}"
+
+    def sync_buttons(self):
+        """プレイヤーのターン以外はボタンを押せないようにする。"""
+        disabled = self.battle_session.current_turn != "player" or self.battle_session.is_battle_over
+        for item in self.children:
+            if isinstance(item, discord.ui.Button):
+                item.disabled = disabled
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if interaction.user.id != self.battle_session.player_id:
@@ -494,19 +648,7 @@ class BattleView(discord.ui.View):
             return
 
         await interaction.response.defer()
-
-        for item in self.children:
-            if isinstance(item, discord.ui.Button):
-                item.disabled = True
-        if self.message:
-            try:
-                await self.message.edit(view=self)
-            except discord.NotFound:
-                logger.warning(f"BattleView: Message for disabling buttons not found (ID: {self.message.id})")
-            except Exception as e_edit:
-                 logger.error(f"BattleView: Error disabling buttons on message edit: {e_edit}", exc_info=True)
-
-
+        # ボタンの無効化は行動後の再描画と一緒に反映される
         await self.battle_session.player_action(action_type, interaction)
 
     @discord.ui.button(label="攻撃", style=discord.ButtonStyle.danger, custom_id="battle_attack")
@@ -525,74 +667,48 @@ class BattleView(discord.ui.View):
     async def on_timeout(self):
         if self.message and not self.battle_session.is_battle_over:
             logger.info(f"BattleView timed out for player {self.battle_session.player_id} vs {self.battle_session.enemy_name}. Message ID: {self.message.id}")
-            self.battle_session.battle_log.append(f"{self.battle_session.player_name}は時間切れで行動できなかった...")
-            for item in self.children:
-                if isinstance(item, discord.ui.Button):
-                    item.disabled = True
-            try:
-                timeout_embed = self.battle_session._create_battle_embed()
-                timeout_embed.description = "時間切れで戦闘が終了しました。"
-                timeout_embed.color = discord.Color.light_grey()
-                await self.message.edit(embed=timeout_embed, view=None)
-            except discord.errors.NotFound:
-                logger.warning(f"BattleView timeout: Message (ID: {self.message.id}) not found.")
-            except Exception as e:
-                logger.error(f"BattleView timeout: Error editing message: {e}", exc_info=True)
-
-            rpg_cog = self.battle_session.bot.get_cog("RPG")
-            if rpg_cog and self.battle_session.player_id in rpg_cog.active_battles:
-                del rpg_cog.active_battles[self.battle_session.player_id]
-                logger.info(f"Battle session for {self.battle_session.player_id} removed from active_battles due to View timeout.")
+            await self.battle_session.expire()
         self.stop()
 
-class BattleContinuationView(discord.ui.View):
-    def __init__(self, rpg_cog: 'RPG', interaction_user_id: int):
-        super().__init__(timeout=180)
-        self.rpg_cog = rpg_cog
-        self.interaction_user_id = interaction_user_id
-        self.message: Optional[discord.Message] = None
+class BattleContinuationView(StaticView):
+    """勝利後の「連戦する / 戦闘を終了する」。連戦は issued_at から BATTLE_CONTINUE_TTL_SECONDS の間だけ受け付ける。"""
+    def __init__(self, interaction_user_id: int, issued_at: Optional[int] = None):
+        issued_at = int(time.time()) if issued_at is None else issued_at
+        super().__init__(
+            discord.ui.Button(label="連戦する", style=discord.ButtonStyle.success,
+                              custom_id=component_id("battle_continue", interaction_user_id, issued_at)),
+            discord.ui.Button(label="戦闘を終了する", style=discord.ButtonStyle.danger,
+                              custom_id=component_id("battle_end", interaction_user_id)),
+        )
 
-    async def interaction_check(self, interaction: discord.Interaction) -> bool:
-        if interaction.user.id != self.interaction_user_id:
-            await interaction.response.send_message("この操作は戦闘を行った本人にしかできません。", ephemeral=True)
-            return False
-        return True
 
-    @discord.ui.button(label="連戦する", style=discord.ButtonStyle.success, custom_id="battle_continue")
-    async def continue_battle(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # 修正: 元のメッセージを削除し、新しい「考え中」メッセージを送信
-        if interaction.message:
-            try:
-                await interaction.message.delete()
-            except (discord.NotFound, discord.Forbidden):
-                logger.warning(f"Could not delete previous battle message (ID: {interaction.message.id})")
+@ROUTES.route("battle_continue", owner_message="この操作は戦闘を行った本人にしかできません。")
+async def _battle_continue(rpg_cog: 'RPG', interaction: discord.Interaction, issued_at: str):
+    if time.time() - int(issued_at) > BATTLE_CONTINUE_TTL_SECONDS:
+        embed = interaction.message.embeds[0] if interaction.message and interaction.message.embeds else discord.Embed()
+        embed.description = f"{embed.description or ''}\n\n選択時間が過ぎたため、戦闘は終了しました。"
+        embed.set_footer(text="タイムアウト")
+        embed.color = discord.Color.light_grey()
+        await interaction.response.edit_message(embed=embed, view=None)
+        return
 
-        bot_name = self.rpg_cog.bot.user.display_name if self.rpg_cog.bot.user else "ソフィア"
-        await interaction.response.send_message(f"… {bot_name} が考え中…", ephemeral=False)
+    # 修正: 元のメッセージを削除し、新しい「考え中」メッセージを送信
+    if interaction.message:
+        try:
+            await interaction.message.delete()
+        except (discord.NotFound, discord.Forbidden):
+            logger.warning(f"Could not delete previous battle message (ID: {interaction.message.id})")
 
-        await self.rpg_cog._start_battle_logic(interaction)
-        self.stop()
+    bot_name = rpg_cog.bot.user.display_name if rpg_cog.bot.user else "ソフィア"
+    await interaction.response.send_message(f"… {bot_name} が考え中…", ephemeral=False)
 
-    @discord.ui.button(label="戦闘を終了する", style=discord.ButtonStyle.danger, custom_id="battle_end")
-    async def end_battle(self, interaction: discord.Interaction, button: discord.ui.Button):
-        embed = discord.Embed(title="戦闘終了", description="お疲れ様でした！またの挑戦を待ってるよ！", color=discord.Color.blue())
-        await interaction.response.edit_message(embed=embed, view=None)
-        self.stop()
-    
-    async def on_timeout(self):
-        for item in self.children:
-            if isinstance(item, discord.ui.Button):
-                item.disabled = True
-        if self.message:
-            try:
-                original_embed = self.message.embeds[0]
-                original_embed.description = f"{original_embed.description}\n\n選択時間が過ぎたため、戦闘は終了しました。"
-                original_embed.set_footer(text="タイムアウト")
-                original_embed.color=discord.Color.light_grey()
-                await self.message.edit(embed=original_embed, view=self)
-            except (discord.NotFound, IndexError, discord.HTTPException) as e:
-                logger.warning(f"Could not edit message on BattleContinuationView timeout: {e}")
-        self.stop()
+    await rpg_cog._start_battle_logic(interaction)
+
+
+@ROUTES.route("battle_end", owner_message="この操作は戦闘を行った本人にしかできません。")
+async def _battle_end(rpg_cog: 'RPG', interaction: discord.Interaction):
+    embed = discord.Embed(title="戦闘終了", description="お疲れ様でした！またの挑戦を待ってるよ！", color=discord.Color.blue())
+    await interaction.response.edit_message(embed=embed, view=None)
 
 class GachaSelectView(discord.ui.View):
     """ユーザーにどのガチャを引くか選択させるView。"""
@@ -604,19 +720,28 @@ class GachaSelectView(discord.ui.View):
         self.interaction_user_id = interaction_user_id
         self.message: Optional[discord.WebhookMessage] = None
 
-        for key, info in gacha_settings.items():
-            button = discord.ui.Button(
-                label=f"{info['name']} ({info['cost_single']}G)",
-                style=discord.ButtonStyle.primary,
-                custom_id=f"gacha_select_{key}"
-            )
-            button.callback = self.create_callback(key)
-            self.add_item(button)
+        # ガチャの種類ごとに1行: 単発 / 10連 / 100連
+        for row, (key, info) in enumerate(gacha_settings.items()):
+            for num_draws in (1, 10, 100):
+                if num_draws == 1:
+                    label = f"{info['name']} ({info['cost_single']}G)"
+                    style = discord.ButtonStyle.primary
+                else:
+                    label = f"{num_draws}連 ({info['cost_single'] * num_draws}G)"
+                    style = discord.ButtonStyle.success
+                button = discord.ui.Button(
+                    label=label,
+                    style=style,
+                    custom_id=f"gacha_select_{key}_{num_draws}",
+                    row=row
+                )
+                button.callback = self.create_callback(key, num_draws)
+                self.add_item(button)
 
-    def create_callback(self, gacha_key: str):
+    def create_callback(self, gacha_key: str, num_draws: int = 1):
         async def callback(interaction: discord.Interaction):
             await interaction.response.defer(ephemeral=True, thinking=True)
-            await self.gacha_system.execute_gacha_draw(interaction, gacha_key, 1)
+            await self.gacha_system.execute_gacha_draw(interaction, gacha_key, num_draws)
             self.stop()
         return callback
 
@@ -637,41 +762,121 @@ class GachaSelectView(discord.ui.View):
             pass
         self.stop()
 
-class GachaResultView(discord.ui.View):
-    """ガチャの結果を表示し、アイテムの保管か売却を選択させるView。"""
-    def __init__(self, bot, rpg_cog, user_id, guild_id, drawn_items_details, gacha_name, rarity_probabilities, rarity_weights, total_rarity_weight, sell_prices, inventory_limit):
+class GachaResultView(StaticView):
+    """ガチャの結果に付ける「保管 / 売却」。アイテムは pending_actions の "gacha" に置く。"""
+    def __init__(self, user_id: int, token: int, sell_price: int, disabled: bool = False):
+        super().__init__(
+            discord.ui.Button(label="インベントリに保管", style=discord.ButtonStyle.green, disabled=disabled,
+                              custom_id=component_id("gacha_keep", user_id, token)),
+            discord.ui.Button(label=f"売却 ({sell_price}G)", style=discord.ButtonStyle.danger, disabled=disabled,
+                              custom_id=component_id("gacha_sell", user_id, token)),
+        )
+
+
+async def _disable_gacha_buttons(interaction: discord.Interaction, token: int, sell_price: int):
+    try:
+        await interaction.edit_original_response(view=GachaResultView(interaction.user.id, token, sell_price, disabled=True))
+    except discord.NotFound:
+        pass
+
+
+@ROUTES.route("gacha_keep", owner_message="この操作はガチャを引いた本人のみ可能です。")
+async def _gacha_keep(rpg_cog: 'RPG', interaction: discord.Interaction, token: str):
+    await interaction.response.defer()
+    user_id = interaction.user.id
+    guild_id = interaction.guild.id
+    # 空き確認と追加を同じトランザクションで行い、他の書き込みに割り込まれないようにする
+    async with rpg_cog.user_locks.hold(user_id, guild_id):
+        async with rpg_cog.bot.db.write() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM inventory WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+                count_row = await cursor.fetchone()
+            inventory_full = (count_row[0] if count_row else 0) >= rpg_cog.inventory_limit
+            action = None
+            drop = None
+            if not inventory_full:
+                action = await rpg_cog.pending_actions.claim(int(token), "gacha", conn)
+                if action is not None:
+                    drop = drop_from_ids(action.payload["item_id"], action.payload["effect_id"])
+                if drop is not None:
+                    await conn.execute(
+                        "INSERT INTO inventory (user_id, guild_id, item_id, effect_id) VALUES (?, ?, ?, ?)",
+                        (user_id, guild_id, action.payload["item_id"], action.payload["effect_id"])
+                    )
+    if inventory_full:
+        embed = discord.Embed(title="インベントリが満杯！", description="アイテムを保管できませんでした。インベントリがいっぱいです。", color=discord.Color.red())
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        return
+    if action is None:
+        await interaction.followup.send(DROP_ALREADY_RESOLVED_MESSAGE, ephemeral=True)
+        return
+    if drop is None:
+        await _report_unknown_drop(interaction, action)
+        return
+    embed = discord.Embed(title="保管完了！", description=f"**{drop.full_name}** をインベントリに保管しました。", color=discord.Color.green())
+    await interaction.followup.send(embed=embed, ephemeral=True)
+    await _disable_gacha_buttons(interaction, action.token, drop.sell_price)
+
+
+@ROUTES.route("gacha_sell", owner_message="この操作はガチャを引いた本人のみ可能です。")
+async def _gacha_sell(rpg_cog: 'RPG', interaction: discord.Interaction, token: str):
+    await interaction.response.defer()
+    user_id = interaction.user.id
+    guild_id = interaction.guild.id
+    async with rpg_cog.user_locks.hold(user_id, guild_id):
+        try:
+            async with rpg_cog.bot.db.write() as conn:
+                action = await rpg_cog.pending_actions.claim(int(token), "gacha", conn)
+                drop = drop_from_ids(action.payload["item_id"], action.payload["effect_id"]) if action is not None else None
+                if drop is not None:
+                    await apply_gold(conn, user_id, guild_id, drop.sell_price, "gacha_sell", (drop.ref_id,))
+        except Exception:
+            rpg_cog.profile_cache.invalidate(user_id, guild_id)
+            raise
+        if drop is not None:
+            rpg_cog.profile_cache.adjust_gold(user_id, guild_id, drop.sell_price)
+    if action is None:
+        await interaction.followup.send(DROP_ALREADY_RESOLVED_MESSAGE, ephemeral=True)
+        return
+    if drop is None:
+        await _report_unknown_drop(interaction, action)
+        return
+    embed = discord.Embed(title="売却完了！", description=f"**{drop.full_name}** を売却して **{drop.sell_price}G** を獲得しました。", color=discord.Color.blue())
+    await interaction.followup.send(embed=embed, ephemeral=True)
+    await _disable_gacha_buttons(interaction, action.token, drop.sell_price)
+
+class GachaMultiResultView(discord.ui.View):
+    """連続ガチャの結果をページ送りで表示するView。精算は表示前に完了している。"""
+    def __init__(self, user_id: int, gacha_name: str, results: List, total_cost: int, sold_total: int, sell_prices: dict,
+                 items_per_page: int = 10, requested_draws: Optional[int] = None):
         super().__init__(timeout=180)
-        self.bot = bot
-        self.rpg_cog = rpg_cog
         self.user_id = user_id
-        self.guild_id = guild_id
         self.gacha_name = gacha_name
-        self.rarity_probabilities = rarity_probabilities
-        self.rarity_weights = rarity_weights
-        self.total_rarity_weight = total_rarity_weight
+        self.results = results  # [(item_tuple, kept: bool), ...]
+        self.total_cost = total_cost
+        # 抽選に失敗した回があると results は要求した回数より少ない (支払いも引けた回数分だけ)
+        self.requested_draws = requested_draws if requested_draws is not None else len(results)
+        self.sold_total = sold_total
         self.sell_prices = sell_prices
-        self.inventory_limit = inventory_limit
+        self.items_per_page = items_per_page
+        self.current_page = 0
+        self.total_pages = max(1, (len(results) - 1) // items_per_page + 1)
         self.message: Optional[discord.WebhookMessage] = None
 
-        item_details = drawn_items_details[0]
-        if item_details is None:
-            self.stop()
-            return
-
-        (self.new_item_base_id, self.new_item_base_name, self.new_item_base_rarity,
-         self.new_item_type_display, self.new_effect_id, self.new_effect_name_prefix,
-         self.new_effect_rarity) = item_details
+        self.kept_count = sum(1 for _, kept in results if kept)
+        self.rarity_counts = {}
+        for item, _ in results:
+            self.rarity_counts[item[2]] = self.rarity_counts.get(item[2], 0) + 1
 
-        self.full_item_name = f"{self.new_effect_name_prefix}{self.new_item_base_name}"
+        self.prev_button = discord.ui.Button(label="◀ 前へ", style=discord.ButtonStyle.grey, disabled=True)
+        self.prev_button.callback = self.prev_page_callback
+        self.add_item(self.prev_button)
 
-        self.acquire_button = discord.ui.Button(label="インベントリに保管", style=discord.ButtonStyle.green)
-        self.acquire_button.callback = self.acquire_callback
-        self.add_item(self.acquire_button)
+        self.page_label = discord.ui.Button(label=f"1/{self.total_pages}", style=discord.ButtonStyle.secondary, disabled=True)
+        self.add_item(self.page_label)
 
-        sell_price = self.sell_prices.get(self.new_item_base_rarity, 0)
-        self.sell_button = discord.ui.Button(label=f"売却 ({sell_price}G)", style=discord.ButtonStyle.danger)
-        self.sell_button.callback = self.sell_callback
-        self.add_item(self.sell_button)
+        self.next_button = discord.ui.Button(label="次へ ▶", style=discord.ButtonStyle.grey, disabled=self.total_pages <= 1)
+        self.next_button.callback = self.next_page_callback
+        self.add_item(self.next_button)
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if interaction.user.id != self.user_id:
@@ -679,7 +884,50 @@ class GachaResultView(discord.ui.View):
             return False
         return True
 
-    async def disable_buttons(self, interaction: discord.Interaction):
+    def _create_page_embed(self, user: discord.abc.User) -> discord.Embed:
+        embed = discord.Embed(title=f"ガチャ結果: {self.gacha_name} ×{len(self.results)}", color=discord.Color.gold())
+        embed.set_author(name=user.display_name, icon_url=user.display_avatar.url)
+
+        rarity_summary = " / ".join(
+            f"{rarity}: {self.rarity_counts[rarity]}"
+            for rarity in sorted(self.rarity_counts, key=lambda r: RARITY_ORDER.get(r, 0), reverse=True)
+        )
+        drawn_note = ""
+        if len(self.results) < self.requested_draws:
+            drawn_note = f" ({self.requested_draws}回中{len(self.results)}回分のみ引けたため、その分だけ支払い)"
+        embed.description = (
+            f"支払い: **{self.total_cost}G**{drawn_note}\n"
+            f"保管: **{self.kept_count}個** / 自動売却: **{len(self.results) - self.kept_count}個** (+{self.sold_total}G)\n"
+            f"装備レアリティ内訳: {rarity_summary}"
+        )
+
+        start_index = self.current_page * self.items_per_page
+        lines = []
+        for number, (item, kept) in enumerate(self.results[start_index:start_index + self.items_per_page], start=start_index + 1):
+            _, base_name, base_rarity, type_display, _, effect_prefix, effect_rarity = item
+            outcome = "📦保管" if kept else f"💰売却 {self.sell_prices.get(base_rarity, 0)}G"
+            lines.append(f"`{number:>3}` {effect_prefix}{base_name[:20]} ({type_display} {base_rarity}/{effect_rarity}) - {outcome}")
+        embed.add_field(name=f"結果一覧 ({self.current_page + 1}/{self.total_pages})", value="\n".join(lines)[:1024] or "なし", inline=False)
+        embed.set_footer(text="インベントリに入りきらない分は、レアリティの低いものから自動で売却されます。")
+        return embed
+
+    async def _update_page(self, interaction: discord.Interaction):
+        self.prev_button.disabled = self.current_page == 0
+        self.next_button.disabled = self.current_page >= self.total_pages - 1
+        self.page_label.label = f"{self.current_page + 1}/{self.total_pages}"
+        await interaction.response.edit_message(embed=self._create_page_embed(interaction.user), view=self)
+
+    async def prev_page_callback(self, interaction: discord.Interaction):
+        if self.current_page > 0:
+            self.current_page -= 1
+        await self._update_page(interaction)
+
+    async def next_page_callback(self, interaction: discord.Interaction):
+        if self.current_page < self.total_pages - 1:
+            self.current_page += 1
+        await self._update_page(interaction)
+
+    async def on_timeout(self):
         for item in self.children:
             if isinstance(item, discord.ui.Button):
                 item.disabled = True
@@ -688,70 +936,6 @@ class GachaResultView(discord.ui.View):
                 await self.message.edit(view=self)
         except discord.NotFound:
             pass
-        self.stop()
-
-    async def acquire_callback(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
-        async with self.bot.db.execute("SELECT COUNT(*) FROM inventory WHERE user_id = ? AND guild_id = ?", (self.user_id, self.guild_id)) as cursor:
-            count_row = await cursor.fetchone()
-        current_inventory_count = count_row[0] if count_row else 0
-
-        if current_inventory_count >= self.inventory_limit:
-            embed = discord.Embed(title="インベントリが満杯！", description="アイテムを保管できませんでした。インベントリがいっぱいです。", color=discord.Color.red())
-            await interaction.followup.send(embed=embed, ephemeral=True)
-            await self.disable_buttons(interaction)
-            return
-
-        try:
-            async with transaction(self.bot.db):
-                await self.bot.db.execute(
-                    "INSERT INTO inventory (user_id, guild_id, item_id, effect_id) VALUES (?, ?, ?, ?)",
-                    (self.user_id, self.guild_id, self.new_item_base_id, self.new_effect_id)
-                )
-            embed = discord.Embed(title="保管完了！", description=f"**{self.full_item_name}** をインベントリに保管しました。", color=discord.Color.green())
-            await interaction.followup.send(embed=embed, ephemeral=True)
-        except Exception as e:
-            logger.error(f"GachaResultView acquire error: {e}", exc_info=True)
-            embed = discord.Embed(title="エラー", description="アイテムの保管中にエラーが発生しました。", color=discord.Color.red())
-            await interaction.followup.send(embed=embed, ephemeral=True)
-        finally:
-            await self.disable_buttons(interaction)
-
-    async def sell_callback(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
-        sell_price = self.sell_prices.get(self.new_item_base_rarity, 0)
-
-        try:
-            async with transaction(self.bot.db):
-                await self.bot.db.execute("UPDATE users SET gold = gold + ? WHERE user_id = ? AND guild_id = ?", (sell_price, self.user_id, self.guild_id))
-
-            embed = discord.Embed(title="売却完了！", description=f"**{self.full_item_name}** を売却して **{sell_price}G** を獲得しました。", color=discord.Color.blue())
-            await interaction.followup.send(embed=embed, ephemeral=True)
-        except Exception as e:
-            logger.error(f"GachaResultView sell error: {e}", exc_info=True)
-            embed = discord.Embed(title="エラー", description="アイテムの売却中にエラーが発生しました。", color=discord.Color.red())
-            await interaction.followup.send(embed=embed, ephemeral=True)
-        finally:
-            await self.disable_buttons(interaction)
 
     async def send_initial_message(self, interaction: discord.Interaction):
-        prob_item = (self.rarity_weights.get(self.new_item_base_rarity, 0) / self.total_rarity_weight) if self.total_rarity_weight > 0 else 0
-        prob_effect = (self.rarity_weights.get(self.new_effect_rarity, 0) / self.total_rarity_weight) if self.total_rarity_weight > 0 else 0
-        combined_prob_percent = prob_item * prob_effect * 100
-
-        embed = discord.Embed(
-            title=f"ガチャ結果: {self.gacha_name}",
-            description=(
-                f"{interaction.user.mention}さん、見てみて！こんなのが出たよ！\n\n"
-                f"**{self.full_item_name}**\n"
-                f"　┣ 装備タイプ: {self.new_item_type_display}\n"
-                f"　┣ 装備レアリティ: {self.new_item_base_rarity} ({self.rarity_probabilities.get(self.new_item_base_rarity, 'N/A')})\n"
-                f"　┣ 効果レアリティ: {self.new_effect_rarity} ({self.rarity_probabilities.get(self.new_effect_rarity, 'N/A')})\n"
-                f"　┗ 組み合わせ出現率: {combined_prob_percent:.3f}%\n\n"
-                "このアイテム、どうする？"
-            ),
-            color=discord.Color.gold()
-        )
-        embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
-        embed.set_footer(text="選択肢のタイムアウトは3分です。")
-        self.message = await interaction.followup.send(embed=embed, view=self, ephemeral=False)
+        self.message = await interaction.followup.send(embed=self._create_page_embed(interaction.user), view=self, ephemeral=False)
@@ -0,0 +1,160 @@
+# rpg_xp_buffer.py
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple, TYPE_CHECKING
+
+from rpg_data import CHARS_PER_LEVEL, XP_BUFFER_MAX_ENTRIES, XP_FLUSH_THRESHOLD
+
+if TYPE_CHECKING:
+    from rpg_cache import UserProfileCache
+    from rpg_leaderboard import Leaderboards
+
+logger = logging.getLogger('SophiaBot.XPBuffer')
+
+UserKey = Tuple[int, int]
+
+
+class _XPEntry:
+    __slots__ = ("total_characters", "level", "pending")
+
+    def __init__(self, total_characters: int, level: int):
+        self.total_characters = total_characters
+        self.level = level
+        self.pending = 0
+
+
+class XPAccumulator:
+    """
+    on_message で増えた文字数を (user_id, guild_id) 単位でメモリに溜め、
+    users テーブルへ executemany でまとめて書き込む write-behind バッファ。
+    レベルはメモリ上の値で即時に判定する。
+    """
+
+    def __init__(self, bot, flush_threshold: int = XP_FLUSH_THRESHOLD, max_entries: int = XP_BUFFER_MAX_ENTRIES):
+        self.bot = bot
+        self.flush_threshold = flush_threshold
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[UserKey, _XPEntry]" = OrderedDict()
+        self._dirty: set = set()
+        self._flush_lock = asyncio.Lock()
+        self._threshold_flush_task: Optional[asyncio.Task] = None
+        # 捨てるエントリの最終値を引き継ぐ先 (RPG cog が設定する)
+        self.profile_cache: Optional['UserProfileCache'] = None
+        # レベルと総文字数のランキング (RPG cog が設定する)。メモリ上の値をそのまま反映する
+        self.leaderboards: Optional['Leaderboards'] = None
+
+    def get_cached(self, user_id: int, guild_id: int) -> Optional[Tuple[int, int]]:
+        """メモリ上の (total_characters, level) を返す。未ロードなら None。"""
+        entry = self._entries.get((user_id, guild_id))
+        if entry is None:
+            return None
+        return entry.total_characters, entry.level
+
+    async def _load_entry(self, key: UserKey) -> Optional[_XPEntry]:
+        user_id, guild_id = key
+        async with self.bot.db.read() as conn:
+            async with conn.execute("SELECT total_characters, level FROM users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)) as cursor:
+                row = await cursor.fetchone()
+
+        if row is None:
+            try:
+                async with self.bot.db.write() as conn:
+                    await conn.execute("INSERT OR IGNORE INTO users (user_id, guild_id, total_characters, level, gold) VALUES (?, ?, ?, ?, ?)",
+                                       (user_id, guild_id, 0, 0, 0))
+            except Exception as e:
+                logger.error(f"Failed to register new user {user_id} in guild {guild_id}: {e}", exc_info=True)
+                return None
+            row = (0, 0)
+
+        # await 中に別のメッセージが先にロードしていればそちらを使う
+        existing = self._entries.get(key)
+        if existing is not None:
+            return existing
+        entry = _XPEntry(row[0] or 0, row[1] or 0)
+        self._entries[key] = entry
+        return entry
+
+    async def add_characters(self, user_id: int, guild_id: int, char_count: int) -> Optional[Tuple[int, int]]:
+        """
+        文字数を加算し、(加算前のレベル, 加算後のレベル) を返す。
+        ユーザーの登録に失敗した場合は None。
+        """
+        key = (user_id, guild_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = await self._load_entry(key)
+            if entry is None:
+                return None
+        else:
+            self._entries.move_to_end(key)
+
+        old_level = entry.level
+        entry.total_characters += char_count
+        entry.pending += char_count
+        entry.level = entry.total_characters // CHARS_PER_LEVEL
+        self._dirty.add(key)
+        if self.leaderboards is not None:
+            self.leaderboards.update(user_id, guild_id, total_characters=entry.total_characters, level=entry.level)
+
+        if len(self._dirty) >= self.flush_threshold and (self._threshold_flush_task is None or self._threshold_flush_task.done()):
+            self._threshold_flush_task = asyncio.create_task(self.flush())
+        return old_level, entry.level
+
+    async def flush(self) -> int:
+        """溜まっている差分を一つのトランザクションで書き込む。書き込んだユーザー数を返す。"""
+        async with self._flush_lock:
+            if not self._dirty or not self.bot.db:
+                return 0
+
+            batch = []
+            for key in self._dirty:
+                entry = self._entries.get(key)
+                if entry is None or entry.pending == 0:
+                    continue
+                batch.append((key, entry.pending))
+                entry.pending = 0
+            self._dirty.clear()
+            if not batch:
+                return 0
+
+            params = [(delta, delta, CHARS_PER_LEVEL, user_id, guild_id) for (user_id, guild_id), delta in batch]
+            try:
+                async with self.bot.db.write() as conn:
+                    await conn.executemany(
+                        "UPDATE users SET total_characters = total_characters + ?, level = (total_characters + ?) / ? WHERE user_id = ? AND guild_id = ?",
+                        params
+                    )
+            except Exception as e:
+                logger.error(f"Failed to flush XP buffer ({len(batch)} users): {e}", exc_info=True)
+                # 失敗した差分は次回のフラッシュで再送する
+                for key, delta in batch:
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        entry.pending += delta
+                        self._dirty.add(key)
+                return 0
+
+            self._evict_clean_entries()
+            logger.debug(f"Flushed XP buffer for {len(batch)} users.")
+            return len(batch)
+
+    def _evict_clean_entries(self):
+        """上限を超えた分、古い順に未変更のエントリを捨てる。"""
+        overflow = len(self._entries) - self.max_entries
+        if overflow <= 0:
+            return
+        for key in list(self._entries.keys()):
+            if overflow <= 0:
+                break
+            if key in self._dirty:
+                continue
+            entry = self._entries.pop(key)
+            if self.profile_cache is not None:
+                self.profile_cache.set_fields(key[0], key[1], total_characters=entry.total_characters, level=entry.level)
+            overflow -= 1
+
+    def clear(self):
+        """未書き込みの差分も含めて全て破棄する (RPGデータのリセット用)。"""
+        self._entries.clear()
+        self._dirty.clear()
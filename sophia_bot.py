@@ -11,9 +11,10 @@ from typing import Dict, Set, Optional, List, Any
 import re
 from concurrent.futures import ThreadPoolExecutor
 import aiohttp
-import aiosqlite
 import sys
 
+from rpg_db import RPGDatabase, open_database
+
 # ログ設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
 logger = logging.getLogger('SophiaBot')
@@ -46,7 +47,7 @@ class SophiaBot(commands.Bot):
         self.trigger_words = ["ソフィア", "ソフィ", "そふぃ", r"¯\_(ツ)_/¯"]
         self.executor = ThreadPoolExecutor(max_workers=5)
         self.http_session: Optional[aiohttp.ClientSession] = None
-        self.db: Optional[aiosqlite.Connection] = None
+        self.db: Optional[RPGDatabase] = None
         try:
             main_script_path = os.path.dirname(os.path.abspath(sys.modules['__main__'].__file__))
         except (AttributeError, KeyError):
@@ -101,7 +102,7 @@ class SophiaBot(commands.Bot):
         rpg_db_file_path = os.path.join(main_script_path, 'rpg_database.db')
         logger.info(f"RPGデータベースファイルのパス: {rpg_db_file_path}")
         try:
-            self.db = await aiosqlite.connect(rpg_db_file_path)
+            self.db = await open_database(rpg_db_file_path)
             logger.info("RPGデータベースに接続しました。")
         except Exception as e:
             logger.error(f"RPGデータベースへの接続に失敗しました: {e}", exc_info=True)
@@ -133,6 +134,12 @@ class SophiaBot(commands.Bot):
         logger.info("ボットをシャットダウンしています...")
         if self.executor: self.executor.shutdown(wait=True); logger.info("ThreadPoolExecutorをシャットダウンしました。")
         if self.http_session and not self.http_session.closed: await self.http_session.close(); logger.info("aiohttp.ClientSessionを閉じました。")
+        rpg_cog = self.get_cog("RPG")
+        if self.db and rpg_cog and hasattr(rpg_cog, 'xp_buffer'):
+            try:
+                flushed = await rpg_cog.xp_buffer.flush() # type: ignore
+                logger.info(f"未書き込みの経験値をフラッシュしました ({flushed}人分)。")
+            except Exception as e: logger.error(f"経験値バッファのフラッシュ中にエラー: {e}", exc_info=True)
         if self.db: await self.db.close(); logger.info("RPGデータベース接続を閉じました。")
         context_menu_cog = self.get_cog("ContextMenuCog")
         if context_menu_cog and hasattr(context_menu_cog, 'db_conn') and context_menu_cog.db_conn:
@@ -401,7 +408,7 @@ async def restart_sophia(interaction: discord.Interaction):
         rpg_cog = bot.get_cog("RPG")
         if rpg_cog and hasattr(rpg_cog, 'active_battles'):
             rpg_cog.active_battles.clear() # type: ignore
-            logger.info(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] アクティブな戦闘セッションをクリアしました。")
+            logger.info(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] アクティブな戦闘セッションをクリアしました (保存済みの戦闘は起動時に復元されます)。")
         logger.info(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ボットを閉じる準備をしています...")
         await bot.close()
         logger.info(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ボットを正常に閉じました。プログラムを終了します。")
@@ -0,0 +1,184 @@
+import asyncio
+import contextlib
+import random
+
+import pytest
+
+from rpg_leaderboard import GuildLeaderboard, Leaderboards, RankEntry, RankedSkipList
+
+
+def _skip_list(keys, seed=0):
+    skip_list = RankedSkipList(random.Random(seed))
+    for key in keys:
+        skip_list.insert(key)
+    return skip_list
+
+
+def test_skip_list_keeps_keys_sorted():
+    keys = [(-5, 3), (-9, 1), (-5, 1), (0, 7), (-7, 2)]
+    skip_list = _skip_list(keys)
+    assert len(skip_list) == len(keys)
+    assert list(skip_list.iter_from(0)) == sorted(keys)
+
+
+def test_skip_list_count_less():
+    skip_list = _skip_list([(-9, 1), (-5, 1), (-5, 3), (0, 7)])
+    assert skip_list.count_less((-10, 0)) == 0
+    assert skip_list.count_less((-5, -1)) == 1
+    assert skip_list.count_less((-5, 3)) == 2
+    assert skip_list.count_less((1, 0)) == 4
+
+
+@pytest.mark.parametrize("index", [0, 1, 5, 49])
+def test_skip_list_iter_from_offset(index):
+    keys = [(-v, v) for v in range(50)]
+    skip_list = _skip_list(keys)
+    assert list(skip_list.iter_from(index)) == sorted(keys)[index:]
+
+
+@pytest.mark.parametrize("index", [-1, 3, 100])
+def test_skip_list_iter_from_out_of_range(index):
+    skip_list = _skip_list([(-1, 1), (-2, 2), (-3, 3)])
+    assert list(skip_list.iter_from(index)) == []
+
+
+def test_skip_list_remove():
+    skip_list = _skip_list([(-3, 1), (-2, 2), (-1, 3)])
+    assert skip_list.remove((-2, 2))
+    assert not skip_list.remove((-2, 2))
+    assert not skip_list.remove((-9, 9))
+    assert len(skip_list) == 2
+    assert list(skip_list.iter_from(0)) == [(-3, 1), (-1, 3)]
+    assert skip_list.count_less((-1, 3)) == 1
+
+
+def test_skip_list_matches_sorted_list_under_random_operations():
+    rng = random.Random(1234)
+    skip_list = RankedSkipList(random.Random(99))
+    reference = []
+    for _ in range(2000):
+        key = (-rng.randrange(50), rng.randrange(30))
+        if key in reference and rng.random() < 0.5:
+            assert skip_list.remove(key)
+            reference.remove(key)
+        elif key not in reference:
+            skip_list.insert(key)
+            reference.append(key)
+    reference.sort()
+    assert len(skip_list) == len(reference)
+    for index in (0, len(reference) // 2, len(reference) - 1):
+        assert list(skip_list.iter_from(index)) == reference[index:]
+    probe = (-25, 15)
+    assert skip_list.count_less(probe) == sum(1 for key in reference if key < probe)
+
+
+def _board(values):
+    board = GuildLeaderboard()
+    for user_id, value in values.items():
+        board.set(user_id, "gold", value)
+    return board
+
+
+def test_top_uses_competition_ranks_for_ties():
+    board = _board({1: 100, 2: 300, 3: 300, 4: 50, 5: 100, 6: 300})
+    assert board.top("gold", 10) == [
+        RankEntry(1, 2, 300), RankEntry(1, 3, 300), RankEntry(1, 6, 300),
+        RankEntry(4, 1, 100), RankEntry(4, 5, 100),
+        RankEntry(6, 4, 50),
+    ]
+
+
+def test_top_with_offset_starting_inside_a_tie():
+    board = _board({1: 100, 2: 300, 3: 300, 4: 50, 5: 100, 6: 300})
+    # 2ページ目が同点の途中から始まっても、順位は同点の先頭と同じ
+    assert board.top("gold", 2, offset=4) == [RankEntry(4, 5, 100), RankEntry(6, 4, 50)]
+    assert board.top("gold", 2, offset=1) == [RankEntry(1, 3, 300), RankEntry(1, 6, 300)]
+    assert board.top("gold", 5, offset=6) == []
+
+
+def test_rank_of_matches_top():
+    board = _board({1: 100, 2: 300, 3: 300, 4: 50})
+    assert board.rank_of("gold", 3) == RankEntry(1, 3, 300)
+    assert board.rank_of("gold", 1) == RankEntry(3, 1, 100)
+    assert board.rank_of("gold", 4) == RankEntry(4, 4, 50)
+    assert board.rank_of("gold", 99) is None
+    assert board.rank_of("level", 1) is None
+
+
+def test_set_moves_user_to_new_rank():
+    board = _board({1: 100, 2: 200, 3: 300})
+    board.set(1, "gold", 300)
+    assert board.rank_of("gold", 1) == RankEntry(1, 1, 300)
+    assert board.rank_of("gold", 2) == RankEntry(3, 2, 200)
+    board.set(3, "gold", 0)
+    assert [entry.user_id for entry in board.top("gold", 10)] == [1, 2, 3]
+    assert len(board.boards["gold"]) == 3
+
+
+class _SlowCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def fetchall(self):
+        await asyncio.sleep(0.05)
+        return self.rows
+
+    async def fetchone(self):
+        await asyncio.sleep(0.05)
+        return self.rows[0] if self.rows else None
+
+
+class _SlowDatabase:
+    """users の行を少し遅れて返す読み取り専用の DB。"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        rows = self.rows
+
+        class _Connection:
+            def execute(self, *args):
+                return _SlowCursor(rows)
+
+        yield _Connection()
+
+
+class _Bot:
+    def __init__(self, rows):
+        self.db = _SlowDatabase(rows)
+
+
+class _NoCachedXP:
+    def get_cached(self, user_id, guild_id):
+        return None
+
+
+def test_clear_cancels_loads_and_refreshes_in_flight():
+    async def scenario():
+        # (user_id, level, total_characters, gold, power)
+        leaderboards = Leaderboards(_Bot([(1, 5, 100, 50, 10)]), _NoCachedXP())
+        await leaderboards.get(1)
+        leaderboards.refresh_later(1, 1)
+        loading = asyncio.ensure_future(leaderboards.get(2))
+        await asyncio.sleep(0)
+        leaderboards.update(1, 2, gold=999)
+
+        leaderboards.clear()
+        await asyncio.sleep(0.1)
+
+        assert loading.cancelled()
+        assert leaderboards._guilds == {}
+        assert leaderboards._loading == {}
+        assert leaderboards._early == {}
+        assert leaderboards._refresh_tasks == {}
+        assert leaderboards._write_epochs == {}
+
+    asyncio.run(scenario())